@@ -1,10 +1,23 @@
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
+import os
+import re
+import sys
 import numpy as np
 import pandas as pd
 from pathlib import Path
 
 DATA_DIR = Path('data')
+WORKBOOK_PATH = DATA_DIR / '한국투자증권_오픈API_전체문서_20260118_030000.xlsx'
+# 시트별 파싱 결과 캐시: {SPEC_CACHE_DIR}/{워크북 sha256}/{시트 이름 sha1}.json
+SPEC_CACHE_DIR = DATA_DIR / 'api_spec_cache'
+# 런타임(downloader.kis_decode.SPEC_INDEX_FILE)에서 읽는 TR id 별 요약. 실행 위치와 상관없이 같은 파일을 쓴다.
+SPEC_INDEX_PATH = Path(__file__).resolve().parents[2] / 'dashboard' / 'data' / 'KIS' / 'api_spec_index.json'
+
+# 한 작업 프로세스가 한 번에 처리하는 시트 수
+SHEETS_PER_TASK = 16
 
 def read_master_sheet(xls, sheet_name):
     df = pd.read_excel(xls, sheet_name=sheet_name)
@@ -13,13 +26,13 @@ def read_master_sheet(xls, sheet_name):
 def read_api_sheet(xls, sheet_name):
     def parse_params(df):
         params = OrderedDict()
-        for idx, row in df.iterrows():
+        for row in df.to_dict('records'):
             params[row['Element']] = {
                 '한글명': row['한글명'],
                 'Type': row['Type'],
                 'Required': row['Required'],
                 'Length': row['Length'],
-                'Description': row['Description'],} 
+                'Description': row['Description'],}
         return params
 
     columns =['구분', 'Element', '한글명', 'Type', 'Required', 'Length', 'Description']
@@ -27,7 +40,7 @@ def read_api_sheet(xls, sheet_name):
     df = pd.read_excel(xls, sheet_name=sheet_name, header=None, names=columns)
     df['구분'] = df['구분'].ffill()
     df = df.replace({np.nan: None})
-    
+
     # 컬럼 : 6개
     spec = {
         'api_name': df['구분'].iloc[0],
@@ -43,7 +56,7 @@ def read_api_sheet(xls, sheet_name):
         'url': df['Element'].iloc[11],
         'description': df['Element'].iloc[13],
     }
-    
+
     groups = df.iloc[16:].groupby('구분')
     if 'Request Header' in groups.groups:
         spec['request_header'] = parse_params(groups.get_group('Request Header'))
@@ -59,18 +72,137 @@ def read_api_sheet(xls, sheet_name):
         spec['response_example'] = df.iloc[groups.get_group('Response Example').index[0], 1]
     return spec
 
-xls = pd.ExcelFile(DATA_DIR / '한국투자증권_오픈API_전체문서_20260118_030000.xlsx')
-sheet_names = xls.sheet_names
 
-api_specs = dict()
-for sheet_name in sheet_names[1:]:
-    api_specs[sheet_name] = read_api_sheet(xls, sheet_name)
+def get_workbook_hash(path):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def get_sheet_cache_path(workbook_hash, sheet_name):
+    return SPEC_CACHE_DIR / workbook_hash / f"{hashlib.sha1(sheet_name.encode('utf-8')).hexdigest()}.json"
+
+
+def _read_cached_sheet(workbook_hash, sheet_name):
+    path = get_sheet_cache_path(workbook_hash, sheet_name)
+    if not path.exists():
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_cached_sheet(workbook_hash, sheet_name, spec):
+    path = get_sheet_cache_path(workbook_hash, sheet_name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(spec, ensure_ascii=False, default=str))
+    os.replace(tmp_path, path)
+
+
+_worker_xls = None
+
+def _init_worker(workbook_path):
+    # 작업 프로세스마다 워크북을 한 번만 연다
+    global _worker_xls
+    _worker_xls = pd.ExcelFile(workbook_path)
+
+
+def _parse_sheets(workbook_hash, sheet_names):
+    specs = {}
+    for sheet_name in sheet_names:
+        spec = read_api_sheet(_worker_xls, sheet_name)
+        _write_cached_sheet(workbook_hash, sheet_name, spec)
+        specs[sheet_name] = spec
+    return specs
+
+
+def extract_api_specs(workbook_path=WORKBOOK_PATH, max_workers=None):
+    """워크북의 API 시트들을 파싱한다. 캐시에 없는 시트만 프로세스 풀에서 파싱한다.
+
+    Returns:
+        dict: {시트 이름: spec}. 시트 순서를 유지한다.
+    """
+    workbook_hash = get_workbook_hash(workbook_path)
+    sheet_names = pd.ExcelFile(workbook_path).sheet_names[1:]
+
+    api_specs = {sheet_name: _read_cached_sheet(workbook_hash, sheet_name) for sheet_name in sheet_names}
+    missing = [sheet_name for sheet_name, spec in api_specs.items() if spec is None]
+    print(f'{len(sheet_names) - len(missing)} sheets from cache, {len(missing)} sheets to parse.')
+
+    if missing:
+        chunks = [missing[i:i + SHEETS_PER_TASK] for i in range(0, len(missing), SHEETS_PER_TASK)]
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker, initargs=(str(workbook_path),)) as executor:
+            for specs in executor.map(_parse_sheets, [workbook_hash] * len(chunks), chunks):
+                api_specs.update(specs)
+    return api_specs
+
+
+def _split_tr_ids(value):
+    if value is None:
+        return []
+    return [tr_id for tr_id in re.split(r'[\s,/()]+', str(value)) if re.fullmatch(r'[A-Z0-9]{6,}', tr_id)]
+
+
+def _field_types(params):
+    return {str(name).strip(): params[name]['Type'] for name in (params or {}) if name is not None}
+
+
+def _group_response_fields(params):
+    """Response Body 를 {output 이름: {필드: 타입}} 으로 묶는다.
+
+    Object/Array 타입 필드(output, output1, ...)가 나오면 그 뒤의 필드들은 그 output 에 속한다.
+    rt_cd, msg_cd, msg1 처럼 output 앞에 오는 필드는 '' 에 둔다.
+    """
+    groups = {'': {}}
+    current = ''
+    for name, param in (params or {}).items():
+        if name is None:
+            continue
+        name = str(name).strip().lstrip('-').strip()
+        field_type = str(param['Type'] or '')
+        if 'object' in field_type.lower() or 'array' in field_type.lower():
+            current = name
+            groups[current] = {}
+        else:
+            groups[current][name] = field_type
+    return groups
+
+
+def build_spec_index(api_specs):
+    """TR id -> {name, url, method, request, response} 요약을 만든다."""
+    index = {}
+    for spec in api_specs.values():
+        entry = {
+            'name': spec.get('api_name'),
+            'api_id': spec.get('api_id'),
+            'url': spec.get('url'),
+            'method': spec.get('http_method'),
+            'request': _field_types(spec.get('request_body')),
+            'response': _group_response_fields(spec.get('response_body')),
+        }
+        for tr_id in _split_tr_ids(spec.get('real_tr_id')):
+            index[tr_id] = entry
+    return index
+
+
+def main():
+    workbook_path = Path(sys.argv[1]) if len(sys.argv) > 1 else WORKBOOK_PATH
+    api_specs = extract_api_specs(workbook_path)
+
+    with open(DATA_DIR / 'api_specs.json', 'w', encoding='utf-8') as f:
+        f.write(
+            json.dumps(api_specs, ensure_ascii=False, indent=4, default=str)
+        )
+
+    spec_index = build_spec_index(api_specs)
+    SPEC_INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(SPEC_INDEX_PATH, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(spec_index, ensure_ascii=False, separators=(',', ':'), default=str))
+    print(f'{len(spec_index)} TRs written to {SPEC_INDEX_PATH}')
 
-with open(DATA_DIR / 'api_specs.json', 'w', encoding='utf-8') as f:
-    f.write(
-        json.dumps(api_specs, ensure_ascii=False, indent=4)
-    )
 
-# print(sheets)
-# def get_sheet(sheet_name):
-#     return sheets.get(sheet_name)
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import logging
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+# 프로세스 전체에서 캐시에 보관할 최대 크기
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def estimate_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_nbytes(v) for v in value)
+    return 0
+
+
+class FrameCache:
+    """(데이터셋, 기간, ...) 키와 데이터 버전으로 DataFrame 을 보관하는 LRU 캐시.
+
+    버전이 바뀌면(새 데이터가 기록되면) 해당 항목은 버려지고 다시 읽는다.
+    반환되는 DataFrame 은 여러 세션이 공유하므로 제자리 수정(inplace)하지 않아야 한다.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _remove(self, key):
+        _, _, nbytes = self._entries.pop(key)
+        self._nbytes -= nbytes
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, version, value):
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            if nbytes > self.max_bytes:
+                logger.info(f"Not caching {key}: {nbytes} bytes exceeds the cache limit.")
+                return
+            self._entries[key] = (version, value, nbytes)
+            self._nbytes += nbytes
+            while self._nbytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def get_or_load(self, key, version, loader, *args, **kwargs):
+        value = self.get(key, version)
+        if value is None:
+            value = loader(*args, **kwargs)
+            self.put(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+# KIS, ECOS 데이터가 함께 쓰는 캐시
+frame_cache = FrameCache()
@@ -0,0 +1,203 @@
+# 연도별로 파티션된 Parquet 저장소.
+# SQLite 테이블과 같은 데이터를 컬럼 단위로 저장해서, 몇 개 컬럼만 짧은 기간 읽는 경우
+# 필요한 연도 파티션과 컬럼만 읽는다.
+#
+#   {root}/{table_name}/year=YYYY/part-{timestamp}.parquet
+import logging
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow 가 없으면 SQLite 만 사용한다
+    pa = None
+
+
+logger = logging.getLogger(__name__)
+
+
+# 파티션 안의 파일 수가 이 값을 넘으면 하나로 합친다
+COMPACT_FILE_COUNT = 8
+
+# SQLite 에 있던 데이터를 옮겨 두었다는 표시 파일 (table 디렉터리 안)
+BACKFILL_MARKER = '_backfilled'
+
+
+def is_available():
+    return pa is not None
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("pyarrow is required for the parquet storage backend. (pip install pyarrow)")
+
+
+def _arrow_type(dtype):
+    if dtype is not None and np.issubdtype(dtype, np.floating):
+        return pa.float64()
+    if dtype is not None and np.issubdtype(dtype, np.integer):
+        return pa.int64()
+    return pa.string()
+
+
+def build_schema(columns, date_column, dtypes):
+    """날짜 컬럼은 'YYYYMMDD' 문자열, 나머지는 dtypes(KIS_DATASETS 의 dtypes) 를 따른다."""
+    _require_pyarrow()
+    fields = [pa.field(date_column, pa.string())]
+    fields += [pa.field(c, _arrow_type(dtypes.get(c))) for c in columns if c != date_column]
+    return pa.schema(fields)
+
+
+def get_table_dir(root, table_name):
+    return os.path.join(root, table_name)
+
+
+def is_backfilled(root, table_name):
+    return os.path.exists(os.path.join(get_table_dir(root, table_name), BACKFILL_MARKER))
+
+
+def mark_backfilled(root, table_name):
+    table_dir = get_table_dir(root, table_name)
+    os.makedirs(table_dir, exist_ok=True)
+    with open(os.path.join(table_dir, BACKFILL_MARKER), 'w', encoding='utf-8') as f:
+        f.write(time.strftime('%Y-%m-%dT%H:%M:%S'))
+
+
+def _partition_dir(root, table_name, year):
+    return os.path.join(get_table_dir(root, table_name), f'year={year}')
+
+
+def _list_partitions(root, table_name):
+    """{연도: 디렉터리} 를 반환한다."""
+    table_dir = get_table_dir(root, table_name)
+    if not os.path.isdir(table_dir):
+        return {}
+    partitions = {}
+    for name in os.listdir(table_dir):
+        if name.startswith('year='):
+            partitions[name[len('year='):]] = os.path.join(table_dir, name)
+    return partitions
+
+
+def _list_part_files(partition_dir):
+    # 파일 이름에 기록 시각이 들어있으므로 이름순 = 기록 순서
+    return sorted(
+        os.path.join(partition_dir, name) for name in os.listdir(partition_dir) if name.endswith('.parquet')
+    )
+
+
+def _new_part_path(partition_dir, prefix='part'):
+    return os.path.join(partition_dir, f'{prefix}-{time.time_ns():020d}.parquet')
+
+
+def _write_table_atomic(table, path):
+    tmp_path = path + '.tmp'
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _open_dataset(files):
+    # 나중에 컬럼이 추가된 파일이 있어도 모든 컬럼을 읽도록 스키마를 합친다
+    schema = pa.unify_schemas([pq.read_schema(path) for path in files])
+    return ds.dataset(files, schema=schema, format='parquet')
+
+
+def write_columnar(root, table_name, df, date_column, key_columns, dtypes):
+    """df 를 연도별 파티션에 새 파일로 추가한다. 파일이 많아진 파티션은 합친다.
+
+    같은 테이블을 동시에 기록하면 한 파티션을 두 번 합칠 수 있으므로 호출하는 쪽에서 테이블별로 직렬화한다.
+
+    Returns:
+        int: 기록한 행 수
+    """
+    _require_pyarrow()
+    if df is None or df.empty:
+        return 0
+
+    df = df.copy()
+    df[date_column] = df[date_column].astype(str)
+    schema = build_schema(list(df.columns), date_column, dtypes)
+    df = df.astype({field.name: dtypes[field.name] for field in schema if field.name in dtypes})
+
+    for year, df_year in df.groupby(df[date_column].str[:4]):
+        partition_dir = _partition_dir(root, table_name, year)
+        os.makedirs(partition_dir, exist_ok=True)
+        table = pa.Table.from_pandas(df_year, schema=schema, preserve_index=False)
+        _write_table_atomic(table, _new_part_path(partition_dir))
+
+        if len(_list_part_files(partition_dir)) > COMPACT_FILE_COUNT:
+            compact_partition(partition_dir, date_column, key_columns)
+
+    return len(df)
+
+
+def compact_partition(partition_dir, date_column, key_columns):
+    """파티션의 파일들을 하나로 합치고 키가 같은 행은 나중에 기록된 것만 남긴다."""
+    _require_pyarrow()
+    files = _list_part_files(partition_dir)
+    if len(files) < 2:
+        return
+
+    df = _open_dataset(files).to_table().to_pandas()
+    df = df.drop_duplicates(subset=key_columns, keep='last').sort_values(date_column)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # 합친 파일은 기존 파일들보다 이름순으로 뒤에 오도록 새 시각으로 만든다
+    _write_table_atomic(table, _new_part_path(partition_dir))
+    for path in files:
+        os.remove(path)
+    logger.info(f"Compacted {len(files)} files in {partition_dir}.")
+
+
+def read_columnar(root, table_name, date_column, key_columns, begin_date=None, end_date=None, columns=None):
+    """기간에 해당하는 연도 파티션만 열고 요청한 컬럼만 읽는다.
+
+    Args:
+        begin_date (str, optional): 'YYYYMMDD'. None 이면 처음부터.
+        end_date (str, optional): 'YYYYMMDD'. None 이면 끝까지.
+        columns (list, optional): 읽을 컬럼. None 이면 전체 컬럼.
+
+    Returns:
+        pd.DataFrame | None: 저장된 데이터가 없으면 None
+    """
+    _require_pyarrow()
+    partitions = _list_partitions(root, table_name)
+    files = []
+    for year, partition_dir in sorted(partitions.items()):
+        if begin_date is not None and year < begin_date[:4]:
+            continue
+        if end_date is not None and year > end_date[:4]:
+            continue
+        files += _list_part_files(partition_dir)
+    if not partitions:
+        return None
+
+    read_columns = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(key_columns + [date_column] + list(columns)))
+
+    if not files:
+        # 기간에 해당하는 파티션이 없어도 컬럼과 타입은 저장된 스키마를 따른다
+        all_files = [path for partition_dir in partitions.values() for path in _list_part_files(partition_dir)]
+        if not all_files:
+            return None
+        schema = pa.unify_schemas([pq.read_schema(path) for path in all_files])
+        if read_columns is not None:
+            schema = pa.schema([schema.field(c) for c in read_columns if c in schema.names])
+        return schema.empty_table().to_pandas()
+
+    dataset = _open_dataset(files)
+    expression = None
+    if begin_date is not None:
+        expression = ds.field(date_column) >= begin_date
+    if end_date is not None:
+        end_expression = ds.field(date_column) <= end_date
+        expression = end_expression if expression is None else expression & end_expression
+
+    df = dataset.to_table(columns=read_columns, filter=expression).to_pandas()
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+    return df.sort_values(date_column, ascending=False, ignore_index=True)
@@ -0,0 +1,168 @@
+import atexit
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+
+logger = logging.getLogger(__name__)
+
+
+# 연결마다 적용하는 PRAGMA
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 256 * 1024 * 1024
+# 음수는 KiB 단위 (64MB)
+CACHE_SIZE = -64 * 1024
+
+DEFAULT_READ_POOL_SIZE = 4
+# busy_timeout 이후에도 잠겨 있으면 재시도할 횟수
+LOCKED_RETRIES = 3
+
+
+class SQLiteDatabase:
+    """하나의 SQLite 파일에 대한 연결 관리자.
+
+    - WAL 저널 모드로 읽기와 쓰기가 서로를 막지 않는다.
+    - 쓰기는 전용 스레드의 단일 연결에서 큐 순서대로 실행된다.
+    - 읽기는 읽기 전용 연결 풀에서 빌려 쓴다.
+
+    scheduler 스레드와 Streamlit 세션이 같은 파일을 쓰더라도 "database is locked" 가 나지 않도록
+    모든 접근은 read()/write() 를 거친다.
+    """
+
+    def __init__(self, path, read_pool_size=DEFAULT_READ_POOL_SIZE):
+        self.path = str(path)
+        self.read_pool_size = read_pool_size
+        self._read_pool = queue.Queue()
+        self._read_count = 0
+        self._read_lock = threading.Lock()
+        self._write_queue = queue.Queue()
+        self._writer_ready = threading.Event()
+        self._writer_error = None
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._writer = threading.Thread(target=self._run_writer, name=f'sqlite-writer-{os.path.basename(self.path)}', daemon=True)
+        self._writer.start()
+        self._writer_ready.wait()
+        if self._writer_error is not None:
+            raise self._writer_error
+
+    def _apply_pragmas(self, conn):
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size = {CACHE_SIZE}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+    def _connect_writer(self):
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        self._apply_pragmas(conn)
+        return conn
+
+    def _connect_reader(self):
+        uri = f"file:{self.path}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+        self._apply_pragmas(conn)
+        conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    def _run_writer(self):
+        try:
+            conn = self._connect_writer()
+        except sqlite3.Error as e:
+            self._writer_error = e
+            self._writer_ready.set()
+            return
+        self._writer_ready.set()
+
+        while True:
+            task = self._write_queue.get()
+            if task is None:
+                break
+            func, args, kwargs, future = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with conn:
+                    result = func(conn, *args, **kwargs)
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+        conn.close()
+
+    def write(self, func, *args, **kwargs):
+        """func(conn, *args, **kwargs) 를 쓰기 스레드에서 하나의 트랜잭션으로 실행하고 결과를 반환한다."""
+        if threading.current_thread() is self._writer:
+            raise RuntimeError("write() cannot be nested inside another write task.")
+        future = Future()
+        self._write_queue.put((func, args, kwargs, future))
+        return future.result()
+
+    def _acquire_reader(self):
+        try:
+            return self._read_pool.get_nowait()
+        except queue.Empty:
+            pass
+        with self._read_lock:
+            if self._read_count < self.read_pool_size:
+                self._read_count += 1
+                try:
+                    return self._connect_reader()
+                except sqlite3.Error:
+                    self._read_count -= 1
+                    raise
+        return self._read_pool.get()
+
+    def read(self, func, *args, **kwargs):
+        """풀에서 읽기 전용 연결을 빌려 func(conn, *args, **kwargs) 를 실행한다.
+
+        busy_timeout 이 지나도 잠겨 있으면 잠시 쉬었다가 다시 시도한다.
+        """
+        conn = self._acquire_reader()
+        try:
+            for attempt in range(LOCKED_RETRIES + 1):
+                try:
+                    return func(conn, *args, **kwargs)
+                except sqlite3.OperationalError as e:
+                    if 'database is locked' not in str(e) or attempt == LOCKED_RETRIES:
+                        raise
+                    logger.warning(f"{self.path} is locked. Retrying read ({attempt + 1}/{LOCKED_RETRIES}).")
+                    time.sleep(0.1 * 2 ** attempt)
+        finally:
+            self._read_pool.put(conn)
+
+    def close(self):
+        self._write_queue.put(None)
+        self._writer.join()
+        while True:
+            try:
+                self._read_pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path) -> SQLiteDatabase:
+    """경로별로 하나의 SQLiteDatabase 를 공유한다."""
+    path = os.path.abspath(str(path))
+    with _databases_lock:
+        if path not in _databases:
+            _databases[path] = SQLiteDatabase(path)
+        return _databases[path]
+
+
+def close_all_databases():
+    with _databases_lock:
+        for database in _databases.values():
+            database.close()
+        _databases.clear()
+
+
+atexit.register(close_all_databases)
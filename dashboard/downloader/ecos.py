@@ -1,13 +1,19 @@
 import copy
 from typing import List
 import dateutil
-import requests
 import pandas as pd
 from config import config, M2_ITEM_CODES, STOCK_MARKET_FUNDS_ITEM_CODES
+from downloader import http_cache, http_session
+from downloader.cache import frame_cache
+from downloader.trading_calendar import get_calendar
 
 
 BASE_URL = config['ECOS']['BASE_URL']
 API_KEY = config['ECOS']['API_KEY']
+# (연결, 읽기) 타임아웃(초). ECOS 는 조회 범위가 크면 60초 뒤에 TIMEOUT 오류(400)를 돌려준다.
+TIMEOUT = tuple(config['ECOS'].get('TIMEOUT', (5, 65)))
+# ECOS 는 URL 경로에 API 키가 들어가므로 HTTP 캐시 키에서 지운다
+http_cache.register_secret(API_KEY)
 
 
 ECOS_RESPONSE_COLUMNS = {
@@ -129,7 +135,7 @@ def download_ecos_data(service_name: str, url: str, valid_columns:list|None, tim
     total_count = 0
     row_data = []
     while start_index <= total_count or total_count == 0:        
-        r = requests.get(url)
+        r = http_session.get(url, timeout=TIMEOUT)
         if r.status_code == 200:
             data = r.json()
             if data.get(service_name) is None:
@@ -222,6 +228,20 @@ def get_stock_market_funds(from_date:str, to_date:str) -> pd.DataFrame:
     return df_all
     
 
+def get_data_version() -> str:
+    # ECOS 일별 통계는 영업일마다 갱신되므로 마지막 영업일이 바뀌면 새 버전으로 본다 (주말, 휴장일에는 다시 받지 않음)
+    return get_calendar().get_latest_trading_day()
+
+
+def get_cached_ecos_data(function, *args):
+    """function(*args) 결과를 데이터 버전 기준으로 캐시한다.
+
+    인자로 함수를 넘기는 경우(예: 조회 시각을 붙이는 래퍼)에는 함수 이름을 키로 사용한다.
+    """
+    key = ('ecos', function.__name__) + tuple(a.__name__ if callable(a) else a for a in args)
+    return frame_cache.get_or_load(key, get_data_version(), function, *args)
+    
+
 if __name__ == '__main__':
     df = get_stock_market_funds('19830101', '20251101')
     print(df.columns)
@@ -0,0 +1,366 @@
+# KIS, ECOS HTTP 응답의 디스크 캐시.
+#
+# 요청은 method, URL, 파라미터, body 와 몇 가지 header 로 정규화한 뒤 sha256 을 키로 쓴다.
+# API 키처럼 비밀인 값은 정규화할 때 지우므로 키가 바뀌어도 같은 요청으로 본다.
+# 응답 본문은 내용의 sha256 으로 zlib 압축해 저장하므로 같은 응답은 한 번만 저장된다.
+#
+#   {DIR}/entries/{요청 키 앞 2자리}/{요청 키}.json     상태 코드, header, 본문 해시, 저장 시각
+#   {DIR}/objects/{본문 해시 앞 2자리}/{본문 해시}.zz   본문
+#
+# config.toml 의 [HTTP_CACHE] MODE
+#   off: 사용하지 않는다 (기본)
+#   cache: 엔드포인트 분류별 TTL 안에서는 저장된 응답을 쓴다
+#   record: 항상 받아서 저장한다
+#   replay: 저장된 응답만 쓴다. 저장된 응답이 없으면 CacheMissError. 네트워크 없이 대시보드를 실행할 때 사용한다.
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from datetime import date, timedelta
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qsl, urlsplit, urlunsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from config import DATA_DIR, config
+
+
+logger = logging.getLogger(__name__)
+
+
+MODE_OFF = 'off'
+MODE_CACHE = 'cache'
+MODE_RECORD = 'record'
+MODE_REPLAY = 'replay'
+MODES = (MODE_OFF, MODE_CACHE, MODE_RECORD, MODE_REPLAY)
+
+DEFAULT_CACHE_DIR = DATA_DIR / 'http_cache'
+
+# 엔드포인트 분류별 TTL(초). None 은 만료되지 않고 0 은 cache 모드에서 쓰지 않는다 (record/replay 에서만 저장, 사용).
+#   auth: 토큰, 접속키 발급. 어느 모드에서도 저장하지 않는다 (STORE_EXCLUDED_CLASSES).
+#   history: 요청한 가장 최근 날짜가 HISTORY_AFTER_DAYS 보다 오래된 조회. 다시 받아도 바뀌지 않는다.
+#   latest: 최근 날짜가 들어간 조회
+#   quote: 날짜가 없는 KIS 조회 (현재가, 잔고 등). 항상 새로 받는다.
+#   default: 날짜가 없는 그 밖의 조회 (통계표 목록 등)
+ENDPOINT_TTL_SECONDS = {
+    'auth': 0,
+    'history': None,
+    'latest': 10 * 60,
+    'quote': 0,
+    'default': 60 * 60,
+}
+# 응답에 토큰, 접속키가 들어있으므로 디스크에 남기지 않는다
+STORE_EXCLUDED_CLASSES = {'auth'}
+# 주문, hashkey, 토큰 발급 같은 POST 요청은 캐시를 거치지 않는다
+CACHED_METHODS = ('GET',)
+# ECOS 월별 통계는 두 달 정도 늦게 확정되므로 넉넉하게 둔다
+HISTORY_AFTER_DAYS = 120
+
+AUTH_PATHS = ('/oauth2/',)
+KIS_PATHS = ('/uapi/',)
+
+# 키에 포함하는 요청 header. 인증 header 는 넣지 않는다.
+KEY_HEADERS = ('tr_id', 'tr_cont', 'custtype')
+# 키에서 지우는 파라미터, body 필드 (소문자)
+SECRET_FIELDS = {'appkey', 'appsecret', 'secretkey', 'servicekey', 'api_key', 'apikey', 'authorization'}
+SECRET_PLACEHOLDER = '{SECRET}'
+
+# 저장하지 않는 응답 header
+SKIP_RESPONSE_HEADERS = {'set-cookie', 'content-encoding', 'content-length', 'transfer-encoding'}
+
+COMPRESS_LEVEL = 6
+
+
+class CacheMissError(requests.ConnectionError):
+    """replay 모드에서 저장된 응답이 없다. 네트워크 오류와 같이 처리되도록 ConnectionError 를 상속한다."""
+
+
+_secrets = set()
+
+
+def register_secret(value):
+    """URL 경로에 들어가는 API 키 등을 등록한다. 키를 만들 때 SECRET_PLACEHOLDER 로 바뀐다."""
+    if value:
+        _secrets.add(str(value))
+
+
+def _strip_secrets(text):
+    for secret in _secrets:
+        text = text.replace(secret, SECRET_PLACEHOLDER)
+    return text
+
+
+def _normalize_fields(fields):
+    return {
+        str(name): SECRET_PLACEHOLDER if str(name).lower() in SECRET_FIELDS else _strip_secrets(str(value))
+        for name, value in fields
+    }
+
+
+def _normalize_body(data):
+    if data is None:
+        return None
+    if isinstance(data, (dict, list)):
+        body = data
+    else:
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        try:
+            body = json.loads(data)
+        except ValueError:
+            return _strip_secrets(data)
+    if isinstance(body, dict):
+        return _normalize_fields(body.items())
+    return body
+
+
+def normalize_request(method, url, params=None, data=None, headers=None) -> dict:
+    """캐시 키를 만드는 요청 정보. 비밀인 값은 들어가지 않는다."""
+    parts = urlsplit(url)
+    fields = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        fields += list(params.items()) if isinstance(params, dict) else list(params)
+    headers = CaseInsensitiveDict(headers or {})
+    return {
+        'method': method.upper(),
+        'url': _strip_secrets(urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, '', ''))),
+        'params': dict(sorted(_normalize_fields(fields).items())),
+        'body': _normalize_body(data),
+        'headers': {name: headers[name] for name in KEY_HEADERS if headers.get(name)},
+    }
+
+
+def get_request_key(request) -> str:
+    return hashlib.sha256(json.dumps(request, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+_DATE_PATTERN = re.compile(r'(?<![0-9])((?:19|20)[0-9]{2})(0[1-9]|1[0-2])((?:0[1-9]|[12][0-9]|3[01])?)(?![0-9])')
+
+
+def _iter_request_values(request):
+    yield from urlsplit(request['url']).path.split('/')
+    yield from request['params'].values()
+    if isinstance(request['body'], dict):
+        yield from (str(value) for value in request['body'].values())
+
+
+def _find_latest_date(request) -> Optional[date]:
+    """요청의 URL 경로, 파라미터, body 에 들어있는 YYYYMMDD, YYYYMM 값 중 가장 최근 날짜. YYYYMM 은 그 달의 말일."""
+    latest = None
+    for value in _iter_request_values(request):
+        match = _DATE_PATTERN.fullmatch(value)
+        if match is None:
+            continue
+        year, month, day = int(match[1]), int(match[2]), match[3]
+        if day:
+            try:
+                found = date(year, month, int(day))
+            except ValueError:
+                continue
+        else:
+            found = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+        latest = found if latest is None or found > latest else latest
+    return latest
+
+
+def classify_request(request, today=None) -> str:
+    """ENDPOINT_TTL_SECONDS 의 엔드포인트 분류"""
+    if any(path in request['url'] for path in AUTH_PATHS):
+        return 'auth'
+    latest = _find_latest_date(request)
+    if latest is None:
+        return 'quote' if any(path in request['url'] for path in KIS_PATHS) else 'default'
+    today = today or date.today()
+    return 'history' if latest < today - timedelta(days=HISTORY_AFTER_DAYS) else 'latest'
+
+
+class HTTPCache:
+    def __init__(self, directory, mode=MODE_CACHE):
+        if mode not in MODES:
+            raise ValueError(f"Invalid HTTP cache mode: {mode}. Use one of {MODES}.")
+        self.directory = str(directory)
+        self.mode = mode
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, 'entries', key[:2], f'{key}.json')
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.directory, 'objects', content_hash[:2], f'{content_hash}.zz')
+
+    @staticmethod
+    def _write_atomic(path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, request, url=None, max_age=None) -> Optional[requests.Response]:
+        """저장된 응답. 없거나 max_age(초)보다 오래되었으면 None"""
+        key = get_request_key(request)
+        try:
+            with open(self._entry_path(key), encoding='utf-8') as f:
+                entry = json.load(f)
+            if max_age is not None and time.time() - entry['stored_at'] > max_age:
+                entry = None
+            else:
+                with open(self._object_path(entry['content']), 'rb') as f:
+                    content = zlib.decompress(f.read())
+        except (FileNotFoundError, ValueError, zlib.error):
+            entry = None
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            return None
+
+        response = requests.Response()
+        response.status_code = entry['status_code']
+        response.reason = entry.get('reason')
+        response.headers = CaseInsensitiveDict(entry['headers'])
+        response.encoding = entry.get('encoding')
+        response.url = url or request['url']
+        response._content = content
+        return response
+
+    def put(self, request, status_code, headers, content: bytes, encoding='utf-8', reason=None):
+        content_hash = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(content_hash)
+        if not os.path.exists(object_path):
+            self._write_atomic(object_path, zlib.compress(content, COMPRESS_LEVEL))
+        entry = {
+            'request': request,
+            'status_code': status_code,
+            'reason': reason,
+            'headers': {name: value for name, value in headers.items() if name.lower() not in SKIP_RESPONSE_HEADERS},
+            'encoding': encoding,
+            'content': content_hash,
+            'stored_at': time.time(),
+        }
+        self._write_atomic(self._entry_path(get_request_key(request)),
+                           json.dumps(entry, ensure_ascii=False).encode('utf-8'))
+        with self._lock:
+            self.stores += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'mode': self.mode, 'hits': self.hits, 'misses': self.misses, 'stores': self.stores}
+
+
+_cache = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+
+def configure(mode=None, directory=None) -> Optional[HTTPCache]:
+    """캐시 모드와 위치를 정한다. 인자가 없으면 config.toml 의 [HTTP_CACHE] 를 읽는다. off 이면 None"""
+    global _cache, _cache_configured
+    cache_config = config.get('HTTP_CACHE', {})
+    mode = mode or cache_config.get('MODE', MODE_OFF)
+    directory = directory or cache_config.get('DIR') or DEFAULT_CACHE_DIR
+    with _cache_lock:
+        _cache = None if mode == MODE_OFF else HTTPCache(directory, mode)
+        _cache_configured = True
+    if _cache is not None:
+        logger.info(f"HTTP cache is in {mode} mode at {directory}.")
+    return _cache
+
+
+def get_http_cache() -> Optional[HTTPCache]:
+    if not _cache_configured:
+        configure()
+    return _cache
+
+
+class CacheLookup(NamedTuple):
+    cache: HTTPCache
+    request: dict
+    endpoint_class: str
+    response: Optional[requests.Response]
+
+
+def lookup(method, url, params=None, data=None, headers=None) -> Optional[CacheLookup]:
+    """요청에 쓸 수 있는 저장된 응답을 찾는다. 캐시를 사용하지 않거나 GET 이 아니면 None.
+
+    response 가 None 이면 요청을 보낸 뒤 save 로 저장한다. replay 모드에서 없으면 CacheMissError.
+    """
+    cache = get_http_cache()
+    if cache is None or method.upper() not in CACHED_METHODS:
+        return None
+    request = normalize_request(method, url, params, data, headers)
+    endpoint_class = classify_request(request)
+    ttl = ENDPOINT_TTL_SECONDS[endpoint_class]
+
+    response = None
+    if cache.mode == MODE_REPLAY:
+        response = cache.get(request, url)
+        if response is None:
+            raise CacheMissError(f"No recorded response for {method} {request['url']} {request['params']}")
+    elif cache.mode == MODE_CACHE and ttl != 0:
+        response = cache.get(request, url, max_age=ttl)
+    return CacheLookup(cache, request, endpoint_class, response)
+
+
+def get_api_error(content: bytes) -> Optional[str]:
+    """HTTP 200 으로 온 API 오류 코드. 오류가 아니면 None
+
+    KIS 는 rt_cd 가 '0' 이 아니면 오류이고, ECOS 는 오류와 '데이터 없음'을 RESULT.CODE(INFO-200, ERROR-xxx)로 보낸다.
+    """
+    # 본문 전체를 파싱하지 않도록 오류 필드가 있을 때만 읽는다
+    if b'"rt_cd"' not in content and b'"RESULT"' not in content:
+        return None
+    try:
+        body = json.loads(content)
+    except ValueError:
+        return None
+    if not isinstance(body, dict):
+        return None
+    if 'rt_cd' in body and str(body['rt_cd']) != '0':
+        return f"rt_cd={body['rt_cd']} {body.get('msg_cd', '')}".strip()
+    result = body.get('RESULT')
+    if isinstance(result, dict) and result.get('CODE') != 'INFO-000':
+        return str(result.get('CODE'))
+    return None
+
+
+def save(entry: CacheLookup, status_code, headers, content: bytes, encoding='utf-8', reason=None, validate=None):
+    """성공한 응답만 저장한다. TTL 이 0 인 분류는 record 모드에서만 저장하고, STORE_EXCLUDED_CLASSES 는 저장하지 않는다.
+
+    HTTP 200 이어도 본문에 API 오류 코드가 있으면 저장하지 않는다. validate(content) 를 주면 그 결과가 참일 때만 저장한다.
+    """
+    if status_code != 200 or entry.cache.mode == MODE_REPLAY or entry.endpoint_class in STORE_EXCLUDED_CLASSES:
+        return
+    if ENDPOINT_TTL_SECONDS[entry.endpoint_class] == 0 and entry.cache.mode != MODE_RECORD:
+        return
+    error = get_api_error(content)
+    if error is not None:
+        logger.info(f"Not caching {entry.request['url']}: API error {error}")
+        return
+    if validate is not None and not validate(content):
+        return
+    entry.cache.put(entry.request, status_code, headers, content, encoding, reason)
+
+
+def cached_request(send, method, url, **kwargs) -> requests.Response:
+    """send(method, url, **kwargs) 를 캐시를 거쳐 호출한다. http_session.request 가 사용한다."""
+    data = kwargs.get('data')
+    entry = lookup(method, url, kwargs.get('params'), kwargs.get('json') if data is None else data, kwargs.get('headers'))
+    if entry is None:
+        return send(method, url, **kwargs)
+    if entry.response is not None:
+        return entry.response
+    response = send(method, url, **kwargs)
+    save(entry, response.status_code, response.headers, response.content, response.encoding or 'utf-8', response.reason)
+    return response
@@ -0,0 +1,84 @@
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from downloader import http_cache
+
+
+logger = logging.getLogger(__name__)
+
+
+# (연결, 읽기) 타임아웃(초). 호출할 때 timeout= 으로 바꿀 수 있다.
+DEFAULT_TIMEOUT = (5, 30)
+
+# 호스트별로 유지하는 keep-alive 연결 수
+POOL_CONNECTIONS = 8
+POOL_MAXSIZE = 16
+
+# 연결 실패/끊김과 게이트웨이 오류(502, 503, 504)는 backoff 하면서 다시 시도한다.
+# 500 은 KIS 가 업무 오류(호출 한도 초과 포함)에도 사용하므로 호출하는 쪽에서 처리한다.
+RETRY_TOTAL = 3
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUS_FORCELIST = (502, 503, 504)
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def _create_session() -> requests.Session:
+    retry = Retry(
+        total=RETRY_TOTAL,
+        connect=RETRY_TOTAL,
+        read=RETRY_TOTAL,
+        backoff_factor=RETRY_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_FORCELIST,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """프로세스 전체가 공유하는 Session.
+
+    연결 풀(urllib3)은 스레드 안전하고 쿠키 등 세션 상태를 쓰지 않으므로 scheduler 스레드와
+    Streamlit 스레드가 같은 Session 을 함께 사용한다.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def _send(method: str, url: str, **kwargs) -> requests.Response:
+    return get_session().request(method, url, **kwargs)
+
+
+def request(method: str, url: str, timeout=None, **kwargs) -> requests.Response:
+    """[HTTP_CACHE] 설정에 따라 디스크에 저장된 응답을 쓰거나 받은 응답을 저장한다. (downloader.http_cache)"""
+    return http_cache.cached_request(_send, method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
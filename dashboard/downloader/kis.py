@@ -5,6 +5,12 @@ import logging
 import pendulum
 import pandas as pd
 import os
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Tuple
 # from sqlalchemy.types import FLOAT, INTEGER, TEXT, NUMERIC, String
 import numpy as np
 
@@ -19,66 +25,121 @@ parent_dir = os.path.dirname(current_dir)
 data_dir = os.path.join(parent_dir, 'data/downloaded')
 
 kis_database_file_name = os.path.join(data_dir, 'databasees/kis.db')
+columnar_data_dir = os.path.join(data_dir, 'columnar')
+backfill_checkpoint_dir = os.path.join(data_dir, 'backfill')
 
 sys.path.insert(0, parent_dir)
 
 
 DEFAULT_LASTEST_DATE = '19830104'
 
+# 테이블별 날짜 범위(min/max)를 저장하는 메타데이터 테이블
+KIS_TABLE_METADATA = '_kis_table_metadata'
 
-KIS_DATAFRAME_DTYPES = {
-    'domestic_stock_075_investor_daily_by_market': {
-        # 'stck_bsop_date' : datetime 으로 이미 변환되었기 때문에 생략
-        # 'stck_bsop_date': str,
-        'bstp_nmix_prpr': np.float64,
-        'bstp_nmix_prdy_vrss': np.float64,
-        'prdy_vrss_sign': np.float64,
-        'bstp_nmix_prdy_ctrt': np.float64,
-        'bstp_nmix_oprc': np.float64,
-        'bstp_nmix_hgpr': np.float64,
-        'bstp_nmix_lwpr': np.float64,
-        'stck_prdy_clpr': np.float64,
-        'frgn_ntby_qty': np.float64,
-        'frgn_reg_ntby_qty': np.float64,
-        'frgn_nreg_ntby_qty': np.float64,
-        'prsn_ntby_qty': np.float64,
-        'orgn_ntby_qty': np.float64,
-        'scrt_ntby_qty': np.float64,
-        'ivtr_ntby_qty': np.float64,
-        'pe_fund_ntby_vol': np.float64,
-        'bank_ntby_qty': np.float64,
-        'insu_ntby_qty': np.float64,
-        'mrbn_ntby_qty': np.float64,
-        'fund_ntby_qty': np.float64,
-        'etc_ntby_qty': np.float64,
-        'etc_orgt_ntby_vol': np.float64,
-        'etc_corp_ntby_vol': np.float64,
-        'frgn_ntby_tr_pbmn': np.float64,
-        'frgn_reg_ntby_pbmn': np.float64,
-        'frgn_nreg_ntby_pbmn': np.float64,
-        'prsn_ntby_tr_pbmn': np.float64,
-        'orgn_ntby_tr_pbmn': np.float64,
-        'scrt_ntby_tr_pbmn': np.float64,
-        'ivtr_ntby_tr_pbmn': np.float64,
-        'pe_fund_ntby_tr_pbmn': np.float64,
-        'bank_ntby_tr_pbmn': np.float64,
-        'insu_ntby_tr_pbmn': np.float64,
-        'mrbn_ntby_tr_pbmn': np.float64,
-        'fund_ntby_tr_pbmn': np.float64,
-        'etc_ntby_tr_pbmn': np.float64,
-        'etc_orgt_ntby_tr_pbmn': np.float64,
-        'etc_corp_ntby_tr_pbmn': np.float64,
-    }
-}
+# 테이블별로 KIS API 에서 받아 본 날짜 구간을 저장하는 테이블. 빈 응답이었던 날도 포함된다.
+KIS_TABLE_COVERAGE = '_kis_table_coverage'
+
+# repair_data 가 한 번에 다시 받는 최대 구간 수. 나머지는 다음 호출에서 받는다.
+REPAIR_MAX_RANGES = 100
+
+# 받은 페이지를 기록하기 전까지 보관하는 최대 페이지 수
+INGEST_QUEUE_SIZE = 4
 
+# backfill 할 때 한 번에 받는 구간 길이(일)와 동시에 받는 구간 수
+BACKFILL_WINDOW_DAYS = 365
+BACKFILL_MAX_WORKERS = 4
 
+# 데이터셋을 KIS API 로 다시 조회하기까지의 기본 최소 간격(초). scheduler 는 한 시간마다 실행된다.
+DEFAULT_REFRESH_SECONDS = 30 * 60
+
+
+from config import DATE_PRESETS, config
+from downloader.cache import frame_cache
+from downloader.database import get_database
+import downloader.columnar as columnar
 import downloader.kis_auth as ka
+import downloader.kis_decode as kis_decode
+from downloader.trading_calendar import get_calendar
 from downloader.kis_samples.domestic_stock.domestic_stock_functions import *
 
+
+# 데이터셋(테이블) 등록 정보. 새 TR 은 여기에 추가한다.
+#   function: 조회 함수. kwargs 로 호출하면 한 페이지를 DataFrame 으로 반환한다. 오류 응답이면 예외를 던진다.
+#   kwargs: function 인자. 문자열 안의 {query_begin_date}, {oldest_date} 는 조회할 때 채운다.
+#   date_column: 날짜(YYYYMMDD) 컬럼
+#   key_columns: 고유 키. 같은 키의 행은 덮어쓴다. (기본: date_column)
+#   dtypes: 날짜 컬럼을 제외한 컬럼별 타입 (기본: 모두 문자열)
+#   paging: 페이지를 넘기는 방법. PAGING_STRATEGIES 의 이름 (기본: 'date_backward')
+#   refresh_seconds: 조회가 끝난 뒤 다시 조회하기까지의 최소 간격(초) (기본: DEFAULT_REFRESH_SECONDS)
+KIS_DATASETS = {
+    'domestic_stock_075_investor_daily_by_market': {
+        # 응답을 스키마 타입으로 바로 변환한다 (kis_decode)
+        'function': kis_decode.fetch_decoded,
+        'kwargs': {
+            'tr_id': kis_decode.INVESTOR_DAILY_BY_MARKET.tr_id,
+            'params': {
+                'FID_COND_MRKT_DIV_CODE': 'U',
+                'FID_INPUT_ISCD': "0001",
+                'FID_INPUT_DATE_1': '{query_begin_date}',
+                'FID_INPUT_ISCD_1': "KSP",
+                'FID_INPUT_DATE_2': '{oldest_date}',
+                'FID_INPUT_ISCD_2': "0001",
+            },
+        },
+        'date_column': 'stck_bsop_date',
+        'key_columns': ('stck_bsop_date',),
+        'dtypes': kis_decode.INVESTOR_DAILY_BY_MARKET.get_typed_fields(),
+        'paging': 'date_backward',
+        'refresh_seconds': DEFAULT_REFRESH_SECONDS,
+    },
+}
+
+
+def get_dataset(table_name):
+    if table_name not in KIS_DATASETS:
+        raise ValueError(f'table name : {table_name} is not defined in KIS_DATASETS.')
+    dataset = KIS_DATASETS[table_name]
+    return {
+        'key_columns': (dataset['date_column'],),
+        'dtypes': {},
+        'paging': 'date_backward',
+        'refresh_seconds': DEFAULT_REFRESH_SECONDS,
+        **dataset,
+    }
+
+
+def get_dataset_dtypes(table_name):
+    return KIS_DATASETS.get(table_name, {}).get('dtypes', {})
+
+
+# 테이블별로 마지막으로 끝까지 조회한 시각(time.monotonic). 실패한 조회는 기록하지 않으므로 바로 다시 시도할 수 있다.
+_last_refresh_time = {}
+_last_refresh_lock = threading.Lock()
+
+
+def is_refresh_due(table_name) -> bool:
+    """데이터셋의 refresh_seconds 가 지나서 KIS API 를 다시 조회할 수 있으면 True"""
+    with _last_refresh_lock:
+        last_refresh_time = _last_refresh_time.get(table_name)
+    return last_refresh_time is None or time.monotonic() - last_refresh_time >= get_dataset(table_name)['refresh_seconds']
+
+
+def _mark_refreshed(table_name, started_at):
+    # 조회를 시작한 시각을 기록해서 한 시간마다 도는 scheduler 가 조회 시간만큼 밀리지 않게 한다
+    with _last_refresh_lock:
+        _last_refresh_time[table_name] = started_at
+
+
 # 로깅 설정
 logging.basicConfig(level=logging.DEBUG, format='%(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 'sqlite' 또는 'parquet'. parquet 이면 SQLite 와 함께 연도별 Parquet 파일에도 기록하고 읽기는 Parquet 에서 한다.
+KIS_STORAGE_BACKEND = config.get('KIS', {}).get('STORAGE_BACKEND', 'sqlite')
+if KIS_STORAGE_BACKEND == 'parquet' and not columnar.is_available():
+    logger.warning("pyarrow is not installed. Falling back to the sqlite storage backend.")
+    KIS_STORAGE_BACKEND = 'sqlite'
+
 ##############################################################################################
 # [국내주식] 시세분석 > 시장별 투자자매매동향(일별) [국내주식-075]
 ##############################################################################################
@@ -90,162 +151,861 @@ start_date = pendulum.now()
 # fid_input_date_2=sd,
 
 
+def get_kis_database():
+    return get_database(kis_database_file_name)
+
+
 def create_database(table_name, df):
-    conn = sqlite3.connect(kis_database_file_name)
-    df.to_sql(table_name, conn, if_exists='replace', index=False)
-    conn.close()
-    
-    
+    get_kis_database().write(
+        lambda conn: df.to_sql(table_name, conn, if_exists='replace', index=False)
+    )
+
+
+def get_sqlite_column_type(table_name, column):
+    dtype = get_dataset_dtypes(table_name).get(column)
+    if dtype is not None and np.issubdtype(dtype, np.floating):
+        return 'REAL'
+    if dtype is not None and np.issubdtype(dtype, np.integer):
+        return 'INTEGER'
+    return 'TEXT'
+
+
+def get_table_columns(conn, table_name):
+    """테이블의 (컬럼명, pk 여부) 목록을 반환한다. 테이블이 없으면 빈 리스트."""
+    rows = conn.execute(f"PRAGMA table_info({table_name})").fetchall()
+    return [(row[1], row[5]) for row in rows]
+
+
+def has_rowid(conn, table_name):
+    """WITHOUT ROWID 로 만든 테이블이면 False"""
+    try:
+        conn.execute(f'SELECT rowid FROM "{table_name}" LIMIT 0')
+        return True
+    except sqlite3.OperationalError:
+        return False
+
+
+def create_table_metadata(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {KIS_TABLE_METADATA} (
+            table_name TEXT PRIMARY KEY,
+            date_column TEXT NOT NULL,
+            min_date TEXT,
+            max_date TEXT,
+            updated_at TEXT,
+            version INTEGER NOT NULL DEFAULT 0
+        )""")
+    if 'version' not in {name for name, _ in get_table_columns(conn, KIS_TABLE_METADATA)}:
+        conn.execute(f"ALTER TABLE {KIS_TABLE_METADATA} ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+
+def read_table_metadata(conn, table_name):
+    """테이블별 min/max 날짜, 데이터 버전 메타데이터. 없으면 None 을 반환한다."""
+    try:
+        cursor = conn.execute(f"SELECT * FROM {KIS_TABLE_METADATA} WHERE table_name = ?", (table_name,))
+        row = cursor.fetchone()
+    except sqlite3.OperationalError as e:
+        if f'no such table: {KIS_TABLE_METADATA}' in str(e):
+            return None
+        raise
+    if row is None:
+        return None
+    metadata = dict(zip([d[0] for d in cursor.description], row))
+    metadata.setdefault('version', 0)
+    return metadata
+
+
+def update_table_metadata(conn, table_name, column_name, min_date, max_date):
+    """새로 기록된 날짜 범위를 기존 메타데이터에 병합하고 데이터 버전을 올린다. 테이블 전체를 스캔하지 않는다."""
+    create_table_metadata(conn)
+    conn.execute(f"""
+        INSERT INTO {KIS_TABLE_METADATA} (table_name, date_column, min_date, max_date, updated_at, version)
+        VALUES (?, ?, ?, ?, ?, 1)
+        ON CONFLICT(table_name) DO UPDATE SET
+            date_column = excluded.date_column,
+            min_date = MIN(COALESCE(min_date, excluded.min_date), excluded.min_date),
+            max_date = MAX(COALESCE(max_date, excluded.max_date), excluded.max_date),
+            updated_at = excluded.updated_at,
+            version = version + 1
+        """, (table_name, column_name, min_date, max_date, pendulum.now().to_iso8601_string()))
+
+
+def rebuild_table_metadata(conn, table_name, column_name):
+    """메타데이터가 없는 기존 테이블에 대해 한 번만 MIN/MAX 를 계산해 저장한다."""
+    min_date, max_date = conn.execute(
+        f"SELECT MIN({column_name}), MAX({column_name}) FROM {table_name}"
+    ).fetchone()
+    if min_date is None:
+        return None
+    update_table_metadata(conn, table_name, column_name, min_date, max_date)
+    return read_table_metadata(conn, table_name)
+
+
+def create_table_coverage(conn):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {KIS_TABLE_COVERAGE} (
+            table_name TEXT NOT NULL,
+            begin_date TEXT NOT NULL,
+            end_date TEXT NOT NULL,
+            PRIMARY KEY (table_name, begin_date)
+        ) WITHOUT ROWID""")
+
+
+def read_table_coverage(conn, table_name) -> List[Tuple[str, str]]:
+    """받아 본 (시작일, 종료일) 구간 목록. 시작일 순이고 서로 겹치지 않는다."""
+    try:
+        return conn.execute(
+            f"SELECT begin_date, end_date FROM {KIS_TABLE_COVERAGE} WHERE table_name = ? ORDER BY begin_date",
+            (table_name,),
+        ).fetchall()
+    except sqlite3.OperationalError as e:
+        if f'no such table: {KIS_TABLE_COVERAGE}' in str(e):
+            return []
+        raise
+
+
+def add_table_coverage(conn, table_name, begin_date, end_date):
+    """[begin_date, end_date] 를 받아 본 구간에 추가한다. 겹치거나 바로 이어지는 구간은 하나로 합친다."""
+    create_table_coverage(conn)
+    day_before = pendulum.parse(begin_date).subtract(days=1).format('YYYYMMDD')
+    day_after = pendulum.parse(end_date).add(days=1).format('YYYYMMDD')
+    overlapping = conn.execute(
+        f"SELECT begin_date, end_date FROM {KIS_TABLE_COVERAGE} "
+        f"WHERE table_name = ? AND begin_date <= ? AND end_date >= ?",
+        (table_name, day_after, day_before),
+    ).fetchall()
+    for overlap_begin, overlap_end in overlapping:
+        begin_date, end_date = min(begin_date, overlap_begin), max(end_date, overlap_end)
+    conn.executemany(
+        f"DELETE FROM {KIS_TABLE_COVERAGE} WHERE table_name = ? AND begin_date = ?",
+        [(table_name, overlap_begin) for overlap_begin, _ in overlapping],
+    )
+    conn.execute(f"INSERT INTO {KIS_TABLE_COVERAGE} VALUES (?, ?, ?)", (table_name, begin_date, end_date))
+
+
+def read_stored_dates(conn, table_name, column_name, begin_date, end_date) -> List[str]:
+    return [row[0] for row in conn.execute(
+        f'SELECT DISTINCT "{column_name}" FROM "{table_name}" WHERE "{column_name}" BETWEEN ? AND ?',
+        (begin_date, end_date),
+    )]
+
+
+def get_data_version(table_name):
+    """테이블에 새 데이터가 기록될 때마다 올라가는 버전. 캐시 무효화에 사용한다."""
+    try:
+        metadata = get_kis_database().read(read_table_metadata, table_name)
+    except sqlite3.DatabaseError as e:
+        logger.error(f"Failed to read data version of {table_name}: {e}")
+        return None
+    return 0 if metadata is None else metadata['version']
+
+
+def get_table_key_columns(table_name, column_name):
+    return list(KIS_DATASETS.get(table_name, {}).get('key_columns', (column_name,)))
+
+
+def ensure_table_schema(conn, table_name, column_name, columns):
+    """데이터셋 키 컬럼을 PRIMARY KEY 로 가지는 테이블을 생성한다.
+
+    to_sql 로 만들어진 예전 테이블(PK 없음)은 PK 테이블로 옮기고, 중복된 키는 나중에 기록된 행을 남긴다.
+    이미 PK 테이블이면 새로 생긴 컬럼만 추가한다.
+    """
+    key_columns = get_table_key_columns(table_name, column_name)
+    existing = get_table_columns(conn, table_name)
+    existing_pk = [name for name, pk in sorted(existing, key=lambda x: x[1]) if pk]
+    if existing and existing_pk == key_columns:
+        existing_names = {name for name, _ in existing}
+        for c in columns:
+            if c not in existing_names:
+                conn.execute(f'ALTER TABLE "{table_name}" ADD COLUMN "{c}" {get_sqlite_column_type(table_name, c)}')
+        return
+
+    source_columns = [name for name, _ in existing] if existing else columns
+    all_columns = key_columns + [c for c in source_columns if c not in key_columns]
+    column_defs = ', '.join(f'"{c}" {get_sqlite_column_type(table_name, c)}' for c in all_columns)
+    key_list = ', '.join(f'"{c}"' for c in key_columns)
+    target_table = f'{table_name}__new' if existing else table_name
+    conn.execute(
+        f'CREATE TABLE "{target_table}" ({column_defs}, PRIMARY KEY ({key_list})) WITHOUT ROWID'
+    )
+
+    if existing:
+        logger.info(f"Migrating table {table_name} to primary key on {key_columns}.")
+        column_list = ', '.join(f'"{c}"' for c in all_columns)
+        # 같은 키가 여러 번 있으면 나중에 넣은 행을 남긴다. 이미 WITHOUT ROWID 인 테이블에는 rowid 가 없다
+        order_by = f'"{column_name}"' + (', rowid' if has_rowid(conn, table_name) else '')
+        conn.execute(
+            f'INSERT OR REPLACE INTO "{target_table}" ({column_list}) '
+            f'SELECT {column_list} FROM "{table_name}" ORDER BY {order_by}'
+        )
+        conn.execute(f'DROP TABLE "{table_name}"')
+        conn.execute(f'ALTER TABLE "{target_table}" RENAME TO "{table_name}"')
+        rebuild_table_metadata(conn, table_name, column_name)
+
+
+# 테이블별 Parquet 저장소 lock. backfill_data 가 같은 테이블의 구간을 동시에 기록해도
+# 한 파티션을 동시에 합치지 않고, 합치는 동안 지워지는 파일을 읽지 않는다.
+_columnar_locks = {}
+_columnar_locks_lock = threading.Lock()
+
+
+def get_columnar_lock(table_name):
+    with _columnar_locks_lock:
+        return _columnar_locks.setdefault(table_name, threading.RLock())
+
+
+def backfill_columnar_from_sqlite(table_name, column_name) -> int:
+    """SQLite 에만 있는 데이터를 Parquet 저장소로 연도별로 옮긴다.
+
+    STORAGE_BACKEND 를 parquet 으로 바꾼 뒤 처음 읽을 때 한 번 실행되므로 그 전에 받은 데이터도 읽힌다.
+
+    Returns:
+        int: 옮긴 행 수
+    """
+    with get_columnar_lock(table_name):
+        if columnar.is_backfilled(columnar_data_dir, table_name):
+            return 0
+        database = get_kis_database()
+        metadata = database.read(read_table_metadata, table_name)
+        key_columns = get_table_key_columns(table_name, column_name)
+        written = 0
+        if metadata is not None and metadata['min_date'] is not None:
+            logger.info(f"Copying {table_name} from SQLite to the columnar store.")
+            for year in range(int(metadata['min_date'][:4]), int(metadata['max_date'][:4]) + 1):
+                df = database.read(lambda conn: pd.read_sql_query(
+                    f'SELECT * FROM "{table_name}" WHERE "{column_name}" BETWEEN ? AND ?',
+                    conn, params=(f'{year}0101', f'{year}1231'),
+                ))
+                written += columnar.write_columnar(columnar_data_dir, table_name, df, column_name, key_columns,
+                                                   get_dataset_dtypes(table_name))
+        columnar.mark_backfilled(columnar_data_dir, table_name)
+        return written
+
+
+def write_database(table_name, df, column_name) -> Tuple[int, int]:
+    """데이터셋 키 기준으로 INSERT OR REPLACE 한다.
+
+    하나의 트랜잭션 안에서 executemany 로 기록하므로 같은 구간을 다시 받아도 행이 늘어나지 않는다.
+
+    Returns:
+        Tuple[int, int]: (새로 추가된 행 수, 갱신된 행 수)
+    """
+    if df is None or df.empty:
+        return 0, 0
+
+    key_columns = get_table_key_columns(table_name, column_name)
+    df = df.drop_duplicates(subset=key_columns, keep='last')
+    columns = list(df.columns)
+    rows = list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+    batch_keys = set(df[key_columns].itertuples(index=False, name=None))
+    min_date, max_date = df[column_name].min(), df[column_name].max()
+
+    column_list = ', '.join(f'"{c}"' for c in columns)
+    placeholders = ', '.join('?' for _ in columns)
+    key_list = ', '.join(f'"{c}"' for c in key_columns)
+
+    def upsert(conn):
+        ensure_table_schema(conn, table_name, column_name, columns)
+        existing_keys = set(conn.execute(
+            f'SELECT {key_list} FROM "{table_name}" WHERE "{column_name}" BETWEEN ? AND ?',
+            (min_date, max_date),
+        ).fetchall())
+        conn.executemany(
+            f'INSERT OR REPLACE INTO "{table_name}" ({column_list}) VALUES ({placeholders})', rows
+        )
+        update_table_metadata(conn, table_name, column_name, min_date, max_date)
+        return existing_keys
+
+    existing_keys = get_kis_database().write(upsert)
+    if KIS_STORAGE_BACKEND == 'parquet':
+        with get_columnar_lock(table_name):
+            columnar.write_columnar(columnar_data_dir, table_name, df, column_name, key_columns,
+                                    get_dataset_dtypes(table_name))
+
+    updated = len(batch_keys & existing_keys)
+    inserted = len(batch_keys) - updated
+    logger.info(f"{table_name}: {inserted} rows inserted, {updated} rows updated.")
+    return inserted, updated
+
+
 def get_latest_date_of_database_table(table_name, column_name):
-    conn = sqlite3.connect(kis_database_file_name)
-    cursor = conn.cursor()
+    database = get_kis_database()
     
     # 날짜 포함
     latest_date = DEFAULT_LASTEST_DATE
     
-    # find last data
-    latest_date_query = f"SELECT MAX({column_name}) FROM {table_name}"
+    # 테이블 스캔 대신 메타데이터에서 최신 날짜를 읽는다
     try:
-        latest_date = cursor.execute(latest_date_query).fetchone()[0]
+        metadata = database.read(read_table_metadata, table_name)
+        if metadata is None:
+            metadata = database.write(rebuild_table_metadata, table_name, column_name)
+        if metadata is not None and metadata['max_date'] is not None:
+            latest_date = metadata['max_date']
     except sqlite3.OperationalError as e:
-        if f'no such table: {table_name}' in str(e):
-            logger.info(f"Table {table_name} does not exist. Starting from default date.")
-    except sqlite3.DatabaseError as e:
-        logger.error(f"Database error occurred: {e}. Maybe the database is absent or locked.")
-    except Exception as e:
-        logger.error(f"Error occurred while fetching last date: {e}")
-        raise e
-    finally:
-        conn.close()
-        return latest_date
+        # 테이블이 없을 때만 처음부터 받는다. "database is locked" 등은 전체 backfill 로 이어지지 않도록 호출한 쪽에 알린다.
+        if f'no such table: {table_name}' not in str(e):
+            logger.error(f"Error occurred while fetching last date of {table_name}: {e}")
+            raise
+        logger.info(f"Table {table_name} does not exist. Starting from default date.")
+    return latest_date
     
 
 def set_dtype_of_dataframe(table_name, df):
-    if table_name in KIS_DATAFRAME_DTYPES:
-        dtype_mapping = KIS_DATAFRAME_DTYPES[table_name]
+    if table_name in KIS_DATASETS:
+        dtype_mapping = get_dataset_dtypes(table_name)
         for column, dtype in dtype_mapping.items():
             if column in df.columns:
                 df[column] = df[column].astype(dtype)
     return df
 
 
-def update_or_read_database(table_name, df, column_name):
-    os.makedirs(os.path.dirname(kis_database_file_name), exist_ok=True)
-    
-    conn = sqlite3.connect(kis_database_file_name)
-    # df_filter = df[df['stck_bsop_date'] > last_date_str]
-    if df is not None and not df.empty:
-        df.to_sql(table_name, conn, if_exists='append', index=False)
-    
-    df_all = pd.read_sql_query(f"SELECT * FROM {table_name} ORDER BY {column_name} DESC", conn)
-    df_all[column_name] = pd.to_datetime(df_all[column_name], format='%Y%m%d')
-    df_all = set_dtype_of_dataframe(table_name, df_all)
-    # df_all[column_name].apply(date_converter)
-    df_all.set_index(column_name, drop=False, inplace=True)
-    conn.close()
-
-    return df_all 
-    
+def get_period_begin_date(period_key):
+    """DATE_PRESETS 키에 해당하는 조회 시작일(YYYYMMDD). 전체 기간이면 None."""
+    if period_key is None:
+        return None
+    days = DATE_PRESETS.get(period_key, DATE_PRESETS['14d'])['days']
+    if days is None:
+        return None
+    return pendulum.now('Asia/Seoul').subtract(days=days).format('YYYYMMDD')
 
-def generate_inquire_function(table_name, query_begin_date, oldest_date):
-    functions = {
-        'domestic_stock_075_investor_daily_by_market': {
-            'function': inquire_investor_daily_by_market,
-            'kwargs': {
-                'fid_cond_mrkt_div_code': 'U',
-                'fid_input_iscd': "0001",
-                'fid_input_date_1': query_begin_date,
-                'fid_input_iscd_1': "KSP",
-                'fid_input_date_2': oldest_date,
-                'fid_input_iscd_2': "0001",                
-            }
-        }
+
+def read_database(table_name, column_name, period_key=None, columns=None):
+    """read_database_uncached 결과를 데이터 버전 기준으로 캐시한다.
+
+    scheduler 등이 새 데이터를 기록하면 버전이 바뀌어 다음 호출에서 다시 읽는다.
+    반환된 DataFrame 은 캐시와 공유되므로 제자리 수정하지 않아야 한다.
+    """
+    version = get_data_version(table_name)
+    if version is None:
+        return read_database_uncached(table_name, column_name, period_key, columns)
+    key = ('kis', kis_database_file_name, KIS_STORAGE_BACKEND, table_name, column_name,
+           get_period_begin_date(period_key), None if columns is None else tuple(columns))
+    return frame_cache.get_or_load(key, version, read_database_uncached,
+                                   table_name, column_name, period_key, columns)
+
+
+def read_database_uncached(table_name, column_name, period_key=None, columns=None):
+    """요청한 기간의 데이터만 읽는다.
+
+    날짜 조건은 PRIMARY KEY 범위 검색으로 SQLite 에서 처리되고, 날짜 파싱과 dtype 변환은
+    읽어온 행에 대해서만 수행된다.
+
+    저장소가 'parquet' 이면 연도 파티션과 컬럼 단위로 읽는다. (columnar.read_columnar)
+    처음 읽을 때 SQLite 에만 있던 데이터를 먼저 옮긴다. (backfill_columnar_from_sqlite)
+
+    Args:
+        period_key (str, optional): DATE_PRESETS 키. None 이면 전체 기간.
+        columns (list, optional): 읽을 컬럼 목록. None 이면 전체 컬럼.
+    """
+    begin_date = get_period_begin_date(period_key)
+    if KIS_STORAGE_BACKEND == 'parquet':
+        backfill_columnar_from_sqlite(table_name, column_name)
+        with get_columnar_lock(table_name):
+            df = columnar.read_columnar(columnar_data_dir, table_name, column_name,
+                                        get_table_key_columns(table_name, column_name),
+                                        begin_date=begin_date, columns=columns)
+        if df is None:
+            logger.info(f"Columnar store of {table_name} is empty. Reading from SQLite.")
+        else:
+            return _finalize_dataframe(table_name, df, column_name)
+
+    select_columns = '*' if columns is None else ', '.join(
+        f'"{c}"' for c in [column_name] + [c for c in columns if c != column_name]
+    )
+    query = f"SELECT {select_columns} FROM {table_name}"
+    params = ()
+    if begin_date is not None:
+        query += f" WHERE {column_name} >= ?"
+        params = (begin_date,)
+    query += f" ORDER BY {column_name} DESC"
+
+    def select(conn):
+        if not get_table_columns(conn, table_name):
+            return None
+        return pd.read_sql_query(query, conn, params=params)
+
+    df = get_kis_database().read(select)
+    if df is None:
+        logger.info(f"Table {table_name} does not exist.")
+        return pd.DataFrame(columns=[column_name]).set_index(column_name, drop=False)
+
+    return _finalize_dataframe(table_name, df, column_name)
+
+
+def _finalize_dataframe(table_name, df, column_name):
+    dtype_mapping = {
+        c: dtype for c, dtype in get_dataset_dtypes(table_name).items() if c in df.columns
     }
+    df = df.astype(dtype_mapping)
+    df[column_name] = pd.to_datetime(df[column_name], format='%Y%m%d')
+    df.set_index(column_name, drop=False, inplace=True)
+    return df
+
+
+def update_or_read_database(table_name, df, column_name, period_key=None):
+    write_database(table_name, df, column_name)
+
+    return read_database(table_name, column_name, period_key)
     
-    if table_name not in functions:
-        raise ValueError(f'table name : {table_name} is not defined in inquirable function info.')
-    
-    function_info = functions[table_name]
-    function = function_info['function'] 
-    kwargs = function_info['kwargs']
-    
-    return function, kwargs
+
+def _render_kwargs(template, values):
+    if isinstance(template, dict):
+        return {k: _render_kwargs(v, values) for k, v in template.items()}
+    if isinstance(template, str):
+        return template.format_map(values)
+    return template
+
+
+def generate_inquire_function(table_name, query_begin_date, oldest_date):
+    dataset = get_dataset(table_name)
+    kwargs = _render_kwargs(dataset['kwargs'], {'query_begin_date': query_begin_date, 'oldest_date': oldest_date})
+    return dataset['function'], kwargs
     
     
-def download_data(table_name, column_name):
+def update_data(table_name, column_name=None, force=False) -> int:
+    """저장된 마지막 날 다음부터 장이 끝난 마지막 영업일까지 KIS API 로 받아 기록한다. 테이블은 읽지 않는다.
+
+    데이터셋의 refresh_seconds 안에 이미 조회했으면 force 가 아닌 한 조회하지 않는다.
+
+    Returns:
+        int: 새로 추가된 행 수
+    """
+    dataset = get_dataset(table_name)
+    column_name = column_name or dataset['date_column']
     oldest_date_str = get_latest_date_of_database_table(table_name, column_name)
-    current_date_str = pendulum.now().format('YYYYMMDD')
+    # 장이 끝나 일별 데이터가 나온 마지막 영업일. 주말, 휴장일, 장중에는 전 영업일이다.
+    current_date_str = get_calendar().get_latest_closed_trading_day()
     
-    if oldest_date_str == current_date_str:
+    if oldest_date_str >= current_date_str:
         print("Data is already up to date.")
-        return update_or_read_database(table_name, None, column_name)
+        return 0
+    if not force and not is_refresh_due(table_name):
+        logger.info(f"{table_name} was queried within {dataset['refresh_seconds']} seconds. Skipping.")
+        return 0
+
+    started_at = time.monotonic()
+    inserted = 0
+    # 비어있는 DB 이거나 오래 비어있던 구간은 기간을 나눠 동시에 받는다. 중단된 backfill 이 있으면 이어서 받는다.
+    if load_backfill_checkpoint(table_name) is not None or get_days_between(oldest_date_str, current_date_str) > BACKFILL_WINDOW_DAYS:
+        inserted, _ = backfill_data(table_name, column_name, oldest_date_str, current_date_str)
+        oldest_date_str = get_latest_date_of_database_table(table_name, column_name)
+        if oldest_date_str >= current_date_str:
+            _mark_refreshed(table_name, started_at)
+            return inserted
+
     last_date_str = pendulum.parse(oldest_date_str).in_tz('Asia/Seoul').add(days=1).format('YYYYMMDD')
     print(f"Querying from data after {last_date_str} from KIS API...")
-    df = query_data(table_name, current_date_str, last_date_str)
-    df_all = update_or_read_database(table_name, df, column_name)
-    return df_all
+    date_range = {}
+    pages = _track_date_range(iter_query_pages(table_name, current_date_str, last_date_str), column_name, date_range)
+    page_inserted, _ = ingest_pages(table_name, column_name, pages)
+    inserted += page_inserted
+    # 실제로 받은 날짜 구간만 받아 본 구간으로 기록한다. 아직 나오지 않았거나 받지 못한 날은
+    # 다음 조회나 repair_data 가 다시 받는다.
+    if date_range:
+        get_kis_database().write(add_table_coverage, table_name, date_range['min'], date_range['max'])
+    expected = get_calendar().count_trading_days(last_date_str, current_date_str)
+    if page_inserted != expected:
+        logger.warning(f"{table_name}: {page_inserted} new rows from {last_date_str} to {current_date_str}, expected {expected} trading days.")
+    _mark_refreshed(table_name, started_at)
+    return inserted
+
+
+def download_data(table_name, column_name=None, period_key=None):
+    """update_data 로 갱신한 뒤 period_key 기간을 읽는다.
+
+    period_key 가 None 이면 갱신만 하고 None 을 반환한다. 전체 기간은 read_database 로 따로 읽는다.
+    """
+    column_name = column_name or get_dataset(table_name)['date_column']
+    update_data(table_name, column_name)
+    if period_key is None:
+        return None
+    return read_database(table_name, column_name, period_key)
     
     
-def query_data(table_name, latest_date:str, oldest_date:str) -> pd.DataFrame:
-    """_summary_
+def iter_query_pages(table_name, latest_date:str, oldest_date:str) -> Iterator[pd.DataFrame]:
+    """[oldest_date, latest_date] 구간을 데이터셋의 paging 방법으로 한 페이지씩 받아 돌려준다.
 
     Args:
         latest_date (str): 조회를 시작할 날짜.
         oldest_date (str): 우리가 가지고 있는 데이터에서 가장 오래된 날짜이므로 이 날짜 이후의 데이터만 쿼리함.
+    """
+    dataset = get_dataset(table_name)
+    return PAGING_STRATEGIES[dataset['paging']](table_name, dataset, latest_date, oldest_date)
 
-    Returns:
-        pd.DataFrame: _description_
+
+def iter_pages_date_backward(table_name, dataset, latest_date:str, oldest_date:str) -> Iterator[pd.DataFrame]:
+    """latest_date 부터 과거 방향으로 조회한다.
+
+    다음 페이지는 받은 데이터의 가장 오래된 날짜 전날부터 조회하므로 경계 날짜를 다시 받지 않는다.
     """
+    date_column = dataset['date_column']
     # 쿼리를 시작할 날짜. 날짜 역순이므로 최근 날짜가 됨
     query_begin_date = latest_date
-    prev_old_date = oldest_date
-    df = pd.DataFrame()
-    while True:
-        # query_begin_date=query_begin_date.format('YYYYMMDD')
-        if query_begin_date == DEFAULT_LASTEST_DATE or query_begin_date <= oldest_date or prev_old_date > oldest_date:
-            break
+    while query_begin_date >= oldest_date and query_begin_date > DEFAULT_LASTEST_DATE:
         print(f"Fetching data for date: {query_begin_date}")
-        # result = inquire_investor_daily_by_market(
-        #     fid_cond_mrkt_div_code="U",
-        #     fid_input_iscd="0001",
-        #     fid_input_date_1=query_begin_date,
-        #     fid_input_iscd_1="KSP",
-        #     fid_input_date_2=oldest_date,
-        #     fid_input_iscd_2="0001",
-        # )
-        inquire_function, kwargs = generate_inquire_function(table_name, query_begin_date, oldest_date)
-        result = inquire_function(**kwargs)
+        # 오류 응답은 조회 함수가 예외로 알리므로 빈 결과는 더 받을 데이터가 없다는 뜻이다
+        result = call_inquire_function(table_name, query_begin_date, oldest_date)
         if len(result) == 0:
             logger.info("No more data available. Exiting loop.")
             break
         
-        # oldest_date 이후의 데이터만 필터링
-        result_filtered = result[result['stck_bsop_date'] >= oldest_date]
+        # [oldest_date, latest_date] 구간의 데이터만 필터링
+        result_filtered = result[(result[date_column] >= oldest_date) & (result[date_column] <= latest_date)]
         if len(result_filtered) == 0:
             logger.info("No new data found after filtering. Exiting loop.")
             break
-        
-        prev_old_date = result_filtered['stck_bsop_date'].min()
-        
-        df = pd.concat([df, result_filtered], ignore_index=True)
-        # print(result)
 
-        query_begin_date = pendulum.parse(result_filtered['stck_bsop_date'].min()).in_tz('Asia/Seoul').format('YYYYMMDD')
-        # print(last_date)
+        yield result_filtered
 
-    return df
+        query_begin_date = pendulum.parse(result_filtered[date_column].min()).subtract(days=1).format('YYYYMMDD')
 
 
-def download_all_kis_data():
-    # file_path = data_dir / Path("domestic_stock_075_investor_daily_by_market.xlsx")
-    df = download_data("domestic_stock_075_investor_daily_by_market", "stck_bsop_date")
-    return df
+def iter_pages_tr_cont(table_name, dataset, latest_date:str, oldest_date:str) -> Iterator[pd.DataFrame]:
+    """[oldest_date, latest_date] 를 한 번 조회하고 다음 페이지는 연속조회(tr_cont)로 받는다.
+
+    kwargs 는 kis_decode.iter_fetch_decoded 의 인자(tr_id, params, output)여야 한다.
+    """
+    date_column = dataset['date_column']
+    kwargs = _render_kwargs(dataset['kwargs'], {'query_begin_date': latest_date, 'oldest_date': oldest_date})
+    for page in kis_decode.iter_fetch_decoded(**kwargs):
+        page = page[(page[date_column] >= oldest_date) & (page[date_column] <= latest_date)]
+        if len(page) > 0:
+            yield page
+
+
+# 데이터셋의 paging 이름 -> (table_name, dataset, latest_date, oldest_date) 로 페이지를 돌려주는 함수
+#   date_backward: 받은 가장 오래된 날짜 전날부터 다시 조회한다. 연속조회를 지원하지 않는 TR 용.
+#   tr_cont: 응답의 연속조회키로 다음 페이지를 받는다. 페이지마다 요청 한 번.
+PAGING_STRATEGIES = {
+    'date_backward': iter_pages_date_backward,
+    'tr_cont': iter_pages_tr_cont,
+}
+
+
+def query_data(table_name, latest_date:str, oldest_date:str) -> pd.DataFrame:
+    """iter_query_pages 의 모든 페이지를 하나의 DataFrame 으로 합친다.
+
+    받은 데이터를 바로 DB 에 기록할 때는 ingest_pages 를 사용한다.
+    """
+    pages = list(iter_query_pages(table_name, latest_date, oldest_date))
+    if not pages:
+        return pd.DataFrame()
+    return pd.concat(pages, ignore_index=True)
+
+
+def ingest_pages(table_name, column_name, pages:Iterable[pd.DataFrame], queue_size:int=INGEST_QUEUE_SIZE) -> Tuple[int, int]:
+    """페이지를 받는 대로 DB 에 기록한다.
+
+    받기(별도 스레드)와 기록(호출한 스레드)은 크기가 queue_size 인 큐로 연결되어 있어서,
+    다음 페이지를 받는 동안 이전 페이지를 기록하고 메모리에는 최대 queue_size 페이지만 남는다.
+
+    Returns:
+        Tuple[int, int]: (새로 추가된 행 수, 갱신된 행 수)
+    """
+    page_queue = queue.Queue(maxsize=queue_size)
+    end_of_pages = object()
+    errors = []
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for page in pages:
+                while not stop.is_set():
+                    try:
+                        page_queue.put(page, timeout=1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            page_queue.put(end_of_pages)
+
+    producer = threading.Thread(target=produce, name=f'ingest-{table_name}', daemon=True)
+    producer.start()
+
+    inserted, updated = 0, 0
+    try:
+        while True:
+            page = page_queue.get()
+            if page is end_of_pages:
+                break
+            page_inserted, page_updated = write_database(table_name, page, column_name)
+            inserted += page_inserted
+            updated += page_updated
+    finally:
+        stop.set()
+        # 기록이 실패해서 빠져나온 경우 큐를 비워 producer 가 끝날 수 있게 한다
+        while producer.is_alive():
+            try:
+                page_queue.get(timeout=1)
+            except queue.Empty:
+                pass
+        producer.join()
+
+    if errors:
+        raise errors[0]
+    return inserted, updated
+
+
+def call_inquire_function(table_name, query_begin_date, oldest_date) -> pd.DataFrame:
+    # 호출 속도는 ka._url_fetch 의 토큰 버킷이 모든 스레드에 대해 맞춘다
+    inquire_function, kwargs = generate_inquire_function(table_name, query_begin_date, oldest_date)
+    return inquire_function(**kwargs)
+
+
+def get_days_between(begin_date:str, end_date:str) -> int:
+    return (pendulum.parse(end_date) - pendulum.parse(begin_date)).in_days()
+
+
+def split_date_windows(oldest_date:str, latest_date:str, window_days:int=None) -> List[Tuple[str, str]]:
+    """[oldest_date, latest_date] 를 window_days 일 단위의 (시작일, 종료일) 목록으로 나눈다. 최근 구간부터."""
+    window_days = window_days or BACKFILL_WINDOW_DAYS
+    windows = []
+    window_end = pendulum.parse(latest_date)
+    oldest = pendulum.parse(oldest_date)
+    while window_end >= oldest:
+        window_begin = max(oldest, window_end.subtract(days=window_days - 1))
+        windows.append((window_begin.format('YYYYMMDD'), window_end.format('YYYYMMDD')))
+        window_end = window_begin.subtract(days=1)
+    return windows
+
+
+def ingest_window(table_name, column_name, window_begin:str, window_end:str) -> Tuple[int, int]:
+    """한 구간을 페이지 단위로 받으면서 바로 기록한다. 구간끼리는 backfill_data 가 동시에 실행한다.
+
+    페이지를 끝까지 받으면 받은 가장 오래된 날부터 가장 최근 날까지를 받아 본 구간(coverage)에 추가한다.
+    중간에 실패하면 추가하지 않는다.
+    """
+    inserted, updated = 0, 0
+    date_range = {}
+    for page in _track_date_range(iter_query_pages(table_name, window_end, window_begin), column_name, date_range):
+        page_inserted, page_updated = write_database(table_name, page, column_name)
+        inserted += page_inserted
+        updated += page_updated
+    if date_range:
+        get_kis_database().write(add_table_coverage, table_name, max(date_range['min'], window_begin),
+                                 min(date_range['max'], window_end))
+    return inserted, updated
+
+
+def _track_date_range(pages:Iterable[pd.DataFrame], column_name, date_range:dict) -> Iterator[pd.DataFrame]:
+    """pages 를 그대로 돌려주면서 받은 날짜의 최소/최대를 date_range['min'], date_range['max'] 에 기록한다."""
+    for page in pages:
+        if len(page) > 0:
+            page_min, page_max = page[column_name].min(), page[column_name].max()
+            date_range['min'] = min(date_range.get('min', page_min), page_min)
+            date_range['max'] = max(date_range.get('max', page_max), page_max)
+        yield page
+
+
+def get_backfill_checkpoint_path(table_name):
+    return os.path.join(backfill_checkpoint_dir, f'{table_name}.json')
+
+
+def load_backfill_checkpoint(table_name):
+    path = get_backfill_checkpoint_path(table_name)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_backfill_checkpoint(table_name, checkpoint):
+    os.makedirs(backfill_checkpoint_dir, exist_ok=True)
+    path = get_backfill_checkpoint_path(table_name)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f)
+    os.replace(path + '.tmp', path)
+
+
+def backfill_data(table_name, column_name, oldest_date:str, latest_date:str,
+                  window_days:int=None, max_workers:int=BACKFILL_MAX_WORKERS) -> Tuple[int, int]:
+    """[oldest_date, latest_date] 를 구간으로 나눠 동시에 받으면서 페이지 단위로 DB 에 기록한다.
+
+    끝난 구간은 checkpoint 파일에 기록되므로 중단된 뒤 다시 호출하면 남은 구간만 받는다.
+    중단된 checkpoint 가 있으면 인자로 받은 기간 대신 checkpoint 의 기간을 이어서 받는다.
+
+    Returns:
+        Tuple[int, int]: (새로 추가된 행 수, 갱신된 행 수)
+    """
+    checkpoint = load_backfill_checkpoint(table_name)
+    if checkpoint is None:
+        checkpoint = {
+            'oldest_date': oldest_date,
+            'latest_date': latest_date,
+            'window_days': window_days or BACKFILL_WINDOW_DAYS,
+            'done': [],
+        }
+        save_backfill_checkpoint(table_name, checkpoint)
+    else:
+        logger.info(f"Resuming backfill of {table_name}: {len(checkpoint['done'])} windows already done.")
+
+    done = {tuple(w) for w in checkpoint['done']}
+    windows = [
+        w for w in split_date_windows(checkpoint['oldest_date'], checkpoint['latest_date'], checkpoint['window_days'])
+        if w not in done
+    ]
+    logger.info(f"Backfilling {table_name}: {len(windows)} windows with {max_workers} workers.")
+
+    inserted, updated, failed = 0, 0, 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(ingest_window, table_name, column_name, *w): w for w in windows}
+        for future in as_completed(futures):
+            window = futures[future]
+            try:
+                window_inserted, window_updated = future.result()
+            except Exception as e:
+                logger.error(f"Failed to fetch {table_name} window {window}: {e}")
+                failed += 1
+                continue
+            inserted += window_inserted
+            updated += window_updated
+            checkpoint['done'].append(list(window))
+            save_backfill_checkpoint(table_name, checkpoint)
+
+    if failed == 0:
+        os.remove(get_backfill_checkpoint_path(table_name))
+    else:
+        logger.warning(f"{failed} windows of {table_name} failed. Call backfill_data again to resume.")
+    return inserted, updated
+
+
+def find_missing_trading_days(table_name, column_name=None, begin_date=None, end_date=None) -> List[str]:
+    """[begin_date, end_date] 의 영업일 중 저장된 행도 없고 받아 본 구간에도 없는 날.
+
+    기본 기간은 테이블에 저장된 가장 오래된 날부터 가장 최근 날까지이다. 휴장일을 모르는 연도의 휴장일을
+    빈 날로 잡지 않도록 달력에 휴장일이 있는 연도 안으로 줄인다. 영업일, 저장된 날짜,
+    받아 본 구간을 정수 배열로 비교하므로 전체 기간을 검사해도 수 밀리초 안에 끝난다.
+    """
+    column_name = column_name or get_dataset(table_name)['date_column']
+    database = get_kis_database()
+    if begin_date is None or end_date is None:
+        metadata = database.read(read_table_metadata, table_name)
+        if metadata is None or metadata['min_date'] is None:
+            return []
+        begin_date = begin_date or metadata['min_date']
+        end_date = end_date or metadata['max_date']
+    calendar = get_calendar()
+    clamped = calendar.clamp_to_years(begin_date, end_date)
+    if clamped is None:
+        return []
+    begin_date, end_date = clamped
+
+    trading_days = calendar.get_trading_days_array(begin_date, end_date)
+    stored = np.array(database.read(read_stored_dates, table_name, column_name, begin_date, end_date), dtype=np.int64)
+    missing = np.setdiff1d(trading_days, stored, assume_unique=True)
+
+    covered = np.zeros(len(missing), dtype=bool)
+    for covered_begin, covered_end in database.read(read_table_coverage, table_name):
+        lo = np.searchsorted(missing, int(covered_begin), side='left')
+        hi = np.searchsorted(missing, int(covered_end), side='right')
+        covered[lo:hi] = True
+    return [str(date) for date in missing[~covered]]
+
+
+def group_trading_days(dates:List[str]) -> List[Tuple[str, str]]:
+    """영업일 목록을 영업일 기준으로 이어지는 (시작일, 종료일) 구간으로 묶는다. 최근 구간부터."""
+    if not dates:
+        return []
+    days = np.array(dates, dtype=np.int64)
+    trading_days = get_calendar().get_trading_days_array(dates[0], dates[-1])
+    positions = np.searchsorted(trading_days, days)
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    ranges = [(str(group[0]), str(group[-1])) for group in np.split(days, breaks)]
+    return ranges[::-1]
+
+
+def repair_data(table_name, column_name=None, max_ranges:int=REPAIR_MAX_RANGES,
+                max_workers:int=BACKFILL_MAX_WORKERS) -> Tuple[int, int]:
+    """find_missing_trading_days 로 찾은 빈 구간만 다시 받는다.
+
+    받은 날까지는 받아 본 구간에 추가되므로 다음 검사에서 빠지고, 받지 못한 날은 다음 호출에서 다시 받는다.
+
+    Returns:
+        Tuple[int, int]: (새로 추가된 행 수, 갱신된 행 수)
+    """
+    column_name = column_name or get_dataset(table_name)['date_column']
+    ranges = group_trading_days(find_missing_trading_days(table_name, column_name))
+    if not ranges:
+        return 0, 0
+    logger.info(f"Repairing {table_name}: {len(ranges)} missing ranges, fetching up to {max_ranges}.")
+
+    inserted, updated = 0, 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(ingest_window, table_name, column_name, *r): r for r in ranges[:max_ranges]}
+        for future in as_completed(futures):
+            try:
+                range_inserted, range_updated = future.result()
+            except Exception as e:
+                logger.error(f"Failed to repair {table_name} range {futures[future]}: {e}")
+                continue
+            inserted += range_inserted
+            updated += range_updated
+    return inserted, updated
+
+
+def repair_all_kis_data() -> dict:
+    """KIS_DATASETS 의 모든 데이터셋에서 빈 구간을 다시 받는다.
+
+    Returns:
+        dict: {table_name: (새로 추가된 행 수, 갱신된 행 수)}. 실패한 데이터셋은 빠진다.
+    """
+    results = {}
+    for table_name in KIS_DATASETS:
+        try:
+            results[table_name] = repair_data(table_name)
+        except Exception as e:
+            logger.error(f"Failed to repair {table_name}: {e}")
+    return results
+
+
+def download_all_kis_data(table_names:list=None, max_workers:int=None) -> dict:
+    """table_names(기본: KIS_DATASETS 전체) 중 refresh_seconds 가 지난 데이터셋을 동시에 갱신한다.
+    호출 속도는 ka 의 토큰 버킷이 맞춘다.
+
+    Returns:
+        dict: {table_name: 새로 추가된 행 수}. 실패했거나 조회할 때가 되지 않은 데이터셋은 빠진다.
+    """
+    table_names = [table_name for table_name in (table_names or KIS_DATASETS) if is_refresh_due(table_name)]
+    if not table_names:
+        return {}
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(table_names)) as executor:
+        futures = {executor.submit(update_data, table_name): table_name for table_name in table_names}
+        for future in as_completed(futures):
+            table_name = futures[future]
+            try:
+                results[table_name] = future.result()
+            except Exception as e:
+                logger.error(f"Failed to download {table_name}: {e}")
+    return results
+
+
+def get_outdated_kis_tables(trading_day:str, due_only:bool=False) -> list:
+    """DB 의 마지막 날짜가 trading_day 보다 이른 데이터셋 목록. 확인하지 못한 데이터셋도 포함한다.
+
+    due_only 이면 그 중 refresh_seconds 가 지나 다시 조회할 수 있는 데이터셋만 반환한다.
+    """
+    outdated = []
+    for table_name in KIS_DATASETS:
+        if due_only and not is_refresh_due(table_name):
+            continue
+        try:
+            latest_date = get_latest_date_of_database_table(table_name, get_dataset(table_name)['date_column'])
+        except Exception as e:
+            logger.error(f"Failed to read the latest date of {table_name}: {e}")
+            latest_date = DEFAULT_LASTEST_DATE
+        if latest_date < trading_day:
+            outdated.append(table_name)
+    return outdated
 
 
 def init_auth():
-    # 인증
+    # 인증. API 를 호출할 때 ka.ensure_auth() 가 자동으로 인증하므로 토큰을 미리 갱신할 때만 호출한다.
     ka.auth()
-    trenv = ka.getTREnv()
 
 
 def date_converter(date_int):
@@ -253,8 +1013,5 @@ def date_converter(date_int):
     return pd.to_datetime(str(date_int), format='%Y%m%d')
 
 
-init_auth()
-
-
 if __name__ == "__main__":
     download_all_kis_data()
\ No newline at end of file
@@ -0,0 +1,142 @@
+# ====|  kis_auth._url_fetch 의 asyncio 버전  |=====================
+# 인증 header, 모의투자 TR id 변환, APIResp 응답 처리와 호출 한도(토큰 버킷)는 kis_auth 와 공유한다.
+# HTTP 클라이언트는 requirements 에 이미 있는 tornado 의 AsyncHTTPClient 를 사용한다.
+
+import asyncio
+import json
+from urllib.parse import urlencode
+
+import pandas as pd
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+import downloader.kis_auth as ka
+import downloader.kis_decode as kis_decode
+from downloader import http_cache, http_session
+
+
+# 동시에 열어두는 최대 요청 수. 실제 호출 속도는 ka 의 앱키별 토큰 버킷이 정한다.
+MAX_CONCURRENCY = 50
+
+
+class _AsyncResponse:
+    """APIResp 가 사용하는 requests.Response 인터페이스를 tornado 응답으로 제공한다."""
+
+    def __init__(self, response):
+        self.status_code = response.code
+        # tornado 는 header 이름을 'Tr_cont' 처럼 바꾸므로 APIResp 가 읽을 수 있게 소문자로 되돌린다.
+        # 'Content-Type' 처럼 '-' 가 들어간 표준 header 는 requests 와 같이 그대로 둔다 (APIResp 는 소문자 이름만 읽는다).
+        self.headers = {k if "-" in k else k.lower(): v for k, v in response.headers.get_all()}
+        self.content = response.body or b""
+        self.text = self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class KISAsyncClient:
+    """한 스레드의 이벤트 루프에서 많은 KIS REST 요청을 동시에 보낸다.
+
+    async with KISAsyncClient() as client:
+        results = await asyncio.gather(*[client.url_fetch(...) for ...])
+    """
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._client = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        # Streamlit 서버도 tornado 를 사용하므로 공용 인스턴스 대신 별도 인스턴스를 만든다
+        self._client = AsyncHTTPClient(force_instance=True, max_clients=self.max_concurrency)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def _fetch(self, url, headers, params, postFlag):
+        # http_session 과 같은 디스크 캐시를 사용한다
+        entry = http_cache.lookup("POST" if postFlag else "GET", url, None if postFlag else params,
+                                  params if postFlag else None, headers)
+        if entry is not None and entry.response is not None:
+            return entry.response
+
+        connect_timeout, request_timeout = http_session.DEFAULT_TIMEOUT
+        if postFlag:
+            request = HTTPRequest(url, method="POST", headers=headers, body=json.dumps(params),
+                                  connect_timeout=connect_timeout, request_timeout=request_timeout)
+        else:
+            query = urlencode(params) if params else ""
+            request = HTTPRequest(f"{url}?{query}" if query else url, method="GET", headers=headers,
+                                  connect_timeout=connect_timeout, request_timeout=request_timeout)
+        async with self._semaphore:
+            response = await self._client.fetch(request, raise_error=False)
+        response = _AsyncResponse(response)
+        if entry is not None:
+            http_cache.save(entry, response.status_code, response.headers, response.content)
+        return response
+
+    async def url_fetch(self, api_url, ptr_id, tr_cont, params, appendHeaders=None, postFlag=False):
+        """ka._url_fetch 와 같은 인자와 반환값(APIResp / APIRespError)을 가진다."""
+        await asyncio.to_thread(ka.ensure_auth)
+        url = f"{ka.getTREnv().my_url}{api_url}"
+        tr_id, headers = ka._build_headers(ptr_id, tr_cont, appendHeaders)
+
+        for attempt in range(ka._RATE_LIMIT_RETRIES + 1):
+            shard = ka._select_shard()
+            shard.apply_headers(headers)
+            wait = shard.rate_limiter.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            res = await self._fetch(url, headers, params, postFlag)
+            if not ka._is_rate_limited(res):
+                shard.rate_limiter.on_success()
+                break
+            shard.rate_limiter.on_rate_limited()
+
+        return ka._make_response(res)
+
+
+##############################################################################################
+# [국내주식] 시세분석 > 시장별 투자자매매동향(일별) [국내주식-075]
+##############################################################################################
+
+async def inquire_investor_daily_by_market_async(
+        client: KISAsyncClient,
+        fid_cond_mrkt_div_code: str,
+        fid_input_iscd: str,
+        fid_input_date_1: str,
+        fid_input_iscd_1: str,
+        fid_input_date_2: str,
+        fid_input_iscd_2: str,
+) -> pd.DataFrame:
+    schema = kis_decode.INVESTOR_DAILY_BY_MARKET
+    params = {
+        "FID_COND_MRKT_DIV_CODE": fid_cond_mrkt_div_code,
+        "FID_INPUT_ISCD": fid_input_iscd,
+        "FID_INPUT_DATE_1": fid_input_date_1,
+        "FID_INPUT_ISCD_1": fid_input_iscd_1,
+        "FID_INPUT_DATE_2": fid_input_date_2,
+        "FID_INPUT_ISCD_2": fid_input_iscd_2,
+    }
+    res = await client.url_fetch(schema.api_url, schema.tr_id, "", params)
+    return kis_decode.decode_response(res, schema.tr_id)
+
+
+async def gather_requests(coroutine_functions, max_concurrency: int = MAX_CONCURRENCY) -> list:
+    """coroutine_functions 의 각 함수를 client 를 인자로 호출해 동시에 실행하고 결과를 순서대로 반환한다.
+
+    예) await gather_requests([functools.partial(inquire_investor_daily_by_market_async, **kwargs), ...])
+    """
+    async with KISAsyncClient(max_concurrency) as client:
+        return await asyncio.gather(*[function(client) for function in coroutine_functions])
+
+
+def run_requests(coroutine_functions, max_concurrency: int = MAX_CONCURRENCY) -> list:
+    """이벤트 루프가 없는 곳(scheduler 등)에서 gather_requests 를 실행한다."""
+    return asyncio.run(gather_requests(coroutine_functions, max_concurrency))
@@ -7,27 +7,30 @@ import copy
 import json
 import logging
 import os
+import threading
 import time
-from base64 import b64decode
 from collections import namedtuple
 from collections.abc import Callable
-from datetime import datetime
-from io import StringIO
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache
 
 import pandas as pd
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
 # pip install requests (패키지설치)
-import requests
+from downloader import http_session, kis_ws_decode
 
 # 웹 소켓 모듈을 선언한다.
 import websockets
 
 # pip install PyYAML (패키지설치)
 import yaml
-from Crypto.Cipher import AES
-
-# pip install pycryptodome
-from Crypto.Util.Padding import unpad
 
 clearConsole = lambda: os.system("cls" if os.name in ("nt", "dos") else "clear")
 
@@ -37,73 +40,351 @@ config_root = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "da
 # config_root = "$HOME/KIS/config/"  # 토큰 파일이 저장될 폴더, 제3자가 찾기 어렵도록 경로 설정하시기 바랍니다.
 # token_tmp = config_root + 'KIS000000'  # 토큰 로컬저장시 파일 이름 지정, 파일이름을 토큰값이 유추가능한 파일명은 삼가바랍니다.
 # token_tmp = config_root + 'KIS' + datetime.today().strftime("%Y%m%d%H%M%S")  # 토큰 로컬저장시 파일명 년월일시분초
-token_tmp = os.path.join(
-    config_root, f"KIS{datetime.today().strftime("%Y%m%d")}"
-)  # 토큰 로컬저장시 파일명 년월일
 
-# 접근토큰 관리하는 파일 존재여부 체크, 없으면 생성
-if os.path.exists(token_tmp) == False:
-    f = open(token_tmp, "w+")
+# 토큰 파일. 서버별로 하나이며 같은 PC 의 프로세스(Streamlit, scheduler 등)가 함께 사용한다.
+TOKEN_FILE_NAME = "KIS_{svr}_token.json"
+# 만료 이 시간 전에 백그라운드에서 새 토큰을 발급받는다.
+# 발급 후 6시간 이내 재발급 요청은 같은 토큰을 돌려주므로 18시간보다 짧아야 한다.
+TOKEN_REFRESH_MARGIN = timedelta(hours=1)
+# 백그라운드 발급이 실패했을 때 다시 시도하는 간격(초)
+TOKEN_RETRY_SECONDS = 60
+
 
 # 앱키, 앱시크리트, 토큰, 계좌번호 등 저장관리, 자신만의 경로와 파일명으로 설정하시기 바랍니다.
-# pip install PyYAML (패키지설치)
-with open(os.path.join(config_root, "kis_devlp.yaml"), encoding="UTF-8") as f:
-    _cfg = yaml.load(f, Loader=yaml.FullLoader)
+# import 할 때가 아니라 처음 필요할 때 읽는다 (getEnv)
+_cfg = None
+_cfg_lock = threading.Lock()
+_auth_lock = threading.Lock()
 
 _TRENV = tuple()
 _last_auth_time = datetime.now()
 _autoReAuth = False
 _DEBUG = False
 _isPaper = False
+_svr = "prod"
 _smartSleep = 0.1
 
-# 기본 헤더값 정의
+# 서버별 초당 REST 호출 한도. kis_devlp.yaml 의 rate_limit: {prod: 20, vps: 2} 로 바꿀 수 있다.
+_RATE_LIMITS = {"prod": 20, "vps": 2}
+# 호출 한도 초과(EGW00201) 응답을 받았을 때 다시 시도하는 횟수
+_RATE_LIMIT_RETRIES = 3
+_RATE_LIMIT_ERROR_CODE = "EGW00201"
+
+
+class TokenBucket:
+    """초당 rate 개씩 채워지는 토큰 버킷. 프로세스의 모든 스레드가 공유한다.
+
+    호출 한도 초과 응답을 받으면 rate 를 절반으로 줄이고(multiplicative decrease),
+    정상 응답마다 조금씩 max_rate 까지 되돌린다(additive increase).
+    """
+
+    def __init__(self, rate: float, capacity: float = None, min_rate: float = 0.5, increase_step: float = 0.1):
+        self._lock = threading.Lock()
+        self.configure(rate, capacity)
+        self.min_rate = min_rate
+        self.increase_step = increase_step
+        self.counters = {"requests": 0, "waits": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    def configure(self, rate: float, capacity: float = None):
+        with self._lock:
+            self.max_rate = float(rate)
+            self.rate = float(rate)
+            self.capacity = float(capacity or rate)
+            self._tokens = self.capacity
+            self._updated = time.monotonic()
+
+    def reserve(self) -> float:
+        """토큰 하나를 예약하고 호출 전에 기다려야 하는 시간(초)을 반환한다."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = max(0.0, -self._tokens / self.rate)
+            self.counters["requests"] += 1
+            if wait > 0:
+                self.counters["waits"] += 1
+                self.counters["wait_seconds"] += wait
+            return wait
+
+    def wait_time(self) -> float:
+        """토큰을 사용하지 않고 지금 예약하면 기다려야 하는 시간(초)을 반환한다."""
+        with self._lock:
+            tokens = min(self.capacity, self._tokens + (time.monotonic() - self._updated) * self.rate)
+            return max(0.0, (1 - tokens) / self.rate)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_rate_limited(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+            # 이미 쌓인 토큰도 버려서 바로 다음 호출이 몰리지 않게 한다
+            self._tokens = min(self._tokens, 0.0)
+            self.counters["rate_limited"] += 1
+
+    def on_success(self):
+        with self._lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def get_counters(self) -> dict:
+        with self._lock:
+            return dict(self.counters, rate=self.rate, max_rate=self.max_rate)
+
+
+_rate_limiter = TokenBucket(_RATE_LIMITS["prod"])
+
+
+def get_rate_limit_stats() -> dict:
+    return _rate_limiter.get_counters()
+
+
+def _get_rate_limit(svr):
+    return {**_RATE_LIMITS, **(getEnv().get("rate_limit") or {})}[svr]
+
+# 기본 헤더값 정의. User-Agent 는 설정을 읽은 뒤 _getBaseHeader 에서 채운다.
 _base_headers = {
     "Content-Type": "application/json",
     "Accept": "text/plain",
     "charset": "UTF-8",
-    "User-Agent": _cfg["my_agent"],
 }
 
 
+@contextmanager
+def _file_lock(path):
+    """다른 프로세스와 함께 쓰는 파일을 위한 배타적 잠금."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a+") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class TokenManager:
+    """서버(prod/vps)별 REST 접근 토큰 관리.
+
+    - 토큰은 메모리에 보관하므로 API 호출 경로에서는 파일을 읽거나 발급을 기다리지 않는다.
+    - 토큰 파일은 잠금 파일로 보호하고 원자적으로 교체하므로 여러 프로세스가 같은 토큰을 쓴다.
+      (발급할 때마다 알림톡이 발송되므로 프로세스마다 따로 발급받지 않는다)
+    - 만료 TOKEN_REFRESH_MARGIN 전에 백그라운드 스레드가 새 토큰을 받아온다.
+    """
+
+    def __init__(self, svr="prod", token_path=None, app_keys=None):
+        self.svr = svr
+        self.token_path = token_path or os.path.join(config_root, TOKEN_FILE_NAME.format(svr=svr))
+        self.lock_path = self.token_path + ".lock"
+        # (앱키, 앱시크리트). None 이면 kis_devlp.yaml 의 서버별 키를 사용한다.
+        self.app_keys = app_keys
+        self._lock = threading.Lock()
+        self._token = None
+        self._expired = None
+        self._timer = None
+
+    def _get_app_keys(self):
+        if self.app_keys is not None:
+            return self.app_keys
+        _cfg = getEnv()
+        if self.svr == "prod":
+            return _cfg["my_app"], _cfg["my_sec"]
+        return _cfg["paper_app"], _cfg["paper_sec"]
+
+    def _read_file(self):
+        try:
+            with open(self.token_path, encoding="utf-8") as f:
+                data = json.load(f)
+            return data["token"], datetime.strptime(data["valid-date"], "%Y-%m-%d %H:%M:%S")
+        except (OSError, ValueError, KeyError):
+            return None, None
+
+    def _write_file(self, token, expired):
+        tmp_path = f"{self.token_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"token": token, "valid-date": expired.strftime("%Y-%m-%d %H:%M:%S")}, f)
+        os.replace(tmp_path, self.token_path)
+
+    def _issue(self):
+        """/oauth2/tokenP 로 새 토큰을 발급받는다. 실패하면 (None, None)"""
+        appkey, appsecret = self._get_app_keys()
+        p = {"grant_type": "client_credentials", "appkey": appkey, "appsecret": appsecret}
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/plain",
+            "charset": "UTF-8",
+            "User-Agent": getEnv()["my_agent"],
+        }
+        res = http_session.post(f"{getEnv()[self.svr]}/oauth2/tokenP", data=json.dumps(p), headers=headers)
+        if res.status_code != 200:
+            logging.error(f"Get Authentification token fail! {res.status_code} | {res.text}")
+            return None, None
+        body = _getResultObject(res.json())
+        return body.access_token, datetime.strptime(body.access_token_token_expired, "%Y-%m-%d %H:%M:%S")
+
+    def _needs_refresh(self, expired):
+        return expired is None or datetime.now() >= expired - TOKEN_REFRESH_MARGIN
+
+    def _set(self, token, expired):
+        self._token, self._expired = token, expired
+        self._schedule((expired - TOKEN_REFRESH_MARGIN - datetime.now()).total_seconds())
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(max(delay, 0), self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def refresh(self, force=False):
+        """토큰 파일이나 발급 API 에서 토큰을 가져온다.
+
+        다른 프로세스가 먼저 새 토큰을 받아 두었으면 파일의 토큰을 사용하고 발급하지 않는다.
+        """
+        with self._lock, _file_lock(self.lock_path):
+            token, expired = self._read_file()
+            if force or self._needs_refresh(expired):
+                token, expired = self._issue()
+                if token is None:
+                    return None
+                self._write_file(token, expired)
+            self._set(token, expired)
+            return token
+
+    def _refresh_in_background(self):
+        try:
+            token = self.refresh()
+        except Exception as e:
+            logging.error(f"KIS token refresh failed: {e}")
+            token = None
+        if token is None and self._expired is not None and datetime.now() < self._expired:
+            self._schedule(TOKEN_RETRY_SECONDS)
+
+    def peek(self):
+        """발급 요청 없이 메모리나 토큰 파일의 유효한 토큰을 반환한다. 없으면 None"""
+        if self._expired is not None and datetime.now() < self._expired:
+            return self._token
+        token, expired = self._read_file()
+        if expired is not None and datetime.now() < expired:
+            with self._lock:
+                self._set(token, expired)
+            return token
+        return None
+
+    def store(self, token, expired):
+        with self._lock, _file_lock(self.lock_path):
+            self._write_file(token, expired)
+            self._set(token, expired)
+
+    def get_token(self):
+        """유효한 토큰을 반환한다. 처음 호출하거나 토큰이 만료된 경우에만 발급을 기다린다."""
+        if self._expired is not None and datetime.now() < self._expired:
+            return self._token
+        return self.refresh()
+
+    def get_expired(self):
+        return self._expired
+
+
+_token_managers = {}
+_token_managers_lock = threading.Lock()
+
+
+def get_token_manager(svr="prod") -> TokenManager:
+    with _token_managers_lock:
+        if svr not in _token_managers:
+            _token_managers[svr] = TokenManager(svr)
+        return _token_managers[svr]
+
+
+class AppKeyShard:
+    """앱키 하나에 대한 토큰과 호출 한도. 호출 한도는 앱키별로 적용된다."""
+
+    def __init__(self, index, appkey, appsecret, token_manager, rate_limiter):
+        self.index = index
+        self.appkey = appkey
+        self.appsecret = appsecret
+        self.token_manager = token_manager
+        self.rate_limiter = rate_limiter
+
+    def apply_headers(self, headers):
+        headers["authorization"] = f"Bearer {self.token_manager.get_token()}"
+        headers["appkey"] = self.appkey
+        headers["appsecret"] = self.appsecret
+
+
+# 현재 서버의 앱키 목록. 첫 번째는 my_app/my_sec (모의투자는 paper_app/paper_sec) 이다.
+# kis_devlp.yaml 에 추가 앱키를 지정하면 요청을 앱키들에 나눠 보낸다.
+#   my_app_keys:
+#     - {app: "앱키2", sec: "앱시크리트2"}
+#     - {app: "앱키3", sec: "앱시크리트3"}
+#   paper_app_keys: [...]
+_shards = []
+_shards_svr = None
+_shards_lock = threading.Lock()
+
+
+def _configure_shards(svr):
+    global _shards, _shards_svr
+    with _shards_lock:
+        if _shards and _shards_svr == svr:
+            return
+        _cfg = getEnv()
+        rate = _get_rate_limit(svr)
+        prefix = "my" if svr == "prod" else "paper"
+        # 기본 앱키는 기존 토큰 파일과 _rate_limiter 를 그대로 사용한다
+        shards = [AppKeyShard(0, _cfg[f"{prefix}_app"], _cfg[f"{prefix}_sec"], get_token_manager(svr), _rate_limiter)]
+        for i, keys in enumerate(_cfg.get(f"{prefix}_app_keys") or [], start=1):
+            token_path = os.path.join(config_root, TOKEN_FILE_NAME.format(svr=f"{svr}_{i}"))
+            token_manager = TokenManager(svr, token_path=token_path, app_keys=(keys["app"], keys["sec"]))
+            shards.append(AppKeyShard(i, keys["app"], keys["sec"], token_manager, TokenBucket(rate)))
+        _shards, _shards_svr = shards, svr
+
+
+def _select_shard() -> AppKeyShard:
+    """가장 빨리 호출할 수 있는 앱키를 고른다."""
+    if not _shards:  # auth_ws 로만 인증한 경우
+        _configure_shards(_svr)
+    shards = _shards
+    if len(shards) == 1:
+        return shards[0]
+    return min(shards, key=lambda shard: shard.rate_limiter.wait_time())
+
+
+def get_shard_stats() -> list:
+    return [dict(shard.rate_limiter.get_counters(), shard=shard.index) for shard in _shards]
+
+
 # 토큰 발급 받아 저장 (토큰값, 토큰 유효시간,1일, 6시간 이내 발급신청시는 기존 토큰값과 동일, 발급시 알림톡 발송)
-def save_token(my_token, my_expired):
-    # print(type(my_expired), my_expired)
+def save_token(my_token, my_expired, svr="prod"):
     valid_date = datetime.strptime(my_expired, "%Y-%m-%d %H:%M:%S")
-    # print('Save token date: ', valid_date)
-    with open(token_tmp, "w", encoding="utf-8") as f:
-        f.write(f"token: {my_token}\n")
-        f.write(f"valid-date: {valid_date}\n")
+    get_token_manager(svr).store(my_token, valid_date)
 
 
-# 토큰 확인 (토큰값, 토큰 유효시간_1일, 6시간 이내 발급신청시는 기존 토큰값과 동일, 발급시 알림톡 발송)
-def read_token():
-    try:
-        # 토큰이 저장된 파일 읽기
-        with open(token_tmp, encoding="UTF-8") as f:
-            tkg_tmp = yaml.load(f, Loader=yaml.FullLoader)
-
-        # 토큰 만료 일,시간
-        exp_dt = datetime.strftime(tkg_tmp["valid-date"], "%Y-%m-%d %H:%M:%S")
-        # 현재일자,시간
-        now_dt = datetime.today().strftime("%Y-%m-%d %H:%M:%S")
-
-        # print('expire dt: ', exp_dt, ' vs now dt:', now_dt)
-        # 저장된 토큰 만료일자 체크 (만료일시 > 현재일시 인경우 보관 토큰 리턴)
-        if exp_dt > now_dt:
-            return tkg_tmp["token"]
-        else:
-            # print('Need new token: ', tkg_tmp['valid-date'])
-            return None
-    except Exception:
-        # print('read token error: ', e)
-        return None
+# 토큰 확인 (저장된 토큰이 유효하면 토큰값, 아니면 None)
+def read_token(svr="prod"):
+    return get_token_manager(svr).peek()
 
 
 # 토큰 유효시간 체크해서 만료된 토큰이면 재발급처리
 def _getBaseHeader():
     if _autoReAuth:
         reAuth()
+    if "User-Agent" not in _base_headers:
+        _base_headers["User-Agent"] = getEnv()["my_agent"]
+    if "authorization" in _base_headers:
+        # 백그라운드에서 새로 발급받은 토큰을 반영한다
+        _base_headers["authorization"] = f"Bearer {get_token_manager(_svr).get_token()}"
     return copy.deepcopy(_base_headers)
 
 
@@ -136,10 +417,14 @@ def isPaperTrading():  # 모의투자 매매
 
 
 # 실전투자면 'prod', 모의투자면 'vps'를 셋팅 하시기 바랍니다.
-def changeTREnv(token_key, svr="prod", product=_cfg["my_prod"]):
+def changeTREnv(token_key, svr="prod", product=None):
     cfg = dict()
+    _cfg = getEnv()
+    if product is None:
+        product = _cfg["my_prod"]
 
-    global _isPaper
+    global _isPaper, _smartSleep, _svr
+    _svr = svr
     if svr == "prod":  # 실전투자
         ak1 = "my_app"  # 실전투자용 앱키
         ak2 = "my_sec"  # 실전투자용 앱시크리트
@@ -151,6 +436,9 @@ def changeTREnv(token_key, svr="prod", product=_cfg["my_prod"]):
         _isPaper = True
         _smartSleep = 0.5
 
+    if _rate_limiter.max_rate != _get_rate_limit(svr):
+        _rate_limiter.configure(_get_rate_limit(svr))
+
     cfg["my_app"] = _cfg[ak1]
     cfg["my_sec"] = _cfg[ak2]
 
@@ -184,54 +472,33 @@ def changeTREnv(token_key, svr="prod", product=_cfg["my_prod"]):
     _setTRENV(cfg)
 
 
+@lru_cache(maxsize=256)
+def _get_namedtuple_class(typename, fields):
+    # 응답마다 namedtuple 클래스를 새로 만들지 않도록 필드 구성별로 재사용한다
+    return namedtuple(typename, fields)
+
+
 def _getResultObject(json_data):
-    _tc_ = namedtuple("res", json_data.keys())
+    _tc_ = _get_namedtuple_class("res", tuple(json_data.keys()))
 
     return _tc_(**json_data)
 
 
 # Token 발급, 유효기간 1일, 6시간 이내 발급시 기존 token값 유지, 발급시 알림톡 무조건 발송
 # 모의투자인 경우  svr='vps', 투자계좌(01)이 아닌경우 product='XX' 변경하세요 (계좌번호 뒤 2자리)
-def auth(svr="prod", product=_cfg["my_prod"], url=None):
-    p = {
-        "grant_type": "client_credentials",
-    }
-    # 개인 환경파일 "kis_devlp.yaml" 파일을 참조하여 앱키, 앱시크리트 정보 가져오기
-    # 개인 환경파일명과 위치는 고객님만 아는 위치로 설정 바랍니다.
-    if svr == "prod":  # 실전투자
-        ak1 = "my_app"  # 앱키 (실전투자용)
-        ak2 = "my_sec"  # 앱시크리트 (실전투자용)
-    elif svr == "vps":  # 모의투자
-        ak1 = "paper_app"  # 앱키 (모의투자용)
-        ak2 = "paper_sec"  # 앱시크리트 (모의투자용)
-
-    # 앱키, 앱시크리트 가져오기
-    p["appkey"] = _cfg[ak1]
-    p["appsecret"] = _cfg[ak2]
-
-    # 기존 발급된 토큰이 있는지 확인
-    saved_token = read_token()  # 기존 발급 토큰 확인
-    # print("saved_token: ", saved_token)
-    if saved_token is None:  # 기존 발급 토큰 확인이 안되면 발급처리
-        url = f"{_cfg[svr]}/oauth2/tokenP"
-        res = requests.post(
-            url, data=json.dumps(p), headers=_getBaseHeader()
-        )  # 토큰 발급
-        rescode = res.status_code
-        if rescode == 200:  # 토큰 정상 발급
-            my_token = _getResultObject(res.json()).access_token  # 토큰값 가져오기
-            my_expired = _getResultObject(
-                res.json()
-            ).access_token_token_expired  # 토큰값 만료일시 가져오기
-            save_token(my_token, my_expired)  # 새로 발급 받은 토큰 저장
-        else:
-            print("Get Authentification token fail!\nYou have to restart your app!!!")
-            return
-    else:
-        my_token = saved_token  # 기존 발급 토큰 확인되어 기존 토큰 사용
+def auth(svr="prod", product=None, url=None):
+    # 메모리 -> 토큰 파일 -> 발급 순서로 토큰을 가져온다
+    my_token = get_token_manager(svr).get_token()
+    if my_token is None:
+        print("Get Authentification token fail!\nYou have to restart your app!!!")
+        return
 
     # 발급토큰 정보 포함해서 헤더값 저장 관리, API 호출시 필요
     changeTREnv(my_token, svr, product)
+    _configure_shards(svr)
+    # 추가 앱키의 토큰도 미리 받아둔다
+    for shard in _shards[1:]:
+        shard.token_manager.get_token()
 
     _base_headers["authorization"] = f"Bearer {my_token}"
     _base_headers["appkey"] = _TRENV.my_app
@@ -246,16 +513,33 @@ def auth(svr="prod", product=_cfg["my_prod"], url=None):
 
 # end of initialize, 토큰 재발급, 토큰 발급시 유효시간 1일
 # 프로그램 실행시 _last_auth_time에 저장하여 유효시간 체크, 유효시간 만료시 토큰 발급 처리
-def reAuth(svr="prod", product=_cfg["my_prod"]):
+def reAuth(svr="prod", product=None):
     n2 = datetime.now()
     if (n2 - _last_auth_time).seconds >= 86400:  # 유효시간 1일
         auth(svr, product)
 
 
 def getEnv():
+    global _cfg
+    if _cfg is None:
+        with _cfg_lock:
+            if _cfg is None:
+                with open(os.path.join(config_root, "kis_devlp.yaml"), encoding="UTF-8") as f:
+                    _cfg = yaml.load(f, Loader=yaml.FullLoader)
     return _cfg
 
 
+def ensure_auth(svr="prod", product=None):
+    """아직 인증하지 않았으면 인증한다. API 를 처음 호출할 때 불린다."""
+    if _TRENV:
+        return
+    with _auth_lock:
+        if not _TRENV:
+            auth(svr, product)
+    if not _TRENV:
+        raise RuntimeError("KIS authentication failed.")
+
+
 def smart_sleep():
     if _DEBUG:
         print(f"[RateLimit] Sleeping {_smartSleep}s ")
@@ -274,7 +558,7 @@ def getTREnv():
 def set_order_hash_key(h, p):
     url = f"{getTREnv().my_url}/uapi/hashkey"  # hashkey 발급 API URL
 
-    res = requests.post(url, data=json.dumps(p), headers=h)
+    res = http_session.post(url, data=json.dumps(p), headers=h)
     rescode = res.status_code
     if rescode == 200:
         h["hashkey"] = _getResultObject(res.json()).HASH
@@ -300,14 +584,15 @@ class APIResp:
         for x in self._resp.headers.keys():
             if x.islower():
                 fld[x] = self._resp.headers.get(x)
-        _th_ = namedtuple("header", fld.keys())
+        _th_ = _get_namedtuple_class("header", tuple(fld.keys()))
 
         return _th_(**fld)
 
     def _setBody(self):
-        _tb_ = namedtuple("body", self._resp.json().keys())
+        body = self._resp.json()
+        _tb_ = _get_namedtuple_class("body", tuple(body.keys()))
 
-        return _tb_(**self._resp.json())
+        return _tb_(**body)
 
     def getHeader(self):
         return self._header
@@ -411,11 +696,8 @@ class APIRespError(APIResp):
 ########### API call wrapping : API 호출 공통
 
 
-def _url_fetch(
-        api_url, ptr_id, tr_cont, params, appendHeaders=None, postFlag=False, hashFlag=True
-):
-    url = f"{getTREnv().my_url}{api_url}"
-
+def _build_headers(ptr_id, tr_cont, appendHeaders=None):
+    """API 호출 header 와 (모의투자이면 변환된) TR id 를 반환한다. 동기/비동기 호출이 함께 사용한다."""
     headers = _getBaseHeader()  # 기본 header 값 정리
 
     # 추가 Header 설정
@@ -433,18 +715,14 @@ def _url_fetch(
             for x in appendHeaders.keys():
                 headers[x] = appendHeaders.get(x)
 
-    if _DEBUG:
-        print("< Sending Info >")
-        print(f"URL: {url}, TR: {tr_id}")
-        print(f"<header>\n{headers}")
-        print(f"<body>\n{params}")
+    return tr_id, headers
 
-    if postFlag:
-        # if (hashFlag): set_order_hash_key(headers, params)
-        res = requests.post(url, headers=headers, data=json.dumps(params))
-    else:
-        res = requests.get(url, headers=headers, params=params)
 
+def _is_rate_limited(res):
+    return _RATE_LIMIT_ERROR_CODE in res.text
+
+
+def _make_response(res):
     if res.status_code == 200:
         ar = APIResp(res)
         if _DEBUG:
@@ -455,6 +733,72 @@ def _url_fetch(
         return APIRespError(res.status_code, res.text)
 
 
+def _url_fetch(
+        api_url, ptr_id, tr_cont, params, appendHeaders=None, postFlag=False, hashFlag=True
+):
+    ensure_auth()
+    url = f"{getTREnv().my_url}{api_url}"
+
+    tr_id, headers = _build_headers(ptr_id, tr_cont, appendHeaders)
+
+    if _DEBUG:
+        print("< Sending Info >")
+        print(f"URL: {url}, TR: {tr_id}")
+        print(f"<header>\n{headers}")
+        print(f"<body>\n{params}")
+
+    for attempt in range(_RATE_LIMIT_RETRIES + 1):
+        shard = _select_shard()
+        shard.apply_headers(headers)
+        shard.rate_limiter.acquire()
+        if postFlag:
+            # if (hashFlag): set_order_hash_key(headers, params)
+            res = http_session.post(url, headers=headers, data=json.dumps(params))
+        else:
+            res = http_session.get(url, headers=headers, params=params)
+
+        if not _is_rate_limited(res):
+            shard.rate_limiter.on_success()
+            break
+        # 초당 거래건수 초과: 호출 속도를 줄이고 다시 시도
+        shard.rate_limiter.on_rate_limited()
+        if _DEBUG:
+            print(f"[RateLimit] {tr_id} rate limited, retry {attempt + 1}/{_RATE_LIMIT_RETRIES}")
+
+    return _make_response(res)
+
+
+# 응답 header 의 tr_cont 가 이 값이면 다음 페이지가 있다
+_TR_CONT_HAS_NEXT = ("M", "F")
+
+
+def iter_url_fetch(api_url, ptr_id, params, appendHeaders=None, postFlag=False, max_pages=None):
+    """연속조회(tr_cont)로 마지막 페이지까지 응답(APIResp)을 차례로 돌려준다.
+
+    응답 body 의 연속조회키(ctx_area_fk*, ctx_area_nk*)를 다음 요청의 같은 이름 파라미터로 넘기고
+    tr_cont 를 "N" 으로 보낸다. 오류 응답은 돌려준 뒤 멈춘다.
+    """
+    params = dict(params)
+    tr_cont = ""
+    pages = 0
+    while True:
+        res = _url_fetch(api_url, ptr_id, tr_cont, params, appendHeaders, postFlag)
+        yield res
+        pages += 1
+        if not res.isOK() or getattr(res.getHeader(), "tr_cont", "") not in _TR_CONT_HAS_NEXT:
+            return
+        if max_pages is not None and pages >= max_pages:
+            return
+
+        body = res.getBody()
+        param_names = {name.lower(): name for name in params}
+        for field in body._fields:
+            if field.startswith("ctx_area_"):
+                params[param_names.get(field, field.upper())] = getattr(body, field)
+        # 호출 간격은 _url_fetch 의 토큰 버킷이 맞춘다
+        tr_cont = "N"
+
+
 # auth()
 # print("Pass through the end of the line")
 
@@ -473,8 +817,18 @@ def _getBaseHeader_ws():
     return copy.deepcopy(_base_headers_ws)
 
 
-def auth_ws(svr="prod", product=_cfg["my_prod"]):
-    p = {"grant_type": "client_credentials"}
+def issue_approval_key(svr, appkey, appsecret):
+    """웹소켓 접속키를 발급받는다. 실패하면 None"""
+    p = {"grant_type": "client_credentials", "appkey": appkey, "secretkey": appsecret}
+    url = f"{getEnv()[svr]}/oauth2/Approval"
+    res = http_session.post(url, data=json.dumps(p), headers=_getBaseHeader())  # 토큰 발급
+    if res.status_code != 200:
+        return None
+    return _getResultObject(res.json()).approval_key
+
+
+def auth_ws(svr="prod", product=None):
+    _cfg = getEnv()
     if svr == "prod":
         ak1 = "my_app"
         ak2 = "my_sec"
@@ -482,15 +836,8 @@ def auth_ws(svr="prod", product=_cfg["my_prod"]):
         ak1 = "paper_app"
         ak2 = "paper_sec"
 
-    p["appkey"] = _cfg[ak1]
-    p["secretkey"] = _cfg[ak2]
-
-    url = f"{_cfg[svr]}/oauth2/Approval"
-    res = requests.post(url, data=json.dumps(p), headers=_getBaseHeader())  # 토큰 발급
-    rescode = res.status_code
-    if rescode == 200:  # 토큰 정상 발급
-        approval_key = _getResultObject(res.json()).approval_key
-    else:
+    approval_key = issue_approval_key(svr, _cfg[ak1], _cfg[ak2])
+    if approval_key is None:
         print("Get Approval token fail!\nYou have to restart your app!!!")
         return
 
@@ -505,7 +852,25 @@ def auth_ws(svr="prod", product=_cfg["my_prod"]):
         print(f"[{_last_auth_time}] => get AUTH Key completed!")
 
 
-def reAuth_ws(svr="prod", product=_cfg["my_prod"]):
+def get_approval_keys(svr="prod", product=None) -> list:
+    """앱키(_shards)마다 웹소켓 접속키를 발급받는다. 첫 번째는 auth_ws 의 접속키이다.
+
+    접속키 하나로 연결 하나에 MAX_SUBSCRIPTIONS 개까지 구독할 수 있으므로 KISWebSocketPool 이 연결을 나눌 때 사용한다.
+    """
+    if "approval_key" not in _base_headers_ws:
+        auth_ws(svr, product)
+    _configure_shards(svr)
+    approval_keys = [_base_headers_ws["approval_key"]]
+    for shard in _shards[1:]:
+        approval_key = issue_approval_key(svr, shard.appkey, shard.appsecret)
+        if approval_key is None:
+            logging.warning(f"Failed to issue an approval key for app key #{shard.index}.")
+            continue
+        approval_keys.append(approval_key)
+    return approval_keys
+
+
+def reAuth_ws(svr="prod", product=None):
     n2 = datetime.now()
     if (n2 - _last_auth_time).seconds >= 86400:
         auth_ws(svr, product)
@@ -590,12 +955,12 @@ def system_resp(data):
     return nt2(**d)
 
 
-def aes_cbc_base64_dec(key, iv, cipher_text):
+def aes_cbc_base64_dec(key, iv, cipher_text, tr_id=None):
     if key is None or iv is None:
         raise AttributeError("key and iv cannot be None")
 
-    cipher = AES.new(key.encode("utf-8"), AES.MODE_CBC, iv.encode("utf-8"))
-    return bytes.decode(unpad(cipher.decrypt(b64decode(cipher_text)), AES.block_size))
+    # 같은 tr_id, key/iv 의 AES 키 스케줄을 재사용한다
+    return kis_ws_decode.get_decryptor(tr_id, key, iv).decrypt(cipher_text)
 
 
 #####
@@ -607,18 +972,21 @@ def add_open_map(
         request: Callable[[str, str, ...], (dict, list[str])],
         data: str | list[str],
         kwargs: dict = None,
+        target: dict = None,
 ):
-    if open_map.get(name, None) is None:
-        open_map[name] = {
+    # target: 구독 목록. 기본은 모듈의 open_map (연결마다 따로 두려면 KISWebSocket.open_map)
+    target = open_map if target is None else target
+    if target.get(name, None) is None:
+        target[name] = {
             "func": request,
             "items": [],
             "kwargs": kwargs,
         }
 
     if type(data) is list:
-        open_map[name]["items"] += data
+        target[name]["items"] += data
     elif type(data) is str:
-        open_map[name]["items"].append(data)
+        target[name]["items"].append(data)
 
 
 data_map: dict = {}
@@ -630,27 +998,54 @@ def add_data_map(
         encrypt: str = None,
         key: str = None,
         iv: str = None,
+        target: dict = None,
 ):
-    if data_map.get(tr_id, None) is None:
-        data_map[tr_id] = {"columns": [], "encrypt": False, "key": None, "iv": None}
+    target = data_map if target is None else target
+    if target.get(tr_id, None) is None:
+        target[tr_id] = {"columns": [], "encrypt": False, "key": None, "iv": None}
 
     if columns is not None:
-        data_map[tr_id]["columns"] = columns
+        target[tr_id]["columns"] = columns
 
     if encrypt is not None:
-        data_map[tr_id]["encrypt"] = encrypt
+        target[tr_id]["encrypt"] = encrypt
 
     if key is not None:
-        data_map[tr_id]["key"] = key
+        target[tr_id]["key"] = key
 
     if iv is not None:
-        data_map[tr_id]["iv"] = iv
+        target[tr_id]["iv"] = iv
+
+
+# 연결(접속키) 하나에 등록할 수 있는 최대 구독 수
+MAX_SUBSCRIPTIONS = 40
+
+# 실시간 데이터를 받았거나 이 시간(초) 넘게 유지된 연결만 정상 세션으로 보고 재시도 횟수를 다시 센다
+MIN_SESSION_SECONDS = 10
+
+
+def count_subscriptions(target: dict = None) -> int:
+    target = open_map if target is None else target
+    return sum(len(obj["items"]) for obj in target.values())
+
+
+def _as_list(data) -> list:
+    if data is None:
+        return []
+    return [data] if isinstance(data, str) else list(data)
+
+
+# KISWebSocket 이 on_result 에 넘기는 실시간 데이터 형식
+#   frame: 문자열 컬럼의 pd.DataFrame (기존 형식)
+#   batch: kis_ws_decode.WSBatch. 컬럼별 numpy 배열이고 등록된 TR 은 숫자 컬럼이 float64 이다.
+RESULT_FRAME = "frame"
+RESULT_BATCH = "batch"
 
 
 class KISWebSocket:
     api_url: str = ""
     on_result: Callable[
-        [websockets.ClientConnection, str, pd.DataFrame, dict], None
+        [websockets.ClientConnection, str, pd.DataFrame | kis_ws_decode.WSBatch, dict], None
     ] = None
     result_all_data: bool = False
 
@@ -658,33 +1053,57 @@ class KISWebSocket:
     amx_retries: int = 0
 
     # init
-    def __init__(self, api_url: str, max_retries: int = 3):
+    def __init__(self, api_url: str, max_retries: int = 3, result_type: str = RESULT_FRAME, tick_store=None,
+                 approval_key: str = None, open_map: dict = None, data_map: dict = None, dispatcher=None):
         self.api_url = api_url
         self.max_retries = max_retries
+        if result_type not in (RESULT_FRAME, RESULT_BATCH):
+            raise ValueError(f"result_type must be {RESULT_FRAME} or {RESULT_BATCH}")
+        self.result_type = result_type
+        # 실시간 체결을 보관할 tick_store.TickStore. on_result 보다 먼저 기록한다.
+        self.tick_store = tick_store
+        # 연결마다 다른 접속키와 구독 목록을 쓸 때 지정한다 (KISWebSocketPool). 기본은 모듈 전역 값이다.
+        self.approval_key = approval_key
+        self.open_map = globals()["open_map"] if open_map is None else open_map
+        self.data_map = globals()["data_map"] if data_map is None else data_map
+        # 연결된 동안의 websocket. 연결/종료 때 await on_connect(self), await on_disconnect(self) 를 호출한다.
+        self.ws = None
+        self.on_connect = None
+        self.on_disconnect = None
+        # kis_ws_dispatch.WSDispatcher. 지정하면 on_result 를 수신 루프 밖의 워커에서 호출한다.
+        self.dispatcher = dispatcher
+        self.retry_count = 0
+        # 실행 중 구독 변경 요청 (update_subscriptions/set_subscriptions). 재연결 중 구독과 겹치지 않도록 lock 을 잡는다.
+        # lock 은 run() 전에 쓰거나 __runner 를 바로 실행해도 되도록 여기서 만들고, queue 는 run() 에서 만든다.
+        self._loop = None
+        self._control = None
+        self._subscription_lock = asyncio.Lock()
+        self._received_data = False
 
     # private
     async def __subscriber(self, ws: websockets.ClientConnection):
+        typed = self.result_type == RESULT_BATCH
         async for raw in ws:
-            logging.info("received message >> %s" % raw)
+            # 체결 메시지마다 문자열을 만들지 않도록 debug 레벨에서만 남긴다
+            logging.debug("received message >> %s", raw)
             show_result = False
 
-            df = pd.DataFrame()
+            result = kis_ws_decode.WSBatch(None, [], {}) if typed else pd.DataFrame()
 
             if raw[0] in ["0", "1"]:
-                d1 = raw.split("|")
-                if len(d1) < 4:
-                    raise ValueError("data not found...")
-
-                tr_id = d1[1]
-
-                dm = data_map[tr_id]
-                d = d1[3]
-                if dm.get("encrypt", None) == "Y":
-                    d = aes_cbc_base64_dec(dm["key"], dm["iv"], d)
-
-                df = pd.read_csv(
-                    StringIO(d), header=None, sep="^", names=dm["columns"], dtype=object
-                )
+                self._received_data = True
+                try:
+                    batch = kis_ws_decode.decode_frame(raw, self.data_map, typed=typed)
+                except Exception as e:
+                    # 깨진 메시지 하나 때문에 연결을 끊지 않는다
+                    logging.warning("Skipped a realtime message that could not be decoded (%s): %s", e, raw[:200])
+                    continue
+                if len(batch) == 0:
+                    continue
+                tr_id = batch.tr_id
+                result = batch if typed else batch.to_frame()
+                if self.tick_store is not None:
+                    self.tick_store.append_result(tr_id, result)
 
                 show_result = True
 
@@ -693,7 +1112,7 @@ class KISWebSocket:
 
                 tr_id = rsp.tr_id
                 add_data_map(
-                    tr_id=rsp.tr_id, encrypt=rsp.encrypt, key=rsp.ekey, iv=rsp.iv
+                    tr_id=rsp.tr_id, encrypt=rsp.encrypt, key=rsp.ekey, iv=rsp.iv, target=self.data_map
                 )
 
                 if rsp.isPingPong:
@@ -704,23 +1123,32 @@ class KISWebSocket:
                 if self.result_all_data:
                     show_result = True
 
-            if show_result is True and self.on_result is not None:
-                self.on_result(ws, tr_id, df, data_map[tr_id])
+            if show_result is True and self.dispatcher is not None:
+                await self.dispatcher.put(ws, tr_id, result, self.data_map[tr_id])
+            elif show_result is True and self.on_result is not None:
+                self.on_result(ws, tr_id, result, self.data_map[tr_id])
 
     async def __runner(self):
-        if len(open_map.keys()) > 40:
-            raise ValueError("Subscription's max is 40")
+        if count_subscriptions(self.open_map) > MAX_SUBSCRIPTIONS:
+            raise ValueError(f"Subscription's max is {MAX_SUBSCRIPTIONS}. Use KISWebSocketPool for more.")
 
         url = f"{getTREnv().my_url_ws}{self.api_url}"
 
         while self.retry_count < self.max_retries:
+            connected_at = None
+            self._received_data = False
             try:
                 async with websockets.connect(url) as ws:
-                    # request subscribe
-                    for name, obj in open_map.items():
-                        await self.send_multiple(
-                            ws, obj["func"], "1", obj["items"], obj["kwargs"]
-                        )
+                    # request subscribe. 재연결이면 지금 open_map 에 남은 구독만 다시 보낸다
+                    async with self._subscription_lock:
+                        self.ws = ws
+                        for name, obj in list(self.open_map.items()):
+                            await self.send_multiple(
+                                ws, obj["func"], "1", list(obj["items"]), obj["kwargs"]
+                            )
+                    connected_at = time.monotonic()
+                    if self.on_connect is not None:
+                        await self.on_connect(self)
 
                     # subscriber
                     await asyncio.gather(
@@ -728,13 +1156,23 @@ class KISWebSocket:
                     )
             except Exception as e:
                 print("Connection exception >> ", e)
+            finally:
+                if self.ws is not None:
+                    self.ws = None
+                    if self.on_disconnect is not None:
+                        await self.on_disconnect(self)
+
+            # 연결하자마자 끊기는 서버에 끝없이 다시 붙지 않도록 정상 세션이었을 때만 재시도 횟수를 다시 센다
+            if connected_at is not None and (
+                    self._received_data or time.monotonic() - connected_at >= MIN_SESSION_SECONDS):
+                self.retry_count = 0
+            else:
                 self.retry_count += 1
                 await asyncio.sleep(1)
 
     # func
-    @classmethod
     async def send(
-            cls,
+            self,
             ws: websockets.ClientConnection,
             request: Callable[[str, str, ...], (dict, list[str])],
             tr_type: str,
@@ -743,13 +1181,16 @@ class KISWebSocket:
     ):
         k = {} if kwargs is None else kwargs
         msg, columns = request(tr_type, data, **k)
+        if self.approval_key is not None:
+            msg["header"]["approval_key"] = self.approval_key
 
-        add_data_map(tr_id=msg["body"]["input"]["tr_id"], columns=columns)
+        add_data_map(tr_id=msg["body"]["input"]["tr_id"], columns=columns, target=self.data_map)
 
         logging.info("send message >> %s" % json.dumps(msg))
 
         await ws.send(json.dumps(msg))
-        smart_sleep()
+        # 같은 이벤트 루프의 다른 연결이 멈추지 않도록 time.sleep 대신 기다린다
+        await asyncio.sleep(_smartSleep)
 
     async def send_multiple(
             self,
@@ -776,25 +1217,144 @@ class KISWebSocket:
     ):
         add_open_map(request.__name__, request, data, kwargs)
 
-    def unsubscribe(
+    async def unsubscribe(
             self,
             ws: websockets.ClientConnection,
             request: Callable[[str, str, ...], (dict, list[str])],
             data: list | str,
     ):
-        self.send_multiple(ws, request, "2", data)
+        await self.apply_subscriptions(request, remove=data, ws=ws)
+
+    def _diff_subscriptions(self, request, data, add, remove, kwargs) -> tuple[list, list, dict]:
+        # open_map 을 새 구독 목록으로 바꾸고 (추가할 종목, 해지할 종목, kwargs) 를 반환한다
+        name = request.__name__
+        obj = self.open_map.get(name)
+        current = [] if obj is None else obj["items"]
+        kwargs = kwargs if kwargs is not None or obj is None else obj["kwargs"]
+
+        removing = set(_as_list(remove))
+        target = list(current) if data is None else _as_list(data)
+        target = [item for item in dict.fromkeys(target + _as_list(add)) if item not in removing]
+        added = [item for item in target if item not in current]
+        removed = [item for item in current if item not in target]
+
+        room = MAX_SUBSCRIPTIONS - count_subscriptions(self.open_map) + len(removed)
+        if len(added) > room:
+            skipped = added[max(room, 0):]
+            logging.warning(f"Subscription's max is {MAX_SUBSCRIPTIONS}. Skipped {len(skipped)} of {name}.")
+            added = added[:max(room, 0)]
+            target = [item for item in target if item not in skipped]
+
+        if target:
+            self.open_map[name] = {"func": request, "items": target, "kwargs": kwargs}
+        elif obj is not None:
+            del self.open_map[name]
+        return added, removed, kwargs
+
+    async def apply_subscriptions(
+            self,
+            request: Callable[[str, str, ...], (dict, list[str])],
+            data: list | str = None,
+            add: list | str = None,
+            remove: list | str = None,
+            kwargs: dict = None,
+            ws: websockets.ClientConnection = None,
+    ) -> tuple[list, list]:
+        """이벤트 루프 안에서 구독을 바꾼다. data 를 주면 request 의 구독 목록을 data 로 바꾸고, add/remove 는 더하고 뺀다.
+
+        open_map 과 비교해 달라진 종목만 해지("2")/등록("1")한다. 연결되어 있지 않으면 open_map 만 바꾸고
+        다음 연결 때 보낸다.
+
+        Returns:
+            tuple: (등록한 종목, 해지한 종목)
+        """
+        async with self._subscription_lock:
+            added, removed, kwargs = self._diff_subscriptions(request, data, add, remove, kwargs)
+            ws = self.ws if ws is None else ws
+            if ws is not None:
+                try:
+                    # 해지를 먼저 보내 구독 수 제한에 자리를 만든다
+                    await self.send_multiple(ws, request, "2", removed, kwargs)
+                    await self.send_multiple(ws, request, "1", added, kwargs)
+                except Exception as e:
+                    # 끊긴 연결이면 재연결할 때 open_map 대로 다시 구독한다
+                    logging.warning(f"Failed to update subscriptions of {request.__name__}: {e}")
+        return added, removed
+
+    def update_subscriptions(
+            self,
+            request: Callable[[str, str, ...], (dict, list[str])],
+            add: list | str = None,
+            remove: list | str = None,
+            kwargs: dict = None,
+    ):
+        """실행 중인 연결에 종목을 추가/해지한다. on_result 나 다른 스레드에서 불러도 된다.
+
+        시작 전이면 open_map 만 바꾼다.
+        """
+        self._put_control(request, None, add, remove, kwargs)
+
+    def set_subscriptions(
+            self,
+            request: Callable[[str, str, ...], (dict, list[str])],
+            data: list | str,
+            kwargs: dict = None,
+    ):
+        """request 의 구독 종목을 data 로 바꾼다. 빠진 종목은 해지하고 새 종목만 등록한다."""
+        self._put_control(request, data, None, None, kwargs)
+
+    def _put_control(self, request, data, add, remove, kwargs):
+        if self._loop is None:
+            self._diff_subscriptions(request, data, add, remove, kwargs)
+        else:
+            self._loop.call_soon_threadsafe(self._control.put_nowait, (request, data, add, remove, kwargs))
+
+    async def __controller(self):
+        while True:
+            request, data, add, remove, kwargs = await self._control.get()
+            try:
+                await self.apply_subscriptions(request, data, add, remove, kwargs)
+            except Exception as e:
+                # 요청 하나가 실패해도 다음 구독 변경 요청을 계속 처리한다
+                logging.error(f"Failed to apply subscription change of {request.__name__}: {e}")
 
     # start
-    def start(
+    async def run(
             self,
             on_result: Callable[
-                [websockets.ClientConnection, str, pd.DataFrame, dict], None
+                [websockets.ClientConnection, str, pd.DataFrame | kis_ws_decode.WSBatch, dict], None
             ],
             result_all_data: bool = False,
     ):
+        """실행 중인 이벤트 루프에서 연결한다. 재시도 횟수를 다 쓰면 끝난다."""
         self.on_result = on_result
         self.result_all_data = result_all_data
+        # 풀처럼 dispatcher 를 여러 연결이 함께 쓰면 먼저 띄운 쪽이 관리한다
+        own_dispatcher = self.dispatcher is not None and not self.dispatcher.running
+        if own_dispatcher:
+            self.dispatcher.start(on_result)
+        self._loop = asyncio.get_running_loop()
+        self._control = asyncio.Queue()
+        # start() 를 다시 부르면 이벤트 루프가 바뀌므로 새 loop 에 묶일 lock 을 만든다
+        self._subscription_lock = asyncio.Lock()
+        self.retry_count = 0
+        controller = asyncio.create_task(self.__controller())
+        try:
+            await self.__runner()
+        finally:
+            controller.cancel()
+            self._loop = None
+            if own_dispatcher:
+                await self.dispatcher.stop()
+
+    def start(
+            self,
+            on_result: Callable[
+                [websockets.ClientConnection, str, pd.DataFrame | kis_ws_decode.WSBatch, dict], None
+            ],
+            result_all_data: bool = False,
+    ):
         try:
-            asyncio.run(self.__runner())
+            asyncio.run(self.run(on_result, result_all_data))
         except KeyboardInterrupt:
             print("Closing by KeyboardInterrupt")
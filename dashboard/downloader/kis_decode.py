@@ -0,0 +1,265 @@
+# KIS REST 응답의 output 배열을 TR 별 스키마에 따라 바로 타입이 지정된 DataFrame 으로 변환한다.
+#
+# KIS 는 모든 값을 문자열로 보내므로 pd.DataFrame(output) 으로 만든 뒤 컬럼마다 astype 하면
+# 문자열 object 컬럼을 만들고 다시 한 번 변환하게 된다. 여기서는 숫자 필드를 레코드에서 바로
+# 2차원 numpy 배열로 변환한다.
+#
+#   python -m downloader.kis_decode   # 디코딩 벤치마크
+import json
+import logging
+import os
+import time
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+import downloader.kis_auth as ka
+
+
+logger = logging.getLogger(__name__)
+
+
+# analysis/kis/datautil.py 가 KIS API 문서로 만드는 TR id 별 요약
+SPEC_INDEX_FILE = os.path.realpath(os.path.join(os.path.dirname(__file__), "..", "data", "KIS", "api_spec_index.json"))
+# 문서의 필드 타입 -> dtype. 그 밖의 타입은 문자열로 둔다.
+SPEC_TYPE_DTYPES = {"number": np.float64}
+
+
+class KISAPIError(Exception):
+    """KIS 가 오류(rt_cd != "0" 또는 HTTP 오류)로 응답했다.
+
+    빈 응답(더 받을 데이터 없음)과 구별되도록 빈 DataFrame 대신 던진다.
+    """
+
+    def __init__(self, tr_id, code, message):
+        super().__init__(f"{tr_id} failed: [{code}] {message}")
+        self.tr_id = tr_id
+        self.code = code
+        self.message = message
+
+
+class ResponseSchema:
+    """TR 하나의 응답 스키마.
+
+    Args:
+        tr_id (str): 실전투자 TR id
+        api_url (str): API 경로
+        outputs (dict): {output 이름: {필드: dtype}}. 스키마에 없는 필드는 문자열로 둔다.
+    """
+
+    def __init__(self, tr_id, api_url, outputs):
+        self.tr_id = tr_id
+        self.api_url = api_url
+        self.outputs = outputs
+
+    def get_fields(self, output="output"):
+        return self.outputs[output]
+
+    def get_typed_fields(self, output="output"):
+        """문자열이 아닌 필드의 {필드: dtype}"""
+        return {name: dtype for name, dtype in self.outputs[output].items() if dtype is not str}
+
+
+_schemas = {}
+
+
+def register_schema(schema: ResponseSchema) -> ResponseSchema:
+    _schemas[schema.tr_id] = schema
+    return schema
+
+
+_spec_index_loaded = False
+
+
+def load_spec_index(path=SPEC_INDEX_FILE) -> int:
+    """api_spec_index.json 의 TR 들을 스키마로 등록한다. 직접 등록한 스키마는 바꾸지 않는다.
+
+    Returns:
+        int: 새로 등록한 TR 수
+    """
+    global _spec_index_loaded
+    _spec_index_loaded = True
+    if not os.path.exists(path):
+        logger.warning(f"{path} is missing. Run analysis/kis/datautil.py to build the KIS API spec index.")
+        return 0
+    with open(path, encoding="utf-8") as f:
+        spec_index = json.load(f)
+
+    count = 0
+    for tr_id, spec in spec_index.items():
+        if tr_id in _schemas:
+            continue
+        outputs = {
+            output: {name: SPEC_TYPE_DTYPES.get(str(field_type).lower(), str) for name, field_type in fields.items()}
+            for output, fields in spec["response"].items() if output
+        }
+        _schemas[tr_id] = ResponseSchema(tr_id, spec["url"], outputs)
+        count += 1
+    logger.info(f"Loaded {count} response schemas from {path}.")
+    return count
+
+
+def get_schema(tr_id) -> ResponseSchema:
+    if tr_id not in _schemas and not _spec_index_loaded:
+        load_spec_index()
+    if tr_id not in _schemas:
+        raise ValueError(f"Response schema for {tr_id} is not registered.")
+    return _schemas[tr_id]
+
+
+##############################################################################################
+# [국내주식] 시세분석 > 시장별 투자자매매동향(일별) [국내주식-075]
+##############################################################################################
+
+INVESTOR_DAILY_BY_MARKET = register_schema(ResponseSchema(
+    tr_id="FHPTJ04040000",
+    api_url="/uapi/domestic-stock/v1/quotations/inquire-investor-daily-by-market",
+    outputs={
+        "output": {
+            "stck_bsop_date": str,
+            "bstp_nmix_prpr": np.float64,
+            "bstp_nmix_prdy_vrss": np.float64,
+            "prdy_vrss_sign": np.float64,
+            "bstp_nmix_prdy_ctrt": np.float64,
+            "bstp_nmix_oprc": np.float64,
+            "bstp_nmix_hgpr": np.float64,
+            "bstp_nmix_lwpr": np.float64,
+            "stck_prdy_clpr": np.float64,
+            "frgn_ntby_qty": np.float64,
+            "frgn_reg_ntby_qty": np.float64,
+            "frgn_nreg_ntby_qty": np.float64,
+            "prsn_ntby_qty": np.float64,
+            "orgn_ntby_qty": np.float64,
+            "scrt_ntby_qty": np.float64,
+            "ivtr_ntby_qty": np.float64,
+            "pe_fund_ntby_vol": np.float64,
+            "bank_ntby_qty": np.float64,
+            "insu_ntby_qty": np.float64,
+            "mrbn_ntby_qty": np.float64,
+            "fund_ntby_qty": np.float64,
+            "etc_ntby_qty": np.float64,
+            "etc_orgt_ntby_vol": np.float64,
+            "etc_corp_ntby_vol": np.float64,
+            "frgn_ntby_tr_pbmn": np.float64,
+            "frgn_reg_ntby_pbmn": np.float64,
+            "frgn_nreg_ntby_pbmn": np.float64,
+            "prsn_ntby_tr_pbmn": np.float64,
+            "orgn_ntby_tr_pbmn": np.float64,
+            "scrt_ntby_tr_pbmn": np.float64,
+            "ivtr_ntby_tr_pbmn": np.float64,
+            "pe_fund_ntby_tr_pbmn": np.float64,
+            "bank_ntby_tr_pbmn": np.float64,
+            "insu_ntby_tr_pbmn": np.float64,
+            "mrbn_ntby_tr_pbmn": np.float64,
+            "fund_ntby_tr_pbmn": np.float64,
+            "etc_ntby_tr_pbmn": np.float64,
+            "etc_orgt_ntby_tr_pbmn": np.float64,
+            "etc_corp_ntby_tr_pbmn": np.float64,
+        },
+    },
+))
+
+
+def _to_numeric(values, dtype):
+    try:
+        return np.array(values, dtype=dtype)
+    except ValueError:
+        # 빈 문자열 등 숫자가 아닌 값은 NaN 으로 둔다
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def decode_records(records, fields) -> pd.DataFrame:
+    """output 레코드(dict 목록)를 fields({필드: dtype}) 에 따라 변환한다.
+
+    같은 dtype 의 숫자 필드들은 레코드에서 한 번에 꺼내 2차원 배열 하나로 변환하므로
+    DataFrame 도 컬럼마다가 아니라 dtype 마다 하나의 블록을 갖는다.
+    첫 레코드의 필드 순서를 따르고 스키마에 없는 필드는 문자열 컬럼이 된다.
+    """
+    if not records:
+        return pd.DataFrame({name: pd.Series(dtype=object if dtype is str else dtype) for name, dtype in fields.items()})
+    if isinstance(records, dict):
+        records = [records]
+
+    names = list(records[0].keys())
+    groups = {}
+    for name in names:
+        dtype = fields.get(name, str)
+        if dtype is not str:
+            groups.setdefault(np.dtype(dtype), []).append(name)
+
+    frames = []
+    for dtype, group in groups.items():
+        getter = itemgetter(*group)
+        values = list(map(getter, records)) if len(group) > 1 else [(getter(record),) for record in records]
+        try:
+            block = np.array(values, dtype=dtype)
+        except ValueError:
+            block = np.column_stack([_to_numeric([row[i] for row in values], dtype) for i in range(len(group))])
+        frames.append(pd.DataFrame(block, columns=group, copy=False))
+
+    if not frames:
+        df = pd.DataFrame(index=range(len(records)))
+    elif len(frames) == 1:
+        df = frames[0]
+    else:
+        df = pd.concat(frames, axis=1)
+    for loc, name in enumerate(names):
+        if fields.get(name, str) is str:
+            df.insert(loc, name, np.array([record[name] for record in records], dtype=object))
+    return df
+
+
+def decode_response(res, tr_id, output="output") -> pd.DataFrame:
+    """APIResp 의 output 을 tr_id 스키마로 변환한다. 오류 응답이면 KISAPIError"""
+    schema = get_schema(tr_id)
+    fields = schema.get_fields(output)
+    if not res.isOK():
+        res.printError(schema.api_url)
+        raise KISAPIError(tr_id, res.getErrorCode(), res.getErrorMessage())
+    return decode_records(getattr(res.getBody(), output, None) or [], fields)
+
+
+def fetch_decoded(tr_id, params, output="output", tr_cont="") -> pd.DataFrame:
+    """tr_id 를 호출하고 output 을 스키마 타입으로 반환한다."""
+    schema = get_schema(tr_id)
+    res = ka._url_fetch(schema.api_url, tr_id, tr_cont, params)
+    return decode_response(res, tr_id, output)
+
+
+def iter_fetch_decoded(tr_id, params, output="output", max_pages=None):
+    """tr_id 를 연속조회(tr_cont)로 끝까지 호출하면서 페이지마다 output 을 스키마 타입으로 돌려준다."""
+    schema = get_schema(tr_id)
+    for res in ka.iter_url_fetch(schema.api_url, tr_id, params, max_pages=max_pages):
+        yield decode_response(res, tr_id, output)
+
+
+def _decode_by_astype(records, fields):
+    # 이전 방식: 문자열 DataFrame 을 만든 뒤 컬럼마다 astype
+    df = pd.DataFrame(records)
+    for name, dtype in fields.items():
+        if dtype is not str and name in df.columns:
+            df[name] = df[name].astype(dtype)
+    return df
+
+
+def run_benchmark(n_rows=100_000, repeat=5):
+    fields = INVESTOR_DAILY_BY_MARKET.get_fields()
+    rng = np.random.default_rng(0)
+    records = [
+        {name: "20250102" if dtype is str else f"{rng.normal() * 1000:.2f}" for name, dtype in fields.items()}
+        for _ in range(n_rows)
+    ]
+    for label, decode in (("astype", _decode_by_astype), ("decode_records", decode_records)):
+        elapsed = min(_time(decode, records, fields) for _ in range(repeat))
+        print(f"{label:>15}: {n_rows / elapsed:12,.0f} rows/sec ({elapsed * 1000:.1f} ms for {n_rows:,} rows)")
+
+
+def _time(function, *args):
+    begin = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - begin
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,221 @@
+# KIS 웹소켓 실시간 데이터를 pandas 없이 컬럼별 배열로 디코딩한다.
+#
+# 실시간 데이터 메시지: 암호화 여부(0/1)|tr_id|데이터 건수|데이터
+# 데이터는 '^' 로 구분된 값이고, 건수가 2 이상이면 여러 레코드가 '^' 로 이어져 온다.
+# 그래서 값 목록을 컬럼 수 간격으로 잘라(fields[i::n]) 컬럼 i 의 모든 레코드 값을 한 번에 꺼낸다.
+#
+# 암호화된 TR(체결통보 등)은 tr_id 마다 AES 키 스케줄(ECB 객체)을 한 번만 만들고 CBC 는 직접 XOR 한다.
+#
+#   python -m downloader.kis_ws_decode   # 디코딩 벤치마크
+import logging
+import time
+from base64 import b64decode
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import unpad
+
+
+logger = logging.getLogger(__name__)
+
+# tr_id -> {컬럼: dtype}. 등록되지 않은 컬럼은 문자열(object)로 둔다.
+_ws_schemas = {}
+
+
+def register_ws_schema(tr_id, dtypes: dict) -> dict:
+    _ws_schemas[tr_id] = dtypes
+    return dtypes
+
+
+##############################################################################################
+# [국내주식] 실시간시세 > 국내주식 실시간체결가 (KRX) [실시간-003]
+##############################################################################################
+
+H0STCNT0_COLUMNS = [
+    "MKSC_SHRN_ISCD", "STCK_CNTG_HOUR", "STCK_PRPR", "PRDY_VRSS_SIGN", "PRDY_VRSS", "PRDY_CTRT",
+    "WGHN_AVRG_STCK_PRC", "STCK_OPRC", "STCK_HGPR", "STCK_LWPR", "ASKP1", "BIDP1", "CNTG_VOL", "ACML_VOL",
+    "ACML_TR_PBMN", "SELN_CNTG_CSNU", "SHNU_CNTG_CSNU", "NTBY_CNTG_CSNU", "CTTR", "SELN_CNTG_SMTN",
+    "SHNU_CNTG_SMTN", "CCLD_DVSN", "SHNU_RATE", "PRDY_VOL_VRSS_ACML_VOL_RATE", "OPRC_HOUR",
+    "OPRC_VRSS_PRPR_SIGN", "OPRC_VRSS_PRPR", "HGPR_HOUR", "HGPR_VRSS_PRPR_SIGN", "HGPR_VRSS_PRPR",
+    "LWPR_HOUR", "LWPR_VRSS_PRPR_SIGN", "LWPR_VRSS_PRPR", "BSOP_DATE", "NEW_MKOP_CLS_CODE", "TRHT_YN",
+    "ASKP_RSQN1", "BIDP_RSQN1", "TOTAL_ASKP_RSQN", "TOTAL_BIDP_RSQN", "VOL_TNRT", "PRDY_SMNS_HOUR_ACML_VOL",
+    "PRDY_SMNS_HOUR_ACML_VOL_RATE", "HOUR_CLS_CODE", "MRKT_TRTM_CLS_CODE", "VI_STND_PRC",
+]
+
+# 종목코드, 시각, 날짜, 부호와 구분 코드는 문자열로 둔다
+_H0STCNT0_STRING_COLUMNS = {
+    "MKSC_SHRN_ISCD", "STCK_CNTG_HOUR", "PRDY_VRSS_SIGN", "CCLD_DVSN", "OPRC_HOUR", "OPRC_VRSS_PRPR_SIGN",
+    "HGPR_HOUR", "HGPR_VRSS_PRPR_SIGN", "LWPR_HOUR", "LWPR_VRSS_PRPR_SIGN", "BSOP_DATE", "NEW_MKOP_CLS_CODE",
+    "TRHT_YN", "HOUR_CLS_CODE", "MRKT_TRTM_CLS_CODE",
+}
+
+register_ws_schema("H0STCNT0", {
+    name: np.float64 for name in H0STCNT0_COLUMNS if name not in _H0STCNT0_STRING_COLUMNS
+})
+
+
+class WSDecryptor:
+    """tr_id 하나의 AES-CBC 복호화.
+
+    AES.new(..., MODE_CBC) 는 메시지마다 키 스케줄을 새로 만들어야 하므로, 상태가 없는 ECB 객체를
+    재사용해 블록을 복호화한 뒤 앞 블록(첫 블록은 iv)과 XOR 한다.
+    """
+
+    def __init__(self, key, iv):
+        self.key = key
+        self.iv = iv
+        self._ecb = AES.new(key.encode("utf-8"), AES.MODE_ECB)
+        self._iv = iv.encode("utf-8")
+
+    def decrypt(self, cipher_text) -> str:
+        data = b64decode(cipher_text)
+        blocks = self._ecb.decrypt(data)
+        chain = self._iv + data[:-AES.block_size]
+        plain = (int.from_bytes(blocks, "big") ^ int.from_bytes(chain, "big")).to_bytes(len(blocks), "big")
+        return unpad(plain, AES.block_size).decode("utf-8")
+
+
+# 접속키(연결)마다 같은 tr_id 의 key/iv 가 다르므로 (tr_id, key, iv) 로 구분한다
+_decryptors = {}
+# 재연결로 key/iv 가 바뀌어 쌓이는 것을 막는다. 넘으면 가장 먼저 만든 것부터 지운다.
+MAX_DECRYPTORS = 256
+
+
+def get_decryptor(tr_id, key, iv) -> WSDecryptor:
+    """(tr_id, key, iv) 의 복호화 객체. 구독 응답으로 key/iv 가 바뀌면 새로 만든다."""
+    if key is None or iv is None:
+        raise AttributeError("key and iv cannot be None")
+    cache_key = (tr_id, key, iv)
+    decryptor = _decryptors.get(cache_key)
+    if decryptor is None:
+        while len(_decryptors) >= MAX_DECRYPTORS:
+            del _decryptors[next(iter(_decryptors))]
+        decryptor = _decryptors[cache_key] = WSDecryptor(key, iv)
+    return decryptor
+
+
+class WSBatch:
+    """메시지 하나(레코드 1건 이상)의 디코딩 결과. data 는 {컬럼: numpy 배열}"""
+
+    __slots__ = ("tr_id", "columns", "data")
+
+    def __init__(self, tr_id, columns, data):
+        self.tr_id = tr_id
+        self.columns = columns
+        self.data = data
+
+    def __len__(self):
+        return len(self.data[self.columns[0]]) if self.columns else 0
+
+    def __getitem__(self, column):
+        return self.data[column]
+
+    def records(self) -> list:
+        """레코드별 dict 목록"""
+        return [dict(zip(self.columns, values)) for values in zip(*(self.data[c] for c in self.columns))]
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame(self.data, columns=self.columns, copy=False)
+
+
+def _to_array(values, dtype):
+    if dtype is None:
+        return np.array(values, dtype=object)
+    try:
+        return np.array(values, dtype=dtype)
+    except ValueError:
+        # 빈 문자열 등 숫자가 아닌 값은 NaN 으로 둔다
+        return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(dtype=np.float64)
+
+
+def decode_payload(tr_id, payload, columns, typed=True) -> WSBatch:
+    """'^' 로 구분된 데이터(레코드 여러 건 가능)를 컬럼별 배열로 나눈다.
+
+    typed 가 False 이면 모든 컬럼을 문자열로 둔다. 값 수가 컬럼 수의 배수가 아니면 온전한 레코드까지만 남긴다.
+    """
+    fields = payload.split("^")
+    if not columns:
+        columns = [str(i) for i in range(len(fields))]
+    n_columns = len(columns)
+    if len(fields) % n_columns:
+        logger.warning(f"{tr_id}: {len(fields)} values do not fit {n_columns} columns. "
+                       f"Dropped the last {len(fields) % n_columns} values.")
+        fields = fields[:len(fields) - len(fields) % n_columns]
+
+    dtypes = _ws_schemas.get(tr_id, {}) if typed else {}
+    data = {name: _to_array(fields[i::n_columns], dtypes.get(name)) for i, name in enumerate(columns)}
+    return WSBatch(tr_id, columns, data)
+
+
+def decode_frame(raw, data_map, typed=True) -> WSBatch:
+    """실시간 데이터 메시지 하나를 디코딩한다. data_map 은 kis_auth.data_map (tr_id 별 컬럼, 암호화 정보)"""
+    parts = raw.split("|", 3)
+    if len(parts) < 4:
+        raise ValueError("data not found...")
+    tr_id, payload = parts[1], parts[3]
+    dm = data_map[tr_id]
+    if dm.get("encrypt", None) == "Y":
+        payload = get_decryptor(tr_id, dm["key"], dm["iv"]).decrypt(payload)
+    return decode_payload(tr_id, payload, dm["columns"], typed)
+
+
+def _decode_by_read_csv(raw, data_map):
+    # 이전 방식: 메시지마다 AES 객체를 만들고 pd.read_csv 로 DataFrame 을 만든다
+    d1 = raw.split("|")
+    dm = data_map[d1[1]]
+    d = d1[3]
+    if dm.get("encrypt", None) == "Y":
+        cipher = AES.new(dm["key"].encode("utf-8"), AES.MODE_CBC, dm["iv"].encode("utf-8"))
+        d = bytes.decode(unpad(cipher.decrypt(b64decode(d)), AES.block_size))
+    return pd.read_csv(StringIO(d), header=None, sep="^", names=dm["columns"], dtype=object)
+
+
+def _make_frames(n_messages, records_per_message, encrypt):
+    from base64 import b64encode
+    from Crypto.Util.Padding import pad
+
+    key, iv = "k" * 32, "i" * 16
+    data_map = {"H0STCNT0": {"columns": H0STCNT0_COLUMNS, "encrypt": "Y" if encrypt else "N", "key": key, "iv": iv}}
+    rng = np.random.default_rng(0)
+    frames = []
+    for _ in range(n_messages):
+        values = []
+        for _ in range(records_per_message):
+            values += [
+                "005930" if name == "MKSC_SHRN_ISCD" else "093015" if name in _H0STCNT0_STRING_COLUMNS
+                else f"{rng.integers(1, 100000)}"
+                for name in H0STCNT0_COLUMNS
+            ]
+        payload = "^".join(values)
+        if encrypt:
+            cipher = AES.new(key.encode("utf-8"), AES.MODE_CBC, iv.encode("utf-8"))
+            payload = b64encode(cipher.encrypt(pad(payload.encode("utf-8"), AES.block_size))).decode("ascii")
+        frames.append(f"{int(encrypt)}|H0STCNT0|{records_per_message:03d}|{payload}")
+    return frames, data_map
+
+
+def run_benchmark(n_messages=1_000, repeat=3):
+    for records_per_message, encrypt in ((1, False), (4, False), (1, True)):
+        frames, data_map = _make_frames(n_messages, records_per_message, encrypt)
+        print(f"{records_per_message} record(s) per message, encrypt={encrypt}")
+        decoders = (
+            ("read_csv", lambda raw: _decode_by_read_csv(raw, data_map)),
+            ("decode_frame", lambda raw: decode_frame(raw, data_map)),
+            ("decode_frame(str)", lambda raw: decode_frame(raw, data_map, typed=False)),
+        )
+        for label, decode in decoders:
+            elapsed = min(_time(decode, frames) for _ in range(repeat))
+            print(f"{label:>20}: {n_messages / elapsed:12,.0f} messages/sec ({elapsed * 1000:.1f} ms)")
+
+
+def _time(decode, frames):
+    begin = time.perf_counter()
+    for raw in frames:
+        decode(raw)
+    return time.perf_counter() - begin
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,220 @@
+# KISWebSocket 수신 루프와 on_result 사이의 제한 크기 큐.
+#
+# 수신 루프는 메시지를 큐에 넣기만 하고, 워커가 최대 batch_size 건씩 꺼내 on_result 를 호출한다.
+# 그래서 느린 소비자(DataFrame 처리, 텔레그램 전송 등)가 있어도 수신이 멈추지 않는다.
+# 큐가 가득 찼을 때의 정책:
+#   block       수신 루프가 자리가 날 때까지 기다린다 (유실 없음)
+#   drop_oldest 가장 오래된 메시지를 버린다
+#   conflate    같은 (tr_id, 종목) 메시지는 최신 것만 남긴다. 새 종목이 들어올 자리가 없으면 가장 오래된 것을 버린다.
+#               여러 종목이 섞인 메시지는 합치지 않는다.
+#
+#   dispatcher = WSDispatcher(policy=POLICY_CONFLATE)
+#   KISWebSocket(api_url, tick_store=store, dispatcher=dispatcher).start(on_result)
+#   dispatcher.stats()   # depth, dropped, lag_max ...
+#
+# tick_store 는 큐에 넣기 전에 수신 루프에서 기록하므로 drop_oldest/conflate 로 버려진 체결도 남는다.
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+POLICY_BLOCK = "block"
+POLICY_DROP_OLDEST = "drop_oldest"
+POLICY_CONFLATE = "conflate"
+POLICIES = (POLICY_BLOCK, POLICY_DROP_OLDEST, POLICY_CONFLATE)
+
+
+def _get_symbol(result):
+    # 실시간 TR 의 첫 컬럼은 종목코드이다. 종목이 하나가 아니면 None
+    if len(result) == 0:
+        return None
+    if isinstance(result, pd.DataFrame):
+        symbols = result.iloc[:, 0].to_numpy()
+    else:
+        symbols = result[result.columns[0]]
+    if len(symbols) > 1 and (symbols != symbols[0]).any():
+        return None
+    return symbols[0]
+
+
+class WSDispatcher:
+    """on_result 를 수신 루프와 분리해 워커에서 micro-batch 로 호출한다.
+
+    Args:
+        maxsize (int): 큐에 쌓아 둘 최대 메시지 수
+        policy (str): 큐가 가득 찼을 때의 정책 (POLICIES)
+        batch_size (int): 워커가 한 번에 꺼내는 최대 메시지 수
+        workers (int): 워커 수. 2 이상이면 배치 사이의 순서는 보장하지 않는다.
+        threaded (bool): 동기 on_result 를 스레드에서 호출한다. False 이면 이벤트 루프에서 바로 호출한다.
+            on_result 가 코루틴 함수이면 워커 태스크에서 await 한다.
+        batched (bool): True 이면 on_result(items) 로 배치의 (ws, tr_id, result, data_map) 목록을 한 번에 넘긴다.
+    """
+
+    def __init__(self, maxsize: int = 10_000, policy: str = POLICY_BLOCK, batch_size: int = 100,
+                 workers: int = 1, threaded: bool = True, batched: bool = False):
+        if policy not in POLICIES:
+            raise ValueError(f"policy must be one of {POLICIES}")
+        if maxsize < 1 or batch_size < 1 or workers < 1:
+            raise ValueError("maxsize, batch_size and workers must be positive.")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self.workers = workers
+        self.threaded = threaded
+        self.batched = batched
+
+        # 키 -> (넣은 시각, 메시지). conflate 는 (tr_id, 종목), 나머지는 일련번호가 키이다.
+        self._items = OrderedDict()
+        self._seq = 0
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._busy = 0
+        self._tasks = []
+        self.on_result = None
+
+        self.enqueued = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.conflated = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self._lag_sum = 0.0
+        self._taken = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _get_key(self, tr_id, result):
+        if self.policy == POLICY_CONFLATE:
+            symbol = _get_symbol(result)
+            if symbol is not None:
+                return tr_id, symbol
+        self._seq += 1
+        return self._seq
+
+    async def put(self, ws, tr_id, result, data_map):
+        """수신 루프에서 호출한다. block 정책에서만 자리가 날 때까지 기다린다."""
+        key = self._get_key(tr_id, result)
+        if key in self._items:
+            # 자리와 처음 넣은 시각은 그대로 두고 최신 메시지로 바꾼다
+            self._items[key] = (self._items[key][0], (ws, tr_id, result, data_map))
+            self.conflated += 1
+            return
+
+        while len(self._items) >= self.maxsize:
+            if self.policy == POLICY_BLOCK:
+                self._not_full.clear()
+                await self._not_full.wait()
+            else:
+                self._items.popitem(last=False)
+                self.dropped += 1
+
+        self._items[key] = (time.monotonic(), (ws, tr_id, result, data_map))
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, len(self._items))
+        self._not_empty.set()
+
+    def _take(self) -> list:
+        now = time.monotonic()
+        batch = []
+        while self._items and len(batch) < self.batch_size:
+            _, (enqueued_at, item) = self._items.popitem(last=False)
+            lag = now - enqueued_at
+            if not batch:
+                # 배치의 첫 메시지가 가장 오래 기다렸다
+                self.lag_last = lag
+                self.lag_max = max(self.lag_max, lag)
+            self._lag_sum += lag
+            self._taken += 1
+            batch.append(item)
+        self._not_full.set()
+        return batch
+
+    def _deliver(self, batch):
+        if self.batched:
+            self.on_result(batch)
+        else:
+            for item in batch:
+                self.on_result(*item)
+
+    async def _worker(self):
+        while True:
+            while not self._items:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            batch = self._take()
+            self._busy += 1
+            try:
+                if asyncio.iscoroutinefunction(self.on_result):
+                    if self.batched:
+                        await self.on_result(batch)
+                    else:
+                        for item in batch:
+                            await self.on_result(*item)
+                elif self.threaded:
+                    await asyncio.to_thread(self._deliver, batch)
+                else:
+                    self._deliver(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.errors += 1
+                self.failed += len(batch)
+                logger.exception("on_result failed.")
+            else:
+                self.delivered += len(batch)
+            finally:
+                self._busy -= 1
+
+    def start(self, on_result):
+        """실행 중인 이벤트 루프에 워커를 띄운다."""
+        if self.running:
+            raise RuntimeError("WSDispatcher is already running.")
+        self.on_result = on_result
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain: bool = True, timeout: float = 5.0):
+        """drain 이면 남은 메시지를 timeout 초까지 전달한 뒤 워커를 멈춘다."""
+        deadline = time.monotonic() + timeout
+        while drain and (self._items or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._items:
+            logger.warning(f"WSDispatcher stopped with {len(self._items)} undelivered messages.")
+
+    def stats(self) -> dict:
+        """큐 길이와 지연(초). lag 는 큐에 넣은 뒤 워커가 꺼낼 때까지의 시간이다.
+
+        failed 는 on_result 가 예외를 낸 배치의 메시지 수, errors 는 그 배치 수이다.
+        """
+        return {
+            "depth": len(self._items),
+            "max_depth": self.max_depth,
+            "maxsize": self.maxsize,
+            "policy": self.policy,
+            "enqueued": self.enqueued,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "conflated": self.conflated,
+            "errors": self.errors,
+            "lag_last": self.lag_last,
+            "lag_max": self.lag_max,
+            "lag_avg": self._lag_sum / self._taken if self._taken else 0.0,
+        }
@@ -0,0 +1,226 @@
+# 여러 접속키/연결에 실시간 구독을 나누는 KISWebSocket 풀.
+#
+# KIS 는 접속키(연결) 하나에 ka.MAX_SUBSCRIPTIONS(40) 개까지 구독할 수 있다. 풀은 kis_devlp.yaml 의 앱키마다
+# 접속키를 받아(ka.get_approval_keys) 연결을 하나씩 만들고 구독을 가장 적게 가진 연결에 나눈다.
+# 모든 연결은 한 이벤트 루프에서 따로 수신하고, 받은 메시지는 하나의 dispatcher(kis_ws_dispatch.WSDispatcher)에
+# 받은 순서대로 모아 워커가 on_result 에 전달한다.
+#
+#   pool = KISWebSocketPool("/tryitout")
+#   pool.subscribe(ccnl_krx, ["005930", "000660", ...])   # 40개 넘게 가능
+#   pool.start(on_result)
+#
+# 재시도를 다 써서 끝난 연결의 구독은 여유가 있는 다른 연결로 옮기고, 자리가 없으면 다음에 연결되는 쪽에 맡긴다.
+# 끊긴 연결은 reconnect_grace_seconds 동안 재연결을 기다렸다가 돌아오지 않을 때만 옮긴다.
+# dispatcher 를 주지 않으면 기본 설정(block 정책, 10,000건)의 WSDispatcher 를 쓴다.
+import asyncio
+import logging
+import math
+
+import downloader.kis_auth as ka
+import downloader.kis_ws_dispatch as kis_ws_dispatch
+
+
+logger = logging.getLogger(__name__)
+
+
+class KISWebSocketPool:
+    """KISWebSocket 과 같은 subscribe/start(on_result) 를 가지면서 구독 수 제한이 연결 수만큼 늘어난다.
+
+    Args:
+        approval_keys (list): 연결별 접속키. 없으면 시작할 때 ka.get_approval_keys() 로 받는다.
+        connections (int): 사용할 연결 수. 기본은 구독을 모두 담을 수 있는 최소 연결 수.
+            처리량을 늘리려면 접속키 수까지 늘릴 수 있다.
+        dispatcher (kis_ws_dispatch.WSDispatcher): 모든 연결이 함께 쓰는 수신 큐. 없으면 기본 설정으로 만든다.
+        reconnect_grace_seconds (float): 끊긴 연결의 구독을 옮기기 전에 재연결을 기다리는 시간.
+            잠깐 끊긴 연결이 빈 채로 돌아오고 다른 연결만 가득 차는 것을 막는다.
+    """
+
+    def __init__(self, api_url: str, approval_keys: list = None, connections: int = None,
+                 max_subscriptions: int = ka.MAX_SUBSCRIPTIONS, max_retries: int = 3,
+                 result_type: str = ka.RESULT_FRAME, tick_store=None, dispatcher=None,
+                 reconnect_grace_seconds: float = 10.0):
+        self.api_url = api_url
+        self.approval_keys = approval_keys
+        self.connections = connections
+        self.max_subscriptions = max_subscriptions
+        self.max_retries = max_retries
+        self.result_type = result_type
+        self.tick_store = tick_store
+        self.reconnect_grace_seconds = reconnect_grace_seconds
+        # 느린 on_result 가 수신을 막거나 메시지가 끝없이 쌓이지 않도록 항상 제한 크기 큐를 거친다
+        self.dispatcher = dispatcher if dispatcher is not None else kis_ws_dispatch.WSDispatcher()
+
+        # (request 이름, 종목) -> (request, kwargs). 연결에 배정되지 않은 구독은 _pending 에 남는다.
+        self._subscriptions = {}
+        self._pending = []
+        self._assignments = {}
+        self.sockets = []
+        self._stopping = False
+        # 연결 번호 -> 재연결을 기다렸다가 구독을 옮기는 task
+        self._grace_tasks = {}
+
+    def subscribe(self, request, data: list | str, kwargs: dict = None):
+        for item in [data] if isinstance(data, str) else data:
+            key = (request.__name__, item)
+            if key not in self._subscriptions:
+                self._subscriptions[key] = (request, kwargs)
+                self._pending.append(key)
+
+    def get_assignments(self) -> dict:
+        """{연결 번호: 구독 (request 이름, 종목) 목록}"""
+        assignments = {i: [] for i in range(len(self.sockets))}
+        for key, index in self._assignments.items():
+            assignments[index].append(key)
+        return assignments
+
+    def _create_sockets(self):
+        if not self.approval_keys:
+            raise ValueError("No approval key for KISWebSocketPool.")
+        needed = max(1, math.ceil(len(self._subscriptions) / self.max_subscriptions))
+        count = max(needed, self.connections or 0)
+        if needed > len(self.approval_keys):
+            raise ValueError(
+                f"{len(self._subscriptions)} subscriptions need {needed} connections, "
+                f"but there are only {len(self.approval_keys)} approval keys. Add app keys to kis_devlp.yaml."
+            )
+        count = min(count, len(self.approval_keys))
+        self.sockets = [
+            ka.KISWebSocket(self.api_url, self.max_retries, self.result_type, self.tick_store,
+                            approval_key=approval_key, open_map={}, data_map={}, dispatcher=self.dispatcher)
+            for approval_key in self.approval_keys[:count]
+        ]
+        for socket in self.sockets:
+            socket.on_connect = self._on_connect
+            socket.on_disconnect = self._on_disconnect
+
+    def _index(self, socket) -> int:
+        return self.sockets.index(socket)
+
+    def _assign_pending(self, sockets) -> list:
+        """_pending 구독을 sockets 중 배정된 구독이 가장 적은 연결에 배정한다. open_map 은 바꾸지 않는다.
+
+        Returns:
+            list: 새로 배정된 구독이 있는 연결의 (socket, 구독 목록)
+        """
+        counts = {self._index(socket): 0 for socket in sockets}
+        for index in self._assignments.values():
+            if index in counts:
+                counts[index] += 1
+        assigned = {index: [] for index in counts}
+        while self._pending and counts:
+            index = min(counts, key=counts.get)
+            if counts[index] >= self.max_subscriptions:
+                break
+            key = self._pending.pop(0)
+            self._assignments[key] = index
+            counts[index] += 1
+            assigned[index].append(key)
+        if self._pending:
+            logger.warning(f"{len(self._pending)} subscriptions are waiting for a free connection.")
+        return [(socket, assigned[self._index(socket)]) for socket in sockets if assigned[self._index(socket)]]
+
+    def _assign_initial(self):
+        # 연결 전이므로 open_map 에만 넣고, 각 연결이 처음 연결할 때 보낸다
+        for socket, keys in self._assign_pending(self.sockets):
+            for key in keys:
+                request, kwargs = self._subscriptions[key]
+                ka.add_open_map(key[0], request, key[1], kwargs, target=socket.open_map)
+
+    async def _send_subscriptions(self, socket, keys):
+        # 연결의 lock 안에서 open_map 을 바꾸고 보내므로 재연결 중의 재구독과 겹치지 않는다
+        for key in keys:
+            request, kwargs = self._subscriptions[key]
+            await socket.apply_subscriptions(request, add=key[1], kwargs=kwargs)
+
+    async def _move_subscriptions(self, socket) -> tuple[int, int]:
+        """socket 의 구독을 연결되어 있는 다른 연결로 옮긴다. 자리가 없는 구독은 다음에 연결되는 쪽에 맡긴다.
+
+        Returns:
+            tuple: (옮긴 구독 수, socket 에 있던 구독 수)
+        """
+        index = self._index(socket)
+        keys = [key for key, assigned in self._assignments.items() if assigned == index]
+        for key in keys:
+            del self._assignments[key]
+        socket.open_map.clear()
+        self._pending.extend(keys)
+        live = [s for s in self.sockets if s is not socket and s.ws is not None]
+        moved = 0
+        for target, target_keys in self._assign_pending(live):
+            await self._send_subscriptions(target, target_keys)
+            moved += len(target_keys)
+        return moved, len(keys)
+
+    def _cancel_grace(self, socket):
+        task = self._grace_tasks.pop(self._index(socket), None)
+        if task is not None:
+            task.cancel()
+
+    async def _on_connect(self, socket):
+        # 기한 안에 다시 연결되었으면 구독은 open_map 대로 다시 보냈으므로 옮기지 않는다
+        self._cancel_grace(socket)
+        # 다른 연결이 끊기거나 끝나서 자리를 기다리던 구독을 새로 연결된 쪽에 배정한다
+        for target, keys in self._assign_pending([socket]):
+            await self._send_subscriptions(target, keys)
+
+    async def _on_disconnect(self, socket):
+        if self._stopping:
+            return
+        logger.info(f"Websocket connection #{self._index(socket)} closed. "
+                    f"Waiting {self.reconnect_grace_seconds}s for reconnection.")
+        self._cancel_grace(socket)
+        self._grace_tasks[self._index(socket)] = asyncio.create_task(self._move_after_grace(socket))
+
+    async def _move_after_grace(self, socket):
+        await asyncio.sleep(self.reconnect_grace_seconds)
+        # 옮기는 도중에는 _on_connect 가 취소하지 않도록 먼저 뺀다
+        self._grace_tasks.pop(self._index(socket), None)
+        if socket.ws is not None or self._stopping:
+            return
+        moved, total = await self._move_subscriptions(socket)
+        logger.info(f"Websocket connection #{self._index(socket)} did not reconnect. "
+                    f"Moved {moved} of {total} subscriptions.")
+
+    async def _rebalance_finished(self, socket):
+        """재시도를 다 써서 끝난 연결의 구독을 연결되어 있는 다른 연결로 옮긴다."""
+        self._cancel_grace(socket)
+        moved, total = await self._move_subscriptions(socket)
+        logger.warning(f"Websocket connection #{self._index(socket)} gave up. Moved {moved} of {total} subscriptions.")
+
+    async def _run_socket(self, socket, on_result):
+        try:
+            await socket.run(on_result, self._result_all_data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Websocket connection #{self._index(socket)} failed: {e}")
+        await self._rebalance_finished(socket)
+
+    async def run(self, on_result, result_all_data: bool = False):
+        """모든 연결을 실행하고, dispatcher 의 워커가 받은 순서대로 on_result(ws, tr_id, result, data_map) 를 호출한다."""
+        if self.approval_keys is None:
+            self.approval_keys = await asyncio.to_thread(ka.get_approval_keys, ka._svr)
+        self._result_all_data = result_all_data
+        self._stopping = False
+        self._create_sockets()
+        self._assign_initial()
+
+        self.dispatcher.start(on_result)
+        tasks = [asyncio.create_task(self._run_socket(socket, on_result)) for socket in self.sockets]
+        try:
+            await asyncio.wait(tasks)
+        finally:
+            # 종료할 때 끊기는 연결의 구독은 옮기지 않는다
+            self._stopping = True
+            tasks += list(self._grace_tasks.values())
+            self._grace_tasks.clear()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self.dispatcher.stop()
+
+    def start(self, on_result, result_all_data: bool = False):
+        try:
+            asyncio.run(self.run(on_result, result_all_data))
+        except KeyboardInterrupt:
+            print("Closing by KeyboardInterrupt")
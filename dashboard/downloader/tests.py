@@ -1,8 +1,11 @@
+import os
+import tempfile
 import unittest
 import requests
 import urllib3
 import rich
 import pandas as pd
+from datetime import datetime, timedelta
 
 
 class TestECOSDownloader(unittest.TestCase):
@@ -59,4 +62,1104 @@ class TestECOSDownloader(unittest.TestCase):
         from downloader.ecos import get_m2_money_supply
         df = get_m2_money_supply('20250101', '20251031')
         rich.print(df)
-        self.assertTrue(not df.empty)
\ No newline at end of file
+        self.assertTrue(not df.empty)
+
+
+class TestSQLiteDatabase(unittest.TestCase):
+    def setUp(self):
+        from downloader.database import SQLiteDatabase
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.database = SQLiteDatabase(os.path.join(self.tmp_dir.name, 'test.db'))
+        self.database.write(lambda conn: conn.execute('CREATE TABLE t (x INTEGER)'))
+        self.database.write(lambda conn: conn.execute('INSERT INTO t VALUES (1)'))
+
+    def tearDown(self):
+        self.database.close()
+        self.tmp_dir.cleanup()
+
+    def select(self, conn):
+        return [row[0] for row in conn.execute('SELECT x FROM t ORDER BY x')]
+
+    def test_read_is_not_blocked_by_write(self):
+        import threading
+        started, release = threading.Event(), threading.Event()
+
+        def slow_write(conn):
+            conn.execute('INSERT INTO t VALUES (2)')
+            started.set()
+            release.wait(5)
+
+        writer = threading.Thread(target=self.database.write, args=(slow_write,))
+        writer.start()
+        try:
+            self.assertTrue(started.wait(5))
+            # 쓰기 트랜잭션이 열려 있는 동안에도 WAL 읽기 연결은 커밋된 데이터를 바로 읽는다
+            self.assertEqual(self.database.read(self.select), [1])
+        finally:
+            release.set()
+            writer.join()
+        self.assertEqual(self.database.read(self.select), [1, 2])
+
+    def test_locked_read_is_retried(self):
+        import sqlite3
+        from downloader import database
+        attempts = []
+
+        def locked_once(conn):
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise sqlite3.OperationalError('database is locked')
+            return self.select(conn)
+
+        self.assertEqual(self.database.read(locked_once), [1])
+        self.assertEqual(len(attempts), 2)
+
+        def always_locked(conn):
+            attempts.append(1)
+            raise sqlite3.OperationalError('database is locked')
+
+        attempts.clear()
+        with self.assertRaises(sqlite3.OperationalError):
+            self.database.read(always_locked)
+        self.assertEqual(len(attempts), database.LOCKED_RETRIES + 1)
+
+
+class TestFrameCache(unittest.TestCase):
+    def test_new_version_reloads_frame(self):
+        from downloader.cache import FrameCache
+        cache = FrameCache()
+        loads = []
+
+        def load(value):
+            loads.append(value)
+            return pd.DataFrame({'x': [value]})
+
+        self.assertEqual(cache.get_or_load('key', 1, load, 1)['x'].iloc[0], 1)
+        self.assertEqual(cache.get_or_load('key', 1, load, 2)['x'].iloc[0], 1)
+        # 새 데이터가 기록되어 버전이 오르면 다시 읽는다
+        self.assertEqual(cache.get_or_load('key', 2, load, 3)['x'].iloc[0], 3)
+        self.assertEqual(loads, [1, 3])
+        self.assertEqual(cache.stats()['entries'], 1)
+
+    def test_least_recently_used_frame_is_evicted(self):
+        from downloader.cache import FrameCache, estimate_nbytes
+        frames = {key: pd.DataFrame({'x': range(100)}) for key in 'abc'}
+        nbytes = estimate_nbytes(frames['a'])
+        cache = FrameCache(max_bytes=nbytes * 2)
+        cache.put('a', 1, frames['a'])
+        cache.put('b', 1, frames['b'])
+        self.assertIs(cache.get('a', 1), frames['a'])
+        cache.put('c', 1, frames['c'])
+
+        self.assertIsNone(cache.get('b', 1))
+        self.assertIs(cache.get('a', 1), frames['a'])
+        self.assertIs(cache.get('c', 1), frames['c'])
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.stats()['bytes'], nbytes * 2)
+
+
+class TestKISDatabase(unittest.TestCase):
+    def setUp(self):
+        import downloader.kis as kis
+        self.kis = kis
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.orig_database_file_name = kis.kis_database_file_name
+        kis.kis_database_file_name = os.path.join(self.tmp_dir.name, 'kis.db')
+
+    def tearDown(self):
+        self.kis.kis_database_file_name = self.orig_database_file_name
+        self.tmp_dir.cleanup()
+
+    def test_write_database_is_idempotent(self):
+        table_name = 'domestic_stock_075_investor_daily_by_market'
+        df = pd.DataFrame({
+            'stck_bsop_date': ['20250102', '20250103', '20250103'],
+            'bstp_nmix_prpr': ['2400.1', '2410.2', '2420.3'],
+        })
+        self.assertEqual(self.kis.write_database(table_name, df, 'stck_bsop_date'), (2, 0))
+        self.assertEqual(self.kis.write_database(table_name, df, 'stck_bsop_date'), (0, 2))
+
+        df_all = self.kis.read_database(table_name, 'stck_bsop_date')
+        self.assertEqual(len(df_all), 2)
+        self.assertEqual(df_all['bstp_nmix_prpr'].iloc[0], 2420.3)
+        self.assertEqual(self.kis.get_latest_date_of_database_table(table_name, 'stck_bsop_date'), '20250103')
+        # 스케줄러는 모든 데이터셋이 마지막 영업일까지 있어야 그날을 받은 것으로 본다
+        self.assertEqual(self.kis.get_outdated_kis_tables('20250103'), [])
+        self.assertEqual(self.kis.get_outdated_kis_tables('20250106'), [table_name])
+
+    def test_upsert_updates_table_metadata(self):
+        table_name = 'domestic_stock_075_investor_daily_by_market'
+        database = self.kis.get_kis_database()
+        df = pd.DataFrame({'stck_bsop_date': ['20250102', '20250103'], 'bstp_nmix_prpr': ['2400.1', '2410.2']})
+        self.kis.write_database(table_name, df, 'stck_bsop_date')
+        metadata = database.read(self.kis.read_table_metadata, table_name)
+        self.assertEqual((metadata['min_date'], metadata['max_date'], metadata['version']), ('20250102', '20250103', 1))
+
+        # 기존 범위에 합치고, 같은 키를 다시 기록해도 버전을 올려 캐시를 무효화한다
+        df = pd.DataFrame({'stck_bsop_date': ['20241230', '20250103'], 'bstp_nmix_prpr': ['2390.0', '2411.0']})
+        self.kis.write_database(table_name, df, 'stck_bsop_date')
+        metadata = database.read(self.kis.read_table_metadata, table_name)
+        self.assertEqual((metadata['min_date'], metadata['max_date'], metadata['version']), ('20241230', '20250103', 2))
+        self.assertEqual(self.kis.get_data_version(table_name), 2)
+
+    def test_latest_date_raises_unless_table_is_missing(self):
+        import sqlite3
+        table_name = 'domestic_stock_075_investor_daily_by_market'
+        self.assertEqual(self.kis.get_latest_date_of_database_table(table_name, 'stck_bsop_date'),
+                         self.kis.DEFAULT_LASTEST_DATE)
+
+        def locked(conn, table_name):
+            raise sqlite3.OperationalError('database is locked')
+
+        read_table_metadata, self.kis.read_table_metadata = self.kis.read_table_metadata, locked
+        try:
+            # 잠긴 DB 를 빈 테이블로 보고 1983년부터 다시 받지 않는다
+            with self.assertRaises(sqlite3.OperationalError):
+                self.kis.get_latest_date_of_database_table(table_name, 'stck_bsop_date')
+            self.assertEqual(self.kis.get_outdated_kis_tables('20250103'), [table_name])
+        finally:
+            self.kis.read_table_metadata = read_table_metadata
+
+    def test_without_rowid_table_is_migrated_to_dataset_key(self):
+        import sqlite3
+        table_name = 'domestic_stock_075_investor_daily_by_market'
+        with sqlite3.connect(self.kis.kis_database_file_name) as conn:
+            conn.execute(f'CREATE TABLE "{table_name}" ("stck_bsop_date" TEXT, "bstp_nmix_prpr" REAL, '
+                         'PRIMARY KEY ("stck_bsop_date", "bstp_nmix_prpr")) WITHOUT ROWID')
+            conn.executemany(f'INSERT INTO "{table_name}" VALUES (?, ?)', [('20250102', 2400.1), ('20250102', 2400.2)])
+        conn.close()
+
+        df = pd.DataFrame({'stck_bsop_date': ['20250103'], 'bstp_nmix_prpr': ['2410.2']})
+        self.kis.write_database(table_name, df, 'stck_bsop_date')
+        df_all = self.kis.read_database(table_name, 'stck_bsop_date')
+        self.assertEqual(len(df_all), 2)
+        self.assertEqual(self.kis.get_latest_date_of_database_table(table_name, 'stck_bsop_date'), '20250103')
+
+    def test_parquet_backend_reads_history_written_before_switch(self):
+        from concurrent.futures import ThreadPoolExecutor
+        from downloader import columnar
+        table_name = 'domestic_stock_075_investor_daily_by_market'
+        df = pd.DataFrame({'stck_bsop_date': ['20231228', '20250102'], 'bstp_nmix_prpr': ['2600.1', '2400.1']})
+        self.kis.write_database(table_name, df, 'stck_bsop_date')
+
+        orig = self.kis.KIS_STORAGE_BACKEND, self.kis.columnar_data_dir, columnar.COMPACT_FILE_COUNT
+        self.kis.KIS_STORAGE_BACKEND = 'parquet'
+        self.kis.columnar_data_dir = os.path.join(self.tmp_dir.name, 'columnar')
+        columnar.COMPACT_FILE_COUNT = 2
+        try:
+            # 같은 테이블을 동시에 기록해도 파티션을 한 번에 하나만 합친다
+            pages = [pd.DataFrame({'stck_bsop_date': [f'202501{d:02d}'], 'bstp_nmix_prpr': ['1.0']}) for d in range(6, 16)]
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda page: self.kis.write_database(table_name, page, 'stck_bsop_date'), pages))
+            df_all = self.kis.read_database_uncached(table_name, 'stck_bsop_date')
+        finally:
+            self.kis.KIS_STORAGE_BACKEND, self.kis.columnar_data_dir, columnar.COMPACT_FILE_COUNT = orig
+        self.assertEqual(len(df_all), 12)
+        self.assertIn('20231228', set(df_all['stck_bsop_date'].dt.strftime('%Y%m%d')))
+
+    def test_parquet_period_without_partition_is_empty(self):
+        table_name = 'domestic_stock_075_investor_daily_by_market'
+        df = pd.DataFrame({'stck_bsop_date': ['20231227', '20231228'], 'bstp_nmix_prpr': ['2600.1', '2610.2']})
+        orig = self.kis.KIS_STORAGE_BACKEND, self.kis.columnar_data_dir
+        self.kis.KIS_STORAGE_BACKEND = 'parquet'
+        self.kis.columnar_data_dir = os.path.join(self.tmp_dir.name, 'columnar')
+        try:
+            self.kis.write_database(table_name, df, 'stck_bsop_date')
+            # 2023년 파티션만 있을 때 최근 14일을 읽으면 컬럼은 있고 행은 없다
+            df_recent = self.kis.read_database_uncached(table_name, 'stck_bsop_date', '14d')
+            df_columns = self.kis.read_database_uncached(table_name, 'stck_bsop_date', '14d', columns=['bstp_nmix_prpr'])
+        finally:
+            self.kis.KIS_STORAGE_BACKEND, self.kis.columnar_data_dir = orig
+        self.assertTrue(df_recent.empty)
+        self.assertIn('bstp_nmix_prpr', df_recent.columns)
+        self.assertEqual(list(df_columns.columns), ['stck_bsop_date', 'bstp_nmix_prpr'])
+
+    def test_registered_dataset_is_paged_backward(self):
+        calls = []
+
+        def fetch(begin, oldest):
+            calls.append(begin)
+            dates = [d for d in ('20250103', '20250102', '20250101') if oldest <= d <= begin][:2]
+            return pd.DataFrame({'date': dates, 'value': [1.0] * len(dates)})
+
+        self.kis.KIS_DATASETS['test_dataset'] = {
+            'function': fetch,
+            'kwargs': {'begin': '{query_begin_date}', 'oldest': '{oldest_date}'},
+            'date_column': 'date',
+        }
+        try:
+            pages = self.kis.iter_query_pages('test_dataset', '20250103', '20250101')
+            self.assertEqual(self.kis.ingest_pages('test_dataset', 'date', pages), (3, 0))
+        finally:
+            del self.kis.KIS_DATASETS['test_dataset']
+        self.assertEqual(calls, ['20250103', '20250101'])
+
+    def test_ingest_pages_raises_producer_error(self):
+        def pages():
+            yield pd.DataFrame({'date': ['20250102'], 'value': [1.0]})
+            raise ConnectionError('page 2 failed')
+
+        with self.assertRaises(ConnectionError):
+            self.kis.ingest_pages('test_dataset', 'date', pages())
+        # 실패 전에 받은 페이지는 기록되어 있다
+        self.assertEqual(self.kis.get_latest_date_of_database_table('test_dataset', 'date'), '20250102')
+
+    def test_ingest_pages_keeps_queue_bound(self):
+        import time
+        produced, written, lead = [0], [0], []
+
+        def pages():
+            for day in range(2, 12):
+                produced[0] += 1
+                lead.append(produced[0] - written[0])
+                yield pd.DataFrame({'date': [f'202501{day:02d}'], 'value': [1.0]})
+
+        def slow_write(table_name, df, column_name):
+            written[0] += 1
+            time.sleep(0.01)
+            return write_database(table_name, df, column_name)
+
+        write_database, self.kis.write_database = self.kis.write_database, slow_write
+        try:
+            self.assertEqual(self.kis.ingest_pages('test_dataset', 'date', pages(), queue_size=2), (10, 0))
+        finally:
+            self.kis.write_database = write_database
+        # 기록 중인 페이지, 큐의 페이지, 넣으려고 기다리는 페이지보다 앞서 받지 않는다
+        self.assertLessEqual(max(lead), 2 + 2)
+
+    def test_refresh_cadence_limits_queries(self):
+        from downloader.trading_calendar import get_calendar
+        calls = []
+
+        def fetch(begin, oldest):
+            # 마지막 영업일 데이터가 아직 나오지 않았다
+            calls.append(begin)
+            return pd.DataFrame({'date': [], 'value': []})
+
+        self.kis.KIS_DATASETS['test_dataset'] = {
+            'function': fetch,
+            'kwargs': {'begin': '{query_begin_date}', 'oldest': '{oldest_date}'},
+            'date_column': 'date',
+            'refresh_seconds': 3600,
+        }
+        trading_day = get_calendar().get_latest_closed_trading_day()
+        previous_day = get_calendar().get_previous_trading_day(trading_day)
+        self.kis.write_database('test_dataset', pd.DataFrame({'date': [previous_day], 'value': [1.0]}), 'date')
+        try:
+            self.assertIn('test_dataset', self.kis.get_outdated_kis_tables(trading_day, due_only=True))
+            self.assertEqual(self.kis.download_all_kis_data(['test_dataset']), {'test_dataset': 0})
+            self.assertEqual(len(calls), 1)
+
+            # refresh_seconds 안에는 다시 조회하지 않지만 그날 데이터가 없는 테이블로는 남는다
+            self.assertEqual(self.kis.download_all_kis_data(['test_dataset']), {})
+            self.assertEqual(self.kis.update_data('test_dataset'), 0)
+            self.assertEqual(len(calls), 1)
+            self.assertNotIn('test_dataset', self.kis.get_outdated_kis_tables(trading_day, due_only=True))
+            self.assertIn('test_dataset', self.kis.get_outdated_kis_tables(trading_day))
+
+            self.kis.update_data('test_dataset', force=True)
+            self.assertEqual(len(calls), 2)
+        finally:
+            del self.kis.KIS_DATASETS['test_dataset']
+            self.kis._last_refresh_time.pop('test_dataset', None)
+
+    def test_repair_fetches_only_missing_trading_days(self):
+        calls = []
+
+        def fetch(begin, oldest):
+            calls.append((oldest, begin))
+            dates = [d for d in ('20250109', '20250108', '20250107', '20250106', '20250103', '20250102') if oldest <= d <= begin]
+            return pd.DataFrame({'date': dates, 'value': [1.0] * len(dates)})
+
+        self.kis.KIS_DATASETS['test_dataset'] = {
+            'function': fetch,
+            'kwargs': {'begin': '{query_begin_date}', 'oldest': '{oldest_date}'},
+            'date_column': 'date',
+        }
+        try:
+            df = pd.DataFrame({'date': ['20250102', '20250106', '20250109'], 'value': [1.0] * 3})
+            self.kis.write_database('test_dataset', df, 'date')
+            # 20250103 은 받아 봤지만 비어있던 날이므로 다시 받지 않는다
+            self.kis.get_kis_database().write(self.kis.add_table_coverage, 'test_dataset', '20250102', '20250103')
+            self.assertEqual(self.kis.find_missing_trading_days('test_dataset'), ['20250107', '20250108'])
+            self.assertEqual(self.kis.repair_data('test_dataset'), (2, 0))
+        finally:
+            del self.kis.KIS_DATASETS['test_dataset']
+        self.assertEqual(calls, [('20250107', '20250108')])
+        self.assertEqual(self.kis.find_missing_trading_days('test_dataset', 'date'), [])
+        self.assertEqual(self.kis.get_kis_database().read(self.kis.read_table_coverage, 'test_dataset'),
+                         [('20250102', '20250103'), ('20250107', '20250108')])
+
+
+    def test_failed_backfill_window_is_resumed(self):
+        import downloader.kis_auth as ka
+        from downloader import kis_decode
+        calls, failures = [], ['20250104']
+
+        def fetch(begin, oldest):
+            calls.append(oldest)
+            if oldest in failures:
+                failures.remove(oldest)
+                # 초당 거래건수 초과는 빈 응답이 아니라 실패로 처리되어야 한다
+                kis_decode.decode_response(ka.APIRespError(500, 'EGW00201'), kis_decode.INVESTOR_DAILY_BY_MARKET.tr_id)
+            dates = [d for d in ('20250109', '20250108', '20250107', '20250106', '20250103', '20250102') if oldest <= d <= begin]
+            return pd.DataFrame({'date': dates, 'value': [1.0] * len(dates)})
+
+        self.kis.KIS_DATASETS['test_dataset'] = {
+            'function': fetch,
+            'kwargs': {'begin': '{query_begin_date}', 'oldest': '{oldest_date}'},
+            'date_column': 'date',
+        }
+        orig_checkpoint_dir = self.kis.backfill_checkpoint_dir
+        self.kis.backfill_checkpoint_dir = os.path.join(self.tmp_dir.name, 'backfill')
+        try:
+            self.assertEqual(self.kis.backfill_data('test_dataset', 'date', '20250101', '20250109',
+                                                    window_days=3, max_workers=1), (5, 0))
+            checkpoint = self.kis.load_backfill_checkpoint('test_dataset')
+            self.assertEqual(sorted(map(tuple, checkpoint['done'])), [('20250101', '20250103'), ('20250107', '20250109')])
+
+            # 다시 호출하면 실패한 구간만 받고 checkpoint 를 지운다
+            calls.clear()
+            self.assertEqual(self.kis.backfill_data('test_dataset', 'date', '20250101', '20250109',
+                                                    window_days=3, max_workers=1), (1, 0))
+            self.assertEqual(set(calls), {'20250104'})
+            self.assertIsNone(self.kis.load_backfill_checkpoint('test_dataset'))
+        finally:
+            self.kis.backfill_checkpoint_dir = orig_checkpoint_dir
+            del self.kis.KIS_DATASETS['test_dataset']
+
+    def test_coverage_stops_at_newest_returned_date(self):
+        def fetch(begin, oldest):
+            # 20250108 이후는 아직 나오지 않았다
+            dates = [d for d in ('20250107', '20250106') if oldest <= d <= begin]
+            return pd.DataFrame({'date': dates, 'value': [1.0] * len(dates)})
+
+        self.kis.KIS_DATASETS['test_dataset'] = {
+            'function': fetch,
+            'kwargs': {'begin': '{query_begin_date}', 'oldest': '{oldest_date}'},
+            'date_column': 'date',
+        }
+        try:
+            self.assertEqual(self.kis.ingest_window('test_dataset', 'date', '20250106', '20250110'), (2, 0))
+            self.assertEqual(self.kis.find_missing_trading_days('test_dataset', 'date', '20250106', '20250110'),
+                             ['20250108', '20250109', '20250110'])
+            # 달력에 휴장일이 없는 연도는 검사하지 않는다
+            self.assertEqual(self.kis.find_missing_trading_days('test_dataset', 'date', '20190101', '20190110'), [])
+        finally:
+            del self.kis.KIS_DATASETS['test_dataset']
+        self.assertEqual(self.kis.get_kis_database().read(self.kis.read_table_coverage, 'test_dataset'),
+                         [('20250106', '20250107')])
+
+    def test_coverage_starts_at_oldest_returned_date(self):
+        def fetch(begin, oldest):
+            # 20250109 보다 오래된 날은 돌려주지 않고 멈춘다
+            dates = [d for d in ('20250110', '20250109') if oldest <= d <= begin]
+            return pd.DataFrame({'date': dates, 'value': [1.0] * len(dates)})
+
+        self.kis.KIS_DATASETS['test_dataset'] = {
+            'function': fetch,
+            'kwargs': {'begin': '{query_begin_date}', 'oldest': '{oldest_date}'},
+            'date_column': 'date',
+        }
+        try:
+            self.assertEqual(self.kis.ingest_window('test_dataset', 'date', '20250101', '20250110'), (2, 0))
+            self.assertEqual(self.kis.get_kis_database().read(self.kis.read_table_coverage, 'test_dataset'),
+                             [('20250109', '20250110')])
+            # 받지 못한 날은 repair_data 가 다시 받을 수 있다
+            self.assertEqual(self.kis.find_missing_trading_days('test_dataset', 'date', '20250102', '20250110'),
+                             ['20250102', '20250103', '20250106', '20250107', '20250108'])
+        finally:
+            del self.kis.KIS_DATASETS['test_dataset']
+
+
+class TestKISTokenManager(unittest.TestCase):
+    def setUp(self):
+        import downloader.kis_auth as ka
+        self.ka = ka
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.token_path = os.path.join(self.tmp_dir.name, 'token.json')
+        self.issued = []
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def make_manager(self, token):
+        manager = self.ka.TokenManager('prod', token_path=self.token_path)
+
+        def issue():
+            self.issued.append(token)
+            return token, datetime.now() + timedelta(days=1)
+
+        manager._issue = issue
+        return manager
+
+    def test_token_is_shared_through_file(self):
+        first = self.make_manager('token-1')
+        second = self.make_manager('token-2')
+        self.assertEqual(first.get_token(), 'token-1')
+        # 두 번째 관리자(다른 프로세스)는 파일의 토큰을 사용하고 발급하지 않는다
+        self.assertEqual(second.get_token(), 'token-1')
+        self.assertEqual(self.issued, ['token-1'])
+
+    def test_expiring_token_is_refreshed(self):
+        manager = self.make_manager('token-2')
+        manager._write_file('token-1', datetime.now() + self.ka.TOKEN_REFRESH_MARGIN / 2)
+        self.assertEqual(manager.refresh(), 'token-2')
+        self.assertEqual(manager.get_token(), 'token-2')
+        self.assertEqual(self.issued, ['token-2'])
+
+
+class TestKISRateLimit(unittest.TestCase):
+    def test_shard_with_free_tokens_is_selected(self):
+        import downloader.kis_auth as ka
+        busy = ka.AppKeyShard(0, 'app0', 'sec0', None, ka.TokenBucket(2))
+        idle = ka.AppKeyShard(1, 'app1', 'sec1', None, ka.TokenBucket(2))
+        busy.rate_limiter.reserve()
+        busy.rate_limiter.reserve()
+        orig_shards = ka._shards
+        ka._shards = [busy, idle]
+        try:
+            self.assertIs(ka._select_shard(), idle)
+        finally:
+            ka._shards = orig_shards
+
+
+    def test_rate_halves_on_rate_limit_and_recovers_additively(self):
+        import json
+        import downloader.kis_auth as ka
+        from downloader import http_session
+
+        class TokenManager:
+            def get_token(self):
+                return 'token'
+
+        class Env:
+            my_url = 'https://example.invalid'
+
+        class Response:
+            status_code = 200
+            headers = {}
+
+            def __init__(self, body):
+                self.text = json.dumps(body)
+                self._body = body
+
+            def json(self):
+                return self._body
+
+        bucket = ka.TokenBucket(20, increase_step=1)
+        limited = {'rt_cd': '1', 'msg_cd': 'EGW00201', 'msg1': '초당 거래건수를 초과하였습니다.'}
+        ok = {'rt_cd': '0', 'msg_cd': 'MCA00000', 'msg1': '정상처리 되었습니다.', 'output': []}
+        responses = [Response(limited), Response(limited), Response(ok)]
+
+        orig = ka._TRENV, ka._getBaseHeader, ka._shards, http_session.get
+        ka._TRENV = Env()
+        ka._getBaseHeader = lambda: {}
+        ka._shards = [ka.AppKeyShard(0, 'app', 'sec', TokenManager(), bucket)]
+        http_session.get = lambda url, **kwargs: responses.pop(0)
+        try:
+            res = ka._url_fetch('/url', 'FHPTJ04040000', '', {})
+        finally:
+            ka._TRENV, ka._getBaseHeader, ka._shards, http_session.get = orig
+
+        # EGW00201 마다 절반으로 줄이고 (20 -> 10 -> 5), 정상 응답에 increase_step 만큼 되돌린다
+        self.assertTrue(res.isOK())
+        self.assertEqual(bucket.get_counters()['rate_limited'], 2)
+        self.assertEqual(bucket.rate, 6)
+        for _ in range(20):
+            bucket.on_success()
+        self.assertEqual(bucket.rate, 20)
+
+        bucket = ka.TokenBucket(1, min_rate=0.5)
+        bucket.on_rate_limited()
+        bucket.on_rate_limited()
+        self.assertEqual(bucket.rate, 0.5)
+
+
+class TestKISAsyncClient(unittest.TestCase):
+    def test_requests_run_concurrently_and_keep_order(self):
+        import asyncio
+        import json
+        from urllib.parse import parse_qs, urlsplit
+        import downloader.kis_auth as ka
+        from downloader import http_cache, kis_async
+        state = {'active': 0, 'max_active': 0}
+
+        class TokenManager:
+            def get_token(self):
+                return 'token'
+
+        class Env:
+            my_url = 'https://example.invalid'
+
+        class Headers:
+            def get_all(self):
+                return [('Content-Type', 'application/json'), ('Tr_cont', 'D')]
+
+        class Response:
+            def __init__(self, body):
+                self.code = 200
+                self.headers = Headers()
+                self.body = json.dumps(body).encode('utf-8')
+
+        class FakeAsyncHTTPClient:
+            def __init__(self, force_instance=False, max_clients=10):
+                self.max_clients = max_clients
+
+            async def fetch(self, request, raise_error=True):
+                page = int(parse_qs(urlsplit(request.url).query)['PAGE'][0])
+                state['active'] += 1
+                state['max_active'] = max(state['max_active'], state['active'])
+                # 나중에 보낸 요청이 먼저 끝나도 결과는 요청 순서대로 돌려준다
+                await asyncio.sleep(0.01 * (10 - page))
+                state['active'] -= 1
+                return Response({'rt_cd': '0', 'msg_cd': 'MCA00000', 'msg1': '', 'output': [{'page': page}]})
+
+            def close(self):
+                pass
+
+        async def fetch_all():
+            async with kis_async.KISAsyncClient(max_concurrency=4) as client:
+                return await asyncio.gather(*[
+                    client.url_fetch('/url', 'FHPTJ04040000', '', {'PAGE': str(page)}) for page in range(10)
+                ])
+
+        orig = (ka._TRENV, ka._getBaseHeader, ka._shards, kis_async.AsyncHTTPClient,
+                http_cache._cache, http_cache._cache_configured)
+        ka._TRENV = Env()
+        ka._getBaseHeader = lambda: {}
+        ka._shards = [ka.AppKeyShard(0, 'app', 'sec', TokenManager(), ka.TokenBucket(1000))]
+        kis_async.AsyncHTTPClient = FakeAsyncHTTPClient
+        http_cache._cache, http_cache._cache_configured = None, True
+        try:
+            results = asyncio.run(fetch_all())
+        finally:
+            (ka._TRENV, ka._getBaseHeader, ka._shards, kis_async.AsyncHTTPClient,
+             http_cache._cache, http_cache._cache_configured) = orig
+
+        self.assertTrue(all(res.isOK() for res in results))
+        self.assertEqual([res.getBody().output[0]['page'] for res in results], list(range(10)))
+        self.assertEqual(state['max_active'], 4)
+
+
+class TestKISDecode(unittest.TestCase):
+    def test_decode_records_types_schema_fields(self):
+        import numpy as np
+        from downloader.kis_decode import INVESTOR_DAILY_BY_MARKET, decode_records
+        records = [
+            {'stck_bsop_date': '20250103', 'bstp_nmix_prpr': '2410.2', 'frgn_ntby_qty': '', 'extra': 'a'},
+            {'stck_bsop_date': '20250102', 'bstp_nmix_prpr': '2400.1', 'frgn_ntby_qty': '-12', 'extra': 'b'},
+        ]
+        df = decode_records(records, INVESTOR_DAILY_BY_MARKET.get_fields())
+        self.assertEqual(list(df.columns), ['stck_bsop_date', 'bstp_nmix_prpr', 'frgn_ntby_qty', 'extra'])
+        self.assertEqual(df['bstp_nmix_prpr'].dtype, np.float64)
+        self.assertEqual(df['stck_bsop_date'].tolist(), ['20250103', '20250102'])
+        self.assertTrue(np.isnan(df['frgn_ntby_qty'].iloc[0]))
+        self.assertEqual(df['frgn_ntby_qty'].iloc[1], -12.0)
+        self.assertEqual(df['extra'].tolist(), ['a', 'b'])
+
+    def test_spec_index_path_matches_producer(self):
+        import importlib.util
+        from pathlib import Path
+        from downloader import kis_decode
+        datautil_path = Path(__file__).resolve().parents[2] / 'analysis' / 'kis' / 'datautil.py'
+        spec = importlib.util.spec_from_file_location('datautil', datautil_path)
+        datautil = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(datautil)
+        self.assertEqual(Path(kis_decode.SPEC_INDEX_FILE), datautil.SPEC_INDEX_PATH)
+
+        with self.assertLogs(kis_decode.logger, level='WARNING'):
+            self.assertEqual(kis_decode.load_spec_index(os.path.join(tempfile.gettempdir(), 'missing_spec_index.json')), 0)
+
+
+class TestKISContinuation(unittest.TestCase):
+    def test_iter_url_fetch_follows_continuation_keys(self):
+        from collections import namedtuple
+        import downloader.kis_auth as ka
+
+        Header = namedtuple('header', ['tr_cont'])
+        Body = namedtuple('body', ['rt_cd', 'ctx_area_fk100', 'ctx_area_nk100', 'output'])
+
+        class Response:
+            def __init__(self, tr_cont, nk, output):
+                self.header, self.body = Header(tr_cont), Body('0', 'fk', nk, output)
+
+            def isOK(self):
+                return True
+
+            def getHeader(self):
+                return self.header
+
+            def getBody(self):
+                return self.body
+
+        responses = [Response('M', 'page2', [1]), Response('F', 'page3', [2]), Response('D', '', [3])]
+        requests_sent = []
+
+        def fake_url_fetch(api_url, ptr_id, tr_cont, params, appendHeaders=None, postFlag=False):
+            requests_sent.append((tr_cont, dict(params)))
+            return responses[len(requests_sent) - 1]
+
+        orig_url_fetch = ka._url_fetch
+        ka._url_fetch = fake_url_fetch
+        try:
+            pages = list(ka.iter_url_fetch('/url', 'TR', {'CTX_AREA_FK100': '', 'CTX_AREA_NK100': ''}))
+        finally:
+            ka._url_fetch = orig_url_fetch
+
+        self.assertEqual([p.getBody().output for p in pages], [[1], [2], [3]])
+        self.assertEqual([tr_cont for tr_cont, _ in requests_sent], ['', 'N', 'N'])
+        self.assertEqual(requests_sent[1][1]['CTX_AREA_NK100'], 'page2')
+        self.assertEqual(requests_sent[2][1]['CTX_AREA_NK100'], 'page3')
+
+
+class TestKISWebSocketDecode(unittest.TestCase):
+    def test_multi_record_frame(self):
+        from downloader import kis_ws_decode
+        data_map = {'H0STCNT0': {'columns': kis_ws_decode.H0STCNT0_COLUMNS, 'encrypt': 'N'}}
+        values = [['005930' if i == 0 else str(i + n) for i in range(len(kis_ws_decode.H0STCNT0_COLUMNS))] for n in (0, 100)]
+        raw = '0|H0STCNT0|002|' + '^'.join(values[0] + values[1])
+
+        batch = kis_ws_decode.decode_frame(raw, data_map)
+        self.assertEqual(len(batch), 2)
+        self.assertEqual(list(batch['MKSC_SHRN_ISCD']), ['005930', '005930'])
+        self.assertEqual(list(batch['STCK_PRPR']), [2.0, 102.0])
+        self.assertEqual(list(kis_ws_decode.decode_frame(raw, data_map, typed=False).to_frame()['STCK_PRPR']), ['2', '102'])
+
+        # 잘린 레코드는 버리고 온전한 레코드만 남긴다
+        with self.assertLogs(kis_ws_decode.logger, level='WARNING'):
+            batch = kis_ws_decode.decode_frame(raw + '^extra', data_map)
+        self.assertEqual(list(batch['STCK_PRPR']), [2.0, 102.0])
+
+    def test_decryptor_matches_cbc(self):
+        from base64 import b64encode
+        from Crypto.Cipher import AES
+        from Crypto.Util.Padding import pad
+        from downloader import kis_ws_decode
+        key, iv = 'k' * 32, 'i' * 16
+        for text in ('a^b^c', '체결^' * 50):
+            cipher = AES.new(key.encode(), AES.MODE_CBC, iv.encode())
+            cipher_text = b64encode(cipher.encrypt(pad(text.encode(), AES.block_size)))
+            self.assertEqual(kis_ws_decode.get_decryptor('H0STCNI0', key, iv).decrypt(cipher_text), text)
+
+    def test_decryptor_is_kept_per_connection_key(self):
+        from downloader import kis_ws_decode
+        # 연결마다 key/iv 가 다른 같은 tr_id 를 번갈아 받아도 다시 만들지 않는다
+        first = kis_ws_decode.get_decryptor('H0STCNI0', 'a' * 32, 'a' * 16)
+        second = kis_ws_decode.get_decryptor('H0STCNI0', 'b' * 32, 'b' * 16)
+        self.assertIsNot(first, second)
+        self.assertIs(kis_ws_decode.get_decryptor('H0STCNI0', 'a' * 32, 'a' * 16), first)
+        self.assertIs(kis_ws_decode.get_decryptor('H0STCNI0', 'b' * 32, 'b' * 16), second)
+
+
+class TestKISWebSocketPool(unittest.TestCase):
+    def test_subscriptions_are_split_across_connections(self):
+        import asyncio
+        import downloader.kis_auth as ka
+        from downloader.kis_ws_pool import KISWebSocketPool
+
+        def ccnl_krx(tr_type, tr_key):
+            return {'header': {'approval_key': 'global'}, 'body': {'input': {'tr_id': 'H0STCNT0', 'tr_key': tr_key}}}, ['MKSC_SHRN_ISCD']
+
+        class FakeWebSocket:
+            def __init__(self):
+                self.sent = []
+
+            async def send(self, message):
+                self.sent.append(message)
+
+        symbols = [f'{i:06d}' for i in range(90)]
+        pool = KISWebSocketPool('/tryitout', approval_keys=['key-0', 'key-1'])
+        pool.subscribe(ccnl_krx, symbols)
+        with self.assertRaises(ValueError):
+            pool._create_sockets()
+
+        pool.approval_keys = ['key-0', 'key-1', 'key-2', 'key-3']
+        pool._create_sockets()
+        pool._assign_initial()
+        self.assertEqual(len(pool.sockets), 3)
+        self.assertEqual([ka.count_subscriptions(s.open_map) for s in pool.sockets], [30, 30, 30])
+        self.assertEqual(ka.count_subscriptions(), 0)
+
+        # 끝난 연결의 구독은 연결되어 있는 다른 연결로 옮기고, 그 연결의 접속키로 보낸다
+        smart_sleep, ka._smartSleep = ka._smartSleep, 0
+        try:
+            pool.sockets[0].ws = FakeWebSocket()
+            asyncio.run(pool._rebalance_finished(pool.sockets[2]))
+            self.assertEqual([len(keys) for keys in pool.get_assignments().values()], [40, 30, 0])
+            self.assertEqual(len(pool._pending), 20)
+            self.assertEqual(len(pool.sockets[0].ws.sent), 10)
+            self.assertEqual(ka.count_subscriptions(pool.sockets[0].open_map), 40)
+            self.assertIn('"approval_key": "key-0"', pool.sockets[0].ws.sent[0])
+
+            pool.reconnect_grace_seconds = 0.01
+
+            async def disconnect(reconnect):
+                await pool._on_disconnect(pool.sockets[1])
+                if reconnect:
+                    pool.sockets[1].ws = FakeWebSocket()
+                    await pool._on_connect(pool.sockets[1])
+                await asyncio.sleep(0.05)
+
+            # 끊긴 연결이 기한 안에 돌아오지 않으면 구독을 옮기고, 옮길 자리가 없으면 다시 연결될 때 보낸다
+            asyncio.run(disconnect(reconnect=False))
+            self.assertEqual([len(keys) for keys in pool.get_assignments().values()], [40, 0, 0])
+            self.assertEqual(len(pool._pending), 50)
+            pool.sockets[1].ws = FakeWebSocket()
+            asyncio.run(pool._on_connect(pool.sockets[1]))
+            self.assertEqual([len(keys) for keys in pool.get_assignments().values()], [40, 40, 0])
+            self.assertEqual(len(pool._pending), 10)
+            self.assertEqual(len(pool.sockets[1].ws.sent), 40)
+            self.assertEqual(ka.count_subscriptions(pool.sockets[1].open_map), 40)
+
+            # 잠깐 끊겼다가 기한 안에 다시 연결되면 구독을 그대로 둔다
+            pool.sockets[1].ws = None
+            asyncio.run(disconnect(reconnect=True))
+        finally:
+            ka._smartSleep = smart_sleep
+        self.assertEqual([len(keys) for keys in pool.get_assignments().values()], [40, 40, 0])
+        self.assertEqual(len(pool._pending), 10)
+        self.assertEqual(ka.count_subscriptions(pool.sockets[1].open_map), 40)
+        # 재구독은 연결이 open_map 대로 보내고 풀은 다시 배정하지 않는다
+        self.assertEqual(pool.sockets[1].ws.sent, [])
+        self.assertEqual(pool._grace_tasks, {})
+
+
+class TestKISWebSocketSubscriptions(unittest.TestCase):
+    def test_live_subscription_diff(self):
+        import asyncio
+        import json
+        import downloader.kis_auth as ka
+
+        def ccnl_krx(tr_type, tr_key):
+            return {'header': {'tr_type': tr_type}, 'body': {'input': {'tr_id': 'H0STCNT0', 'tr_key': tr_key}}}, ['MKSC_SHRN_ISCD']
+
+        class FakeWebSocket:
+            def __init__(self):
+                self.sent = []
+
+            async def send(self, message):
+                message = json.loads(message)
+                self.sent.append((message['header']['tr_type'], message['body']['input']['tr_key']))
+
+        socket = ka.KISWebSocket('/tryitout', open_map={}, data_map={})
+        # 시작 전에는 open_map 만 바꾼다
+        socket.set_subscriptions(ccnl_krx, ['005930', '000660'])
+        socket.update_subscriptions(ccnl_krx, add='035420', remove='000660')
+        self.assertEqual(socket.open_map['ccnl_krx']['items'], ['005930', '035420'])
+
+        smart_sleep, ka._smartSleep = ka._smartSleep, 0
+        try:
+            socket.ws = FakeWebSocket()
+            added, removed = asyncio.run(socket.apply_subscriptions(ccnl_krx, ['035420', '000660']))
+            asyncio.run(socket.unsubscribe(socket.ws, ccnl_krx, '000660'))
+        finally:
+            ka._smartSleep = smart_sleep
+        self.assertEqual((added, removed), (['000660'], ['005930']))
+        self.assertEqual(socket.ws.sent, [('2', '005930'), ('1', '000660'), ('2', '000660')])
+        self.assertEqual(socket.open_map['ccnl_krx']['items'], ['035420'])
+
+
+    def test_retry_count_resets_only_after_healthy_session(self):
+        import asyncio
+        from collections import namedtuple
+        import downloader.kis_auth as ka
+        sessions = [['0|TEST|001|A^1'], []]
+        connects = []
+
+        class FakeConnection:
+            def __init__(self, messages):
+                self.messages = messages
+
+            async def __aenter__(self):
+                return self
+
+            async def __aexit__(self, *args):
+                return False
+
+            def __aiter__(self):
+                return self
+
+            async def __anext__(self):
+                if not self.messages:
+                    raise StopAsyncIteration
+                return self.messages.pop(0)
+
+        class FakeWebsockets:
+            @staticmethod
+            def connect(url):
+                connects.append(url)
+                return FakeConnection(sessions.pop(0) if sessions else [])
+
+        received = []
+        socket = ka.KISWebSocket('/tryitout', max_retries=1, result_type=ka.RESULT_BATCH, open_map={},
+                                 data_map={'TEST': {'columns': ['SYMBOL', 'PRICE'], 'encrypt': 'N'}})
+        orig = ka.websockets, ka._TRENV
+        ka.websockets = FakeWebsockets
+        ka._TRENV = namedtuple('TREnv', ['my_url_ws'])('ws://test')
+        try:
+            # 데이터를 받은 세션 뒤에는 다시 연결하고, 바로 끊긴 세션은 재시도 횟수를 쓴다
+            asyncio.run(socket.run(lambda ws, tr_id, result, dm: received.append(tr_id)))
+        finally:
+            ka.websockets, ka._TRENV = orig
+        self.assertEqual(len(connects), 2)
+        self.assertEqual(received, ['TEST'])
+        self.assertEqual(socket.retry_count, 1)
+
+        # run() 을 거치지 않고 수신 루프를 바로 실행해도 구독 lock 이 있다
+        socket = ka.KISWebSocket('/tryitout', max_retries=1, open_map={}, data_map={})
+        connected = []
+
+        async def on_connect(ws):
+            connected.append(ws)
+
+        socket.on_connect = on_connect
+        ka.websockets = FakeWebsockets
+        ka._TRENV = namedtuple('TREnv', ['my_url_ws'])('ws://test')
+        try:
+            asyncio.run(socket._KISWebSocket__runner())
+        finally:
+            ka.websockets, ka._TRENV = orig
+        self.assertEqual(len(connects), 3)
+        self.assertEqual(connected, [socket])
+
+
+class TestWSDispatcher(unittest.TestCase):
+    def batch(self, symbol, price):
+        from downloader.kis_ws_decode import decode_payload
+        return decode_payload('TEST', f'{symbol}^{price}', ['SYMBOL', 'PRICE'])
+
+    def test_overflow_policies(self):
+        import asyncio
+        from downloader.kis_ws_dispatch import WSDispatcher
+
+        async def fill(dispatcher, items):
+            for symbol, price in items:
+                await dispatcher.put(None, 'TEST', self.batch(symbol, price), {})
+            received = []
+            dispatcher.start(lambda items: received.extend((r['SYMBOL'][0], r['PRICE'][0]) for _, _, r, _ in items))
+            await dispatcher.stop()
+            return received
+
+        items = [('A', '1'), ('B', '1'), ('A', '2'), ('C', '1'), ('A', '3')]
+        dispatcher = WSDispatcher(maxsize=3, policy='drop_oldest', batched=True)
+        self.assertEqual(asyncio.run(fill(dispatcher, items)), [('A', '2'), ('C', '1'), ('A', '3')])
+        self.assertEqual(dispatcher.stats()['dropped'], 2)
+
+        dispatcher = WSDispatcher(maxsize=3, policy='conflate', batched=True)
+        self.assertEqual(asyncio.run(fill(dispatcher, items)), [('A', '3'), ('B', '1'), ('C', '1')])
+        self.assertEqual(dispatcher.stats()['conflated'], 2)
+
+    def test_conflate_keeps_multi_symbol_frames_and_counts_failures(self):
+        import asyncio
+        from downloader.kis_ws_decode import decode_payload
+        from downloader.kis_ws_dispatch import WSDispatcher
+
+        async def run(dispatcher, on_result, results):
+            for result in results:
+                await dispatcher.put(None, 'TEST', result, {})
+            dispatcher.start(on_result)
+            await dispatcher.stop()
+            return dispatcher.stats()
+
+        mixed = decode_payload('TEST', 'A^1^B^1', ['SYMBOL', 'PRICE'])
+        received = []
+        stats = asyncio.run(run(WSDispatcher(policy='conflate'), lambda ws, tr_id, r, dm: received.append(len(r)),
+                                [mixed, self.batch('A', '2'), self.batch('A', '3')]))
+        self.assertEqual(received, [2, 1])
+        self.assertEqual(stats['conflated'], 1)
+
+        def fail(ws, tr_id, result, dm):
+            raise RuntimeError('consumer failed')
+
+        with self.assertLogs('downloader.kis_ws_dispatch', level='ERROR'):
+            stats = asyncio.run(run(WSDispatcher(threaded=False), fail, [self.batch('A', '1')]))
+        self.assertEqual((stats['delivered'], stats['failed'], stats['errors']), (0, 1, 1))
+
+    def test_block_waits_for_slow_consumer(self):
+        import asyncio
+        import time
+        from downloader.kis_ws_dispatch import WSDispatcher
+        received = []
+
+        def on_result(ws, tr_id, result, dm):
+            time.sleep(0.01)
+            received.append(result['PRICE'][0])
+
+        async def run():
+            dispatcher = WSDispatcher(maxsize=2, batch_size=2)
+            dispatcher.start(on_result)
+            for price in range(10):
+                await dispatcher.put(None, 'TEST', self.batch('A', price), {})
+            await dispatcher.stop()
+            return dispatcher.stats()
+
+        stats = asyncio.run(run())
+        self.assertEqual(received, [str(price) for price in range(10)])
+        self.assertEqual((stats['dropped'], stats['delivered'], stats['depth']), (0, 10, 0))
+        self.assertLessEqual(stats['max_depth'], 2)
+
+
+class TestTickStore(unittest.TestCase):
+    def test_ring_buffer_window(self):
+        import numpy as np
+        from downloader.tick_store import TickStore, TickBuffer
+        store = TickStore(capacity=4, max_bytes=4 * 2 * 40 * 2)
+        times = np.datetime64('2025-01-02T09:00:00') + np.arange(6) * np.timedelta64(60, 's')
+        for i, t in enumerate(times):
+            store.append('005930', t, 100.0 + i, 1.0)
+
+        snapshot = store.snapshot('005930')
+        self.assertEqual(list(snapshot['price']), [102.0, 103.0, 104.0, 105.0])
+        # 복사하지 않은 view 이다
+        self.assertIsNotNone(snapshot['price'].base)
+        self.assertEqual(list(store.window('005930', minutes=2)['price']), [103.0, 104.0, 105.0])
+
+        # 메모리 상한을 넘으면 가장 오래 갱신되지 않은 종목을 버린다
+        store.extend('000660', {'time': times[:2], 'price': [1.0, 2.0], 'volume': [1.0, 1.0]})
+        store.extend('035420', {'time': times[:1], 'price': [1.0], 'volume': [1.0]})
+        self.assertEqual(store.symbols(), ['000660', '035420'])
+
+        buffer = TickBuffer(capacity=3)
+        buffer.extend({'time': times, 'price': np.arange(6.0), 'volume': np.ones(6)})
+        self.assertEqual(list(buffer.snapshot(2)['price']), [4.0, 5.0])
+
+    def test_append_websocket_batch(self):
+        import numpy as np
+        from downloader import kis_ws_decode
+        from downloader.tick_store import TickStore
+        columns = kis_ws_decode.H0STCNT0_COLUMNS
+        record = {name: '1' for name in columns}
+        records = []
+        for symbol, hour, price in (('005930', '090001', '70000'), ('000660', '090002', '180000'), ('005930', '090003', '70100')):
+            record.update(MKSC_SHRN_ISCD=symbol, STCK_CNTG_HOUR=hour, STCK_PRPR=price, BSOP_DATE='20250102')
+            records += [record[name] for name in columns]
+        batch = kis_ws_decode.decode_payload('H0STCNT0', '^'.join(records), columns)
+
+        store = TickStore(capacity=10)
+        self.assertEqual(store.append_result('H0STCNT0', batch), 3)
+        self.assertEqual(list(store.snapshot('005930')['price']), [70000.0, 70100.0])
+        self.assertEqual(str(store.snapshot('000660')['time'][0]), '2025-01-02T09:00:02')
+
+        # 문자열 그대로 온 값이 비어 있거나 시각이 깨져도 예외 없이 NaN 으로 두거나 건너뛴다
+        frame = kis_ws_decode.decode_payload('H0STCNT0', '^'.join(records), columns, typed=False).to_frame()
+        frame.loc[0, 'ASKP1'] = ''
+        frame.loc[1, 'STCK_CNTG_HOUR'] = ''
+        self.assertEqual(store.append_result('H0STCNT0', frame), 2)
+        self.assertTrue(np.isnan(store.snapshot('005930')['ask'][-2]))
+
+    def test_buffer_grows_lazily(self):
+        import numpy as np
+        from downloader.tick_store import TickStore, TickBuffer
+        buffer = TickBuffer(capacity=10, initial_capacity=2)
+        times = np.datetime64('2025-01-02T09:00:00') + np.arange(7) * np.timedelta64(1, 's')
+        for i, t in enumerate(times[:3]):
+            buffer.append(t, float(i), 1.0)
+        self.assertEqual(buffer.size, 4)
+        buffer.extend({'time': times[3:], 'price': np.arange(3.0, 7.0), 'volume': np.ones(4)})
+        self.assertEqual(buffer.size, 8)
+        self.assertEqual(list(buffer.snapshot()['price']), list(np.arange(7.0)))
+
+        # 종목을 만들 때 capacity 만큼 미리 잡지 않는다
+        store = TickStore(capacity=100_000)
+        for i in range(500):
+            store.append(f'{i:06d}', times[0], 1.0, 1.0)
+        self.assertEqual(store.stats()['symbols'], 500)
+        self.assertEqual(store.evictions, 0)
+
+
+class TestHTTPCache(unittest.TestCase):
+    def setUp(self):
+        from downloader import http_cache
+        self.http_cache = http_cache
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sent = []
+        http_cache.register_secret('ecos-key-1')
+        http_cache.register_secret('ecos-key-2')
+
+    def tearDown(self):
+        self.http_cache.configure('off')
+        self.tmp_dir.cleanup()
+
+    def send(self, method, url, **kwargs):
+        self.sent.append(url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'{"rows": [1, 2, 3]}'
+        response.headers['tr_cont'] = 'M'
+        return response
+
+    def test_record_and_replay(self):
+        url = 'https://ecos.bok.or.kr/api/StatisticSearch/{}/json/kr/1/10/731Y001/D/20200101/20200110/0000001'
+        self.http_cache.configure('record', self.tmp_dir.name)
+        self.http_cache.cached_request(self.send, 'GET', url.format('ecos-key-1'))
+
+        # API 키가 달라도 같은 요청이고, replay 모드에서는 보내지 않는다
+        self.http_cache.configure('replay', self.tmp_dir.name)
+        response = self.http_cache.cached_request(self.send, 'GET', url.format('ecos-key-2'))
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(response.json(), {'rows': [1, 2, 3]})
+        self.assertEqual(response.headers['TR_CONT'], 'M')
+        with self.assertRaises(self.http_cache.CacheMissError):
+            self.http_cache.cached_request(self.send, 'GET', url.format('ecos-key-1').replace('20200110', '20200111'))
+
+    def test_api_error_body_is_not_cached(self):
+        bodies = [b'{"RESULT": {"CODE": "INFO-200", "MESSAGE": "no data"}}', b'{"rt_cd": "1", "msg_cd": "EGW00201"}']
+        for body in bodies:
+            sent = []
+
+            def send(method, url, **kwargs):
+                sent.append(url)
+                response = requests.Response()
+                response.status_code = 200
+                response._content = body
+                return response
+
+            self.http_cache.configure('cache', self.tmp_dir.name)
+            url = 'https://host/uapi/quotations?FID_INPUT_DATE_1=20200102'
+            self.http_cache.cached_request(send, 'GET', url)
+            self.http_cache.cached_request(send, 'GET', url)
+            self.assertEqual(len(sent), 2)
+        self.assertIsNone(self.http_cache.get_api_error(b'{"rt_cd": "0", "output": []}'))
+
+    def test_endpoint_class(self):
+        def classify(url, params=None):
+            request = self.http_cache.normalize_request('GET', url, params)
+            return self.http_cache.classify_request(request, today=datetime(2025, 10, 1).date())
+
+        self.assertEqual(classify('https://host/uapi/quotations', {'FID_INPUT_DATE_1': '20250102', 'FID_INPUT_ISCD': '0001'}), 'history')
+        self.assertEqual(classify('https://host/api/StatisticSearch/k/json/kr/1/10/101Y006/M/202401/202509/BBHS00'), 'latest')
+        self.assertEqual(classify('https://host/api/StatisticTableList/k/json/kr/1/10/102Y004/'), 'default')
+        self.assertEqual(classify('https://host/oauth2/tokenP'), 'auth')
+        self.assertEqual(classify('https://host/uapi/domestic-stock/v1/quotations/inquire-price', {'FID_INPUT_ISCD': '005930'}), 'quote')
+
+    def test_post_and_auth_are_not_cached(self):
+        self.http_cache.configure('record', self.tmp_dir.name)
+        self.http_cache.cached_request(self.send, 'POST', 'https://host/uapi/domestic-stock/v1/trading/order-cash',
+                                       data='{"PDNO": "005930"}')
+        self.http_cache.cached_request(self.send, 'GET', 'https://host/oauth2/Approval')
+        self.assertEqual(self.http_cache.get_http_cache().stats()['stores'], 0)
+
+        # 날짜가 없는 KIS 조회는 cache 모드에서 매번 받는다
+        self.http_cache.configure('cache', self.tmp_dir.name)
+        url = 'https://host/uapi/domestic-stock/v1/quotations/inquire-price?FID_INPUT_ISCD=005930'
+        self.http_cache.cached_request(self.send, 'GET', url)
+        self.http_cache.cached_request(self.send, 'GET', url)
+        self.http_cache.cached_request(self.send, 'POST', url)
+        self.assertEqual(len(self.sent), 5)
+        self.assertEqual(self.http_cache.get_http_cache().stats()['hits'], 0)
+
+
+class TestTradingCalendar(unittest.TestCase):
+    def test_latest_closed_trading_day_skips_weekends_and_holidays(self):
+        import pendulum
+        from downloader.trading_calendar import TradingCalendar
+        calendar = TradingCalendar(holidays={'20250101': '신정'}, years=[2024, 2025])
+        # 2025-01-01 (수) 휴장, 2025-01-02 (목) 장중
+        now = pendulum.datetime(2025, 1, 2, 11, 0, tz='Asia/Seoul')
+        self.assertEqual(calendar.get_latest_closed_trading_day(now), '20241231')
+        self.assertEqual(calendar.get_latest_closed_trading_day(now.add(hours=6)), '20250102')
+        # 2025-01-04 (토)
+        self.assertEqual(calendar.get_latest_closed_trading_day(now.add(days=2)), '20250103')
+        self.assertFalse(calendar.has_new_data('20250103', now.add(days=2)))
+        self.assertEqual(calendar.count_trading_days('20241230', '20250105'), 4)
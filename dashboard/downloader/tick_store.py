@@ -0,0 +1,293 @@
+# 실시간 체결 데이터를 종목별 원형 버퍼(numpy 배열)에 보관한다.
+#
+# 컬럼마다 2 * size 길이 배열에 같은 값을 i 와 i + size 두 곳에 쓴다. 그래서 최근 n(<= size)건은
+# 언제나 [head + size - n, head + size) 로 이어져 있고, 창(window)을 복사 없이 view 로 돌려줄 수 있다.
+# 배열은 INITIAL_CAPACITY 건으로 시작해 capacity 까지 두 배씩 늘리므로 체결이 적은 종목은 메모리를 적게 쓴다.
+#
+#   store = get_tick_store()
+#   KISWebSocket(api_url, result_type=RESULT_BATCH, tick_store=store).start(on_result)
+#   store.window('005930', minutes=5)['price']
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from config import config
+
+
+logger = logging.getLogger(__name__)
+
+
+TICK_DTYPES = {
+    'time': 'datetime64[s]',
+    'price': np.float64,
+    'volume': np.float64,
+    'bid': np.float64,
+    'ask': np.float64,
+}
+TICK_COLUMNS = list(TICK_DTYPES)
+# 한 건을 저장하는 데 드는 바이트 수 (두 번 쓰므로 실제 배열 크기는 두 배)
+TICK_ITEMSIZE = sum(np.dtype(dtype).itemsize for dtype in TICK_DTYPES.values())
+
+# 종목별 최대 보관 건수와 전체 메모리 상한. 꽉 찬 종목 하나가 2 * 20,000 * 40 B = 1.6 MB 이므로
+# 모든 종목이 꽉 차도 300 종목 넘게 들어간다.
+DEFAULT_CAPACITY = 20_000
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# 종목별로 처음 잡는 건수
+INITIAL_CAPACITY = 1_024
+
+# 실시간 TR 별 {tick 컬럼: TR 컬럼}. date + time 으로 체결 시각을 만든다.
+TICK_FIELDS = {
+    'H0STCNT0': {
+        'symbol': 'MKSC_SHRN_ISCD',
+        'date': 'BSOP_DATE',
+        'time': 'STCK_CNTG_HOUR',
+        'price': 'STCK_PRPR',
+        'volume': 'CNTG_VOL',
+        'bid': 'BIDP1',
+        'ask': 'ASKP1',
+    },
+}
+
+
+def _to_float(values) -> np.ndarray:
+    try:
+        return np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        # 빈 문자열 등 숫자가 아닌 값은 NaN 으로 둔다
+        return pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').to_numpy(dtype=np.float64)
+
+
+def _to_times(dates, hours) -> np.ndarray:
+    dates = np.asarray(dates, dtype=object)
+    hours = np.asarray(hours, dtype=object)
+    try:
+        return np.array([f'{d[:4]}-{d[4:6]}-{d[6:8]}T{h[:2]}:{h[2:4]}:{h[4:6]}' for d, h in zip(dates, hours)],
+                        dtype='datetime64[s]')
+    except (TypeError, ValueError):
+        # 읽을 수 없는 시각은 NaT 로 둔다
+        stamps = pd.Series(dates, dtype=object).astype(str) + pd.Series(hours, dtype=object).astype(str)
+        return pd.to_datetime(stamps, format='%Y%m%d%H%M%S', errors='coerce').to_numpy(dtype='datetime64[s]')
+
+
+class TickBuffer:
+    """종목 하나의 원형 버퍼. append 는 O(1)(배치는 O(배치 크기))이고 snapshot 은 복사하지 않는다."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, initial_capacity=INITIAL_CAPACITY):
+        self.capacity = capacity
+        self.count = 0
+        # 지금 잡아 둔 건수. capacity 에 닿기 전에는 한 바퀴 돌지 않으므로 데이터는 [0, count) 에 있다.
+        self.size = min(capacity, initial_capacity)
+        self._columns = {name: np.zeros(2 * self.size, dtype=dtype) for name, dtype in TICK_DTYPES.items()}
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self._columns.values())
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def _reserve(self, n) -> int:
+        """n 건을 더 쓸 자리를 만든다. 늘어난 바이트 수를 반환한다."""
+        if self.count + n <= self.size or self.size >= self.capacity:
+            return 0
+        before = self.nbytes
+        size = min(self.capacity, max(2 * self.size, self.count + n))
+        for name, column in self._columns.items():
+            grown = np.zeros(2 * size, dtype=column.dtype)
+            grown[:self.count] = grown[size:size + self.count] = column[:self.count]
+            self._columns[name] = grown
+        self.size = size
+        return self.nbytes - before
+
+    def append(self, time, price, volume, bid=np.nan, ask=np.nan) -> int:
+        values = {'time': time, 'price': price, 'volume': volume, 'bid': bid, 'ask': ask}
+        with self._lock:
+            grown = self._reserve(1)
+            i = self.count % self.size
+            for name, column in self._columns.items():
+                column[i] = column[i + self.size] = values[name]
+            self.count += 1
+        return grown
+
+    def extend(self, columns: dict) -> int:
+        """{컬럼: 배열} 여러 건을 한 번에 추가한다. 없는 컬럼은 NaN
+
+        Returns:
+            int: 배열을 늘리느라 더 쓴 바이트 수
+        """
+        n = len(columns['time'])
+        if n == 0:
+            return 0
+        with self._lock:
+            grown = self._reserve(n)
+            # size 보다 많으면 마지막 size 건만 남는다
+            skip = max(0, n - self.size)
+            positions = (self.count + skip + np.arange(n - skip)) % self.size
+            for name, column in self._columns.items():
+                values = columns.get(name)
+                values = np.nan if values is None else np.asarray(values)[skip:]
+                column[positions] = values
+                column[positions + self.size] = values
+            self.count += n
+        return grown
+
+    def snapshot(self, n=None) -> dict:
+        """최근 n 건(기본: 전부)의 {컬럼: view}. 시간 순이다.
+
+        view 는 버퍼를 직접 가리키므로 그 뒤로 배열이 늘어나거나 size - n 건 넘게 추가되면 최신 값이 아니다.
+        오래 보관하려면 복사한다.
+        """
+        with self._lock:
+            n = len(self) if n is None else min(n, len(self))
+            end = self.count % self.size + self.size
+            return {name: column[end - n:end] for name, column in self._columns.items()}
+
+
+class TickStore:
+    """종목별 TickBuffer. 종목이 늘어 max_bytes 를 넘으면 가장 오래 갱신되지 않은 종목을 버린다."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_bytes=DEFAULT_MAX_BYTES):
+        if 2 * capacity * TICK_ITEMSIZE > max_bytes:
+            raise ValueError(f"capacity {capacity} does not fit max_bytes {max_bytes}.")
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self._buffers = OrderedDict()
+        self._lock = threading.Lock()
+        self._nbytes = 0
+        self.evictions = 0
+
+    def _evict(self, keep):
+        # self._lock 안에서 호출한다. 메모리 상한 아래로 내려갈 때까지 가장 오래 갱신되지 않은 종목을 버린다
+        while self._nbytes > self.max_bytes and len(self._buffers) > 1:
+            evicted = next(iter(self._buffers))
+            if evicted == keep:
+                self._buffers.move_to_end(evicted)
+                continue
+            self._nbytes -= self._buffers.pop(evicted).nbytes
+            self.evictions += 1
+            logger.warning(f"Tick store is full. Dropped ticks of {evicted}.")
+
+    def get_buffer(self, symbol, create=False) -> TickBuffer | None:
+        with self._lock:
+            buffer = self._buffers.get(symbol)
+            if buffer is not None:
+                self._buffers.move_to_end(symbol)
+                return buffer
+            if not create:
+                return None
+            buffer = self._buffers[symbol] = TickBuffer(self.capacity)
+            self._nbytes += buffer.nbytes
+            self._evict(symbol)
+            return buffer
+
+    def _grown(self, symbol, nbytes):
+        if nbytes:
+            with self._lock:
+                self._nbytes += nbytes
+                self._evict(symbol)
+
+    def append(self, symbol, time, price, volume, bid=np.nan, ask=np.nan):
+        self._grown(symbol, self.get_buffer(symbol, create=True).append(time, price, volume, bid, ask))
+
+    def extend(self, symbol, columns: dict):
+        self._grown(symbol, self.get_buffer(symbol, create=True).extend(columns))
+
+    def append_result(self, tr_id, result) -> int:
+        """KISWebSocket 의 실시간 데이터(WSBatch 또는 DataFrame)를 종목별로 추가한다. TICK_FIELDS 에 없는 TR 은 무시한다.
+
+        수신 루프에서 호출되므로 예외를 내지 않는다. 숫자가 아닌 값은 NaN 으로 두고, 시각을 읽을 수 없는 레코드는 버린다.
+
+        Returns:
+            int: 추가한 건수
+        """
+        fields = TICK_FIELDS.get(tr_id)
+        if fields is None or len(result) == 0:
+            return 0
+        try:
+            return self._append_result(fields, result)
+        except Exception as e:
+            logger.warning(f"Failed to store ticks of {tr_id}: {e}")
+            return 0
+
+    def _append_result(self, fields, result) -> int:
+        symbols = np.asarray(result[fields['symbol']], dtype=object)
+        times = _to_times(result[fields['date']], result[fields['time']])
+        columns = {'time': times}
+        for name in ('price', 'volume', 'bid', 'ask'):
+            columns[name] = _to_float(result[fields[name]])
+
+        valid = ~np.isnat(times)
+        if not valid.all():
+            logger.warning(f"Skipped {(~valid).sum()} ticks with an invalid time.")
+            symbols = symbols[valid]
+            columns = {name: values[valid] for name, values in columns.items()}
+            if len(symbols) == 0:
+                return 0
+
+        if len(symbols) == 1 or (symbols == symbols[0]).all():
+            self.extend(symbols[0], columns)
+        else:
+            for symbol in pd.unique(symbols):
+                mask = symbols == symbol
+                self.extend(symbol, {name: values[mask] for name, values in columns.items()})
+        return len(symbols)
+
+    def snapshot(self, symbol, n=None) -> dict:
+        """최근 n 건의 {컬럼: view}. 종목이 없으면 빈 배열"""
+        buffer = self.get_buffer(symbol)
+        if buffer is None:
+            return {name: np.empty(0, dtype=dtype) for name, dtype in TICK_DTYPES.items()}
+        return buffer.snapshot(n)
+
+    def window(self, symbol, minutes=None, since=None) -> dict:
+        """마지막 체결 시각부터 minutes 분 전(또는 since) 이후의 {컬럼: view}"""
+        snapshot = self.snapshot(symbol)
+        if len(snapshot['time']) == 0:
+            return snapshot
+        if since is None:
+            since = snapshot['time'][-1] - np.timedelta64(int(minutes * 60), 's')
+        begin = np.searchsorted(snapshot['time'], np.datetime64(since, 's'), side='left')
+        return {name: column[begin:] for name, column in snapshot.items()}
+
+    def to_frame(self, symbol, minutes=None) -> pd.DataFrame:
+        """window 를 복사해 time 인덱스의 DataFrame 으로 반환한다."""
+        window = self.window(symbol, minutes) if minutes is not None else self.snapshot(symbol)
+        df = pd.DataFrame({name: column.copy() for name, column in window.items()})
+        return df.set_index('time')
+
+    def symbols(self) -> list:
+        with self._lock:
+            return list(self._buffers)
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffers = list(self._buffers.values())
+        return {
+            'symbols': len(buffers),
+            'ticks': sum(len(buffer) for buffer in buffers),
+            'nbytes': self._nbytes,
+            'max_bytes': self.max_bytes,
+            'evictions': self.evictions,
+        }
+
+
+_tick_store = None
+_tick_store_lock = threading.Lock()
+
+
+def get_tick_store() -> TickStore:
+    """프로세스 전체가 공유하는 TickStore. config.toml 의 [TICK_STORE] 로 크기를 정한다."""
+    global _tick_store
+    if _tick_store is None:
+        with _tick_store_lock:
+            if _tick_store is None:
+                store_config = config.get('TICK_STORE', {})
+                _tick_store = TickStore(
+                    capacity=store_config.get('CAPACITY_PER_SYMBOL', DEFAULT_CAPACITY),
+                    max_bytes=store_config.get('MAX_BYTES', DEFAULT_MAX_BYTES),
+                )
+    return _tick_store
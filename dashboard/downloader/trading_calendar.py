@@ -0,0 +1,162 @@
+# KRX 영업일 달력.
+#
+# 휴장일과 개장/폐장 시각은 이 모듈 옆의 krx_calendar.json 에 들어있다. 새 해의 휴장일은
+# data/calendar/krx_calendar.json 에 같은 형식으로 두면 코드를 바꾸지 않고 덮어쓸 수 있다.
+#
+#   {
+#       "holidays": {"YYYYMMDD": "이름", ...},
+#       "sessions": {"YYYYMMDD": ["HH:MM", "HH:MM"], ...},   # 개장/폐장 시각이 다른 날
+#       "years": [2024, ...]                                  # 휴장일이 모두 들어있는 연도
+#   }
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import pendulum
+
+
+logger = logging.getLogger(__name__)
+
+
+TIMEZONE = 'Asia/Seoul'
+BUNDLED_CALENDAR_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'krx_calendar.json')
+CALENDAR_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'calendar', 'krx_calendar.json')
+
+SESSION_OPEN = '09:00'
+SESSION_CLOSE = '15:30'
+# 폐장 후 일별 데이터가 조회되기까지 기다리는 시간(분)
+DATA_READY_DELAY_MINUTES = 10
+
+
+class TradingCalendar:
+    """날짜는 모두 'YYYYMMDD' 문자열이다."""
+
+    def __init__(self, holidays=None, sessions=None, years=None):
+        self.holidays = dict(holidays or {})
+        self.sessions = dict(sessions or {})
+        self.years = set(years or [])
+        self._warned_years = set()
+        self._holiday_array = np.array([_to_datetime64(date) for date in self.holidays], dtype='datetime64[D]')
+
+    @classmethod
+    def from_files(cls, *paths):
+        """뒤에 오는 파일이 앞 파일의 같은 날짜를 덮어쓴다. 없는 파일은 건너뛴다."""
+        holidays, sessions, years = {}, {}, set()
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            holidays.update(data.get('holidays', {}))
+            sessions.update(data.get('sessions', {}))
+            years.update(data.get('years', []))
+        return cls(holidays, sessions, years)
+
+    def _check_years(self, begin_date, end_date=None):
+        years = set(range(int(begin_date[:4]), int((end_date or begin_date)[:4]) + 1))
+        missing = sorted(years - self.years - self._warned_years) if self.years else []
+        if missing:
+            self._warned_years.update(missing)
+            logger.warning(f"KRX holidays of {missing[0]}-{missing[-1]} are not in the trading calendar. "
+                           "Only weekends are skipped for those years.")
+
+    def is_trading_day(self, date) -> bool:
+        self._check_years(date)
+        return pendulum.from_format(date, 'YYYYMMDD').day_of_week < 5 and date not in self.holidays
+
+    def get_session(self, date):
+        """(개장 시각, 폐장 시각) pendulum.DateTime. 휴장일이면 None"""
+        if not self.is_trading_day(date):
+            return None
+        open_time, close_time = self.sessions.get(date, (SESSION_OPEN, SESSION_CLOSE))
+        return (
+            pendulum.from_format(f'{date} {open_time}', 'YYYYMMDD HH:mm', tz=TIMEZONE),
+            pendulum.from_format(f'{date} {close_time}', 'YYYYMMDD HH:mm', tz=TIMEZONE),
+        )
+
+    def get_trading_days_array(self, begin_date, end_date) -> np.ndarray:
+        """[begin_date, end_date] 의 영업일을 정수(YYYYMMDD) 배열로 반환한다. 수십 년 구간도 밀리초 단위로 계산한다."""
+        if begin_date > end_date:
+            return np.array([], dtype=np.int64)
+        self._check_years(begin_date, end_date)
+        days = np.arange(_to_datetime64(begin_date), _to_datetime64(end_date) + 1, dtype='datetime64[D]')
+        days = days[np.is_busday(days, holidays=self._holiday_array)]
+        return to_int_dates(days)
+
+    def clamp_to_years(self, begin_date, end_date):
+        """[begin_date, end_date] 를 휴장일이 들어있는 연도 안으로 줄인다. 겹치지 않으면 None
+
+        years 가 없으면 그대로 돌려준다.
+        """
+        if not self.years:
+            return begin_date, end_date
+        begin_date = max(begin_date, f'{min(self.years)}0101')
+        end_date = min(end_date, f'{max(self.years)}1231')
+        return (begin_date, end_date) if begin_date <= end_date else None
+
+    def get_trading_days(self, begin_date, end_date) -> list:
+        """[begin_date, end_date] 의 영업일 목록"""
+        return [str(date) for date in self.get_trading_days_array(begin_date, end_date)]
+
+    def count_trading_days(self, begin_date, end_date) -> int:
+        return len(self.get_trading_days_array(begin_date, end_date))
+
+    def get_previous_trading_day(self, date) -> str:
+        """date 이전(date 제외)의 마지막 영업일"""
+        day = pendulum.from_format(date, 'YYYYMMDD').subtract(days=1)
+        while not self.is_trading_day(day.format('YYYYMMDD')):
+            day = day.subtract(days=1)
+        return day.format('YYYYMMDD')
+
+    def get_latest_trading_day(self, date=None) -> str:
+        """date(기본: 오늘) 이전(date 포함)의 마지막 영업일"""
+        date = date or pendulum.now(TIMEZONE).format('YYYYMMDD')
+        return date if self.is_trading_day(date) else self.get_previous_trading_day(date)
+
+    def get_latest_closed_trading_day(self, now=None) -> str:
+        """now(기본: 현재 시각)까지 장이 끝나고 일별 데이터가 나왔을 마지막 영업일"""
+        now = now or pendulum.now(TIMEZONE)
+        today = now.in_tz(TIMEZONE).format('YYYYMMDD')
+        session = self.get_session(today)
+        if session is not None and now >= session[1].add(minutes=DATA_READY_DELAY_MINUTES):
+            return today
+        return self.get_previous_trading_day(today)
+
+    def has_new_data(self, latest_stored_date, now=None) -> bool:
+        """latest_stored_date 이후에 새 일별 데이터가 있을 수 있으면 True"""
+        return latest_stored_date < self.get_latest_closed_trading_day(now)
+
+
+def _to_datetime64(date):
+    return np.datetime64(f'{date[:4]}-{date[4:6]}-{date[6:8]}', 'D')
+
+
+def to_int_dates(days) -> np.ndarray:
+    """datetime64[D] 배열을 정수(YYYYMMDD) 배열로 바꾼다."""
+    years = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    day_of_month = (days - days.astype('datetime64[M]')).astype(np.int64) + 1
+    return years * 10000 + months * 100 + day_of_month
+
+
+_calendar = None
+_calendar_lock = threading.Lock()
+
+
+def get_calendar() -> TradingCalendar:
+    global _calendar
+    if _calendar is None:
+        with _calendar_lock:
+            if _calendar is None:
+                _calendar = TradingCalendar.from_files(BUNDLED_CALENDAR_FILE, CALENDAR_FILE)
+    return _calendar
+
+
+def reload_calendar() -> TradingCalendar:
+    """CALENDAR_FILE 을 고친 뒤 다시 읽는다."""
+    global _calendar
+    with _calendar_lock:
+        _calendar = TradingCalendar.from_files(BUNDLED_CALENDAR_FILE, CALENDAR_FILE)
+    return _calendar
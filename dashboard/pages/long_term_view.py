@@ -1,11 +1,10 @@
-import sqlite3
 from typing import Tuple
 import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as st_components
 from config import COLUMN_KEY_DESC, DATE_PRESETS, DOWNLOAD_DATA_DIR, M2_ITEM_CODES, STOCK_MARKET_FUNDS_ITEM_CODES, save_settings, settings
 from downloader.kis import date_converter, download_data, update_or_read_database
-from downloader.ecos import get_exchange_rate, get_m2_money_supply, get_stock_market_funds
+from downloader.ecos import get_cached_ecos_data, get_exchange_rate, get_m2_money_supply, get_stock_market_funds
 import humanize
 
 from pages.short_term_view import draw_filtered_data, get_period, show_current_to_mean_ratio
@@ -44,14 +43,12 @@ def show_search_forms():
     save_settings()
     
     
-@st.cache_data
 def st_get_m2_money_supply(start_date:str, end_date:str) -> pd.DataFrame:
-    return get_m2_money_supply(start_date, end_date)
+    return get_cached_ecos_data(get_m2_money_supply, start_date, end_date)
 
 
-@st.cache_data
 def st_get_stock_market_funds(start_date, end_date):
-    return get_stock_market_funds(start_date, end_date)
+    return get_cached_ecos_data(get_stock_market_funds, start_date, end_date)
 
     
 def show_basic_statistics():
@@ -4,8 +4,8 @@ import streamlit as st
 import pandas as pd
 import streamlit.components.v1 as st_components
 from config import COLUMN_KEY_DESC, DATE_PRESETS, DOWNLOAD_DATA_DIR, save_settings, settings
-from downloader.kis import download_data
-from downloader.ecos import get_exchange_rate, get_kospi_stat, get_m2_money_supply
+from downloader.kis import read_database
+from downloader.ecos import get_cached_ecos_data, get_exchange_rate, get_kospi_stat, get_m2_money_supply
 import humanize
 import altair as alt
 import plotly.graph_objects as go
@@ -34,9 +34,9 @@ def get_period(period_key) -> Tuple[str, str]:
         return start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d')
 
 
-@st.cache_data
-def load_data(dataset):
-    df = download_data(dataset, 'stck_bsop_date')
+def load_data(dataset, period_key):
+    # KIS API 조회는 scheduler.py 가 한다. 페이지는 다시 그릴 때마다 저장된 데이터만 캐시를 거쳐 읽는다.
+    df = read_database(dataset, 'stck_bsop_date', period_key)
 
     return df
 
@@ -235,7 +235,10 @@ def load_stock_market_dataset():
         st.header(dataset, divider=True)
         st.markdown(get_dataset_description(dataset))
         
-        df = load_data(dataset)
+        df = load_data(dataset, st.session_state.selected_period)
+        if df.empty:
+            st.info("저장된 데이터가 없습니다. scheduler.py 가 KIS API 에서 받아 오면 표시됩니다.")
+            continue
 
         st.subheader("Data Analysis")
         analyze_data(df, dataset)
@@ -284,21 +287,21 @@ def show_stock_market_forms():
     save_settings()
     
     
-def st_get_exchange_rate(start_date:str, end_date:str) -> Tuple[pd.DataFrame, str]:
+def _with_timestamp(function, start_date:str, end_date:str) -> Tuple[pd.DataFrame, str]:
     now = pd.Timestamp.now('Asia/Seoul')
-    return get_exchange_rate(start_date, end_date), now.isoformat()
+    return function(start_date, end_date), now.isoformat()
+
+
+def st_get_exchange_rate(start_date:str, end_date:str) -> Tuple[pd.DataFrame, str]:
+    return get_cached_ecos_data(_with_timestamp, get_exchange_rate, start_date, end_date)
     
     
-@st.cache_data
 def st_get_m2_money_supply(start_date:str, end_date:str) -> Tuple[pd.DataFrame, str]:
-    now = pd.Timestamp.now('Asia/Seoul')
-    return get_m2_money_supply(start_date, end_date), now.isoformat()
+    return get_cached_ecos_data(_with_timestamp, get_m2_money_supply, start_date, end_date)
 
     
-@st.cache_data
 def st_get_kospi_stat(start_date:str, end_date:str) -> Tuple[pd.DataFrame, str]:
-    now = pd.Timestamp.now('Asia/Seoul')
-    return get_kospi_stat(start_date, end_date), now.isoformat()
+    return get_cached_ecos_data(_with_timestamp, get_kospi_stat, start_date, end_date)
 
 
 def show_basic_statistics():
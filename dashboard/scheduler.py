@@ -3,10 +3,15 @@ from pathlib import Path
 import threading
 import time
 import schedule
-from downloader.kis import download_all_kis_data, init_auth
+from downloader.kis import download_all_kis_data, get_outdated_kis_tables, repair_all_kis_data
+from downloader.trading_calendar import get_calendar
 from rich import print
 
 
+# 모든 데이터셋을 받아 둔 마지막 영업일. 다음 영업일 장이 끝나기 전까지는 KIS API 를 조회하지 않는다.
+_last_synced_trading_day = None
+
+
 # 1. 주기적으로 실행할 작업 함수 정의
 def scheduled_kis_job():
     """백그라운드에서 실행될 작업. Streamlit UI와 독립적입니다."""
@@ -14,10 +19,26 @@ def scheduled_kis_job():
     # Streamlit의 session_state에 직접 접근하려면 추가적인 고려가 필요하지만,
     # 여기서는 독립적인 작업을 수행한다고 가정합니다.
     print(f"✅ 백그라운드 작업 실행: {current_time}")
-    
-    init_auth()
-    
-    download_all_kis_data()
+
+    global _last_synced_trading_day
+    trading_day = get_calendar().get_latest_closed_trading_day()
+    if trading_day == _last_synced_trading_day:
+        print(f"새 데이터 없음 (마지막 영업일 {trading_day})")
+        return
+
+    # 인증과 토큰 갱신은 kis_auth 의 TokenManager 가 처리한다.
+    # 그날 데이터가 없고 데이터셋의 refresh_seconds 가 지난 테이블만 조회한다.
+    due = get_outdated_kis_tables(trading_day, due_only=True)
+    if due:
+        download_all_kis_data(due)
+    # 영업일인데 비어있는 날만 다시 받는다
+    repair_all_kis_data()
+    # KIS 가 아직 그날 데이터를 내지 않았으면 다음 실행에서 다시 받는다
+    outdated = get_outdated_kis_tables(trading_day)
+    if outdated:
+        print(f"{trading_day} 데이터가 아직 없는 테이블: {outdated}")
+    else:
+        _last_synced_trading_day = trading_day
     
 
 # 2. schedule.run_pending()을 반복적으로 실행할 함수